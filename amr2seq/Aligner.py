@@ -62,6 +62,7 @@ class Aligner():
     neg_prefix = ['dis','un','im','in']
     plural_suffix = ['s']
     fuzzy_max_len = 4 # maximum prefix match between string
+    pattern_cache_size = 10000 # compiled entity patterns kept across sentences
     special_morph_table = {'see':['saw','sighted'],
                            'be-located-at':['is','was','were'],
                            'possible':['able','could','can','may','might','perhaps'],
@@ -117,6 +118,9 @@ class Aligner():
         self.align_type = align_type
         self.verbose = verbose
         self.concept_patterns = self._compile_regex_rule(Aligner.concept_lex_rule)
+        self.pattern_cache = {}
+        self.offset_sent = None
+        self.offset_index = None
         
     @staticmethod
     def readJAMRAlignment(amr,JAMR_alignment):
@@ -217,6 +221,16 @@ class Aligner():
         regexstr = '|'.join('(?P<%s>%s)' % (name,rule) for name,rule in rules)
         return re.compile(regexstr,re.IGNORECASE)
 
+    def _compile_pattern(self,regexstr):
+        """case-insensitive pattern for regexstr, compiled once across sentences"""
+        pattern = self.pattern_cache.get(regexstr)
+        if pattern is None:
+            if len(self.pattern_cache) >= Aligner.pattern_cache_size:
+                self.pattern_cache.clear()
+            pattern = re.compile(regexstr,re.IGNORECASE)
+            self.pattern_cache[regexstr] = pattern
+        return pattern
+
     def span_align2(self,sentence,amr):
         sent = sentence[:]
         alignment = defaultdict(list)
@@ -272,7 +286,7 @@ class Aligner():
                 if rule_type == 'NameEntity':
                     NE_items = [v[0] for k,v in amr[matched_variable].items()]
                     #spans = [(j,len(NEStr)) for j in range(len(sent_list)) if sent_list[j:j+len(NEStr)] == NEStr]
-                    NE_pattern = re.compile("\s".join(NE_items),re.IGNORECASE)
+                    NE_pattern = self._compile_pattern("\s".join(NE_items))
 
                     '''
                     m = name_re.match(sent)
@@ -300,7 +314,7 @@ class Aligner():
                             # other modifier
                             pass
                     if quantity and unit:
-                        TEMP_pattern = re.compile('(%s|%s)\s+(%s)s?' % (quantity,english_number(int(quantity)),unit),re.IGNORECASE)
+                        TEMP_pattern = self._compile_pattern('(%s|%s)\s+(%s)s?' % (quantity,english_number(int(quantity)),unit))
                         TEMP_items = [quantity,unit_node]
                     else:
                         missing = ''
@@ -405,7 +419,7 @@ class Aligner():
                 update = True
                 if rule_type == "NameEntity":
                     NE_items = [v[0] for k,v in amr[cur].items()]
-                    NE_pattern = re.compile(r"\s".join(NE_items),re.IGNORECASE)
+                    NE_pattern = self._compile_pattern(r"\s".join(NE_items))
                     
                     start,end = self._search_sent(NE_pattern,sent,tokens)
                     assert end-start == len(NE_items)
@@ -425,7 +439,7 @@ class Aligner():
                         else:
                             pass
                     if quantity and unit:
-                        QTY_pattern = re.compile('(%s|%s)\s+(%s)s?' % (quantity,english_number(int(quantity)),unit),re.IGNORECASE)
+                        QTY_pattern = self._compile_pattern('(%s|%s)\s+(%s)s?' % (quantity,english_number(int(quantity)),unit))
                         QTY_items = [quantity,unit]
                         start,end = self._search_sent(QTY_pattern,sent,tokens)
                         assert end - start == len(QTY_items)
@@ -514,7 +528,7 @@ class Aligner():
             if rule_type == "NameEntity":
                 NE_items = [v[0] for k,v in amr[cur_var].items() if isinstance(v[0],StrLiteral)]
                 nep = r'%s|%s'%(r'\s'.join(NE_items),r'\s'.join(n[:4] if len(n) > 3 else n for n in NE_items))
-                NE_pattern = re.compile(nep,re.IGNORECASE)
+                NE_pattern = self._compile_pattern(nep)
                 
                 start,end = self._search_sent(NE_pattern,sent,tokens)
                 assert end-start == len(NE_items)
@@ -913,13 +927,13 @@ class Aligner():
         if m:                        
             items = m.group().split()
 
+            start = m.start()
             if m.group()[0] == ' ' and m.group()[-1] == ' ':
-                spans = [(tokens[i][0],tokens[i][0]+len(items)) for i in range(len(tokens)) \
-                         if (sum(map(lambda x:len(x[1])+1,tokens[:i]))-1,sum(map(lambda x:len(x[1])+1,tokens[:i]))-1+len(m.group())) == m.span()]
-            else:
-                spans = [(tokens[i][0],tokens[i][0]+len(items)) for i in range(len(tokens)) \
-                         if (sum(map(lambda x:len(x[1])+1,tokens[:i])),sum(map(lambda x:len(x[1])+1,tokens[:i]))+len(m.group())) == m.span()]
-            return spans[0]
+                start += 1
+            i = self._token_offsets(sent,tokens).get(start)
+            if i is None:
+                raise SearchException("WARNING:Matched span does not start at a token!")
+            return (tokens[i][0],tokens[i][0]+len(items))
         else:
             print pattern.pattern
             print sent
@@ -928,6 +942,19 @@ class Aligner():
             
             
                 
+    def _token_offsets(self,sent,tokens):
+        '''map from the character offset of each token in sent (the tokens joined
+           by single spaces) to its position in tokens, rebuilt only when sent changes
+        '''
+        if sent != self.offset_sent:
+            self.offset_index = {}
+            offset = 0
+            for i,(idx,token) in enumerate(tokens):
+                self.offset_index[offset] = i
+                offset += len(token)+1
+            self.offset_sent = sent
+        return self.offset_index
+
     def remove_aligned_concepts(self,cur_var,rel,child_var,var_list,triples):
         """remove childrens of aligned concepts"""
         #print triples
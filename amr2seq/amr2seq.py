@@ -3,18 +3,24 @@ categorize amr; generate linearized amr sequence
 '''
 import sys, os, re, codecs
 import string
+import multiprocessing
+import traceback
 import gflags
-from amr_graph import AMR
-from collections import OrderedDict, defaultdict
+from amr_graph import AMR, write_amrs
+from collections import OrderedDict, defaultdict, deque
+from itertools import izip_longest, islice
 #from constants import TOP,LBR,RBR,RET,SURF,CONST,END,VERB
 from constants import *
 from parser import ParserError
 from date_extraction import *
+from amr_cache import load_cached
 FLAGS=gflags.FLAGS
 gflags.DEFINE_string("version",'1.0','version for the sequence generated')
 gflags.DEFINE_integer("min_prd_freq",50,"threshold for filtering out predicates")
 gflags.DEFINE_integer("min_var_freq",50,"threshold for filtering out non predicate variables")
 gflags.DEFINE_string("seq_cat",'freq',"mode to output sequence category")
+gflags.DEFINE_boolean("amr_cache", True, "If to load parsed AMR graphs from the on-disk cache")
+gflags.DEFINE_string("amr_cache_dir", None, "directory of the parsed-AMR cache, defaults to the directory of the AMR file")
 class AMR_stats(object):
     def __init__(self):
         self.num_reentrancy = 0
@@ -600,6 +606,16 @@ def readAMR(amrfile_path):
 
     return (comment_list,amr_list)
 
+def parseAMR(amrfile_path):
+    comment_list, amr_list = readAMR(amrfile_path)
+    return (comment_list, [AMR.parse_string(amr_string) for amr_string in amr_list])
+
+def loadAMR(amrfile_path):
+    """comments and parsed graphs of an amr file, from the parsed-AMR cache if the file is unchanged"""
+    if FLAGS.amr_cache:
+        return load_cached(amrfile_path, 'amr', parseAMR, FLAGS.amr_cache_dir)
+    return parseAMR(amrfile_path)
+
 def amr2sequence(toks, amr_graphs, alignments, poss, out_seq_file, amr_stats):
     amr_seq = AMR_seq(stats=amr_stats)
     with open(out_seq_file, 'w') as outf:
@@ -610,24 +626,102 @@ def amr2sequence(toks, amr_graphs, alignments, poss, out_seq_file, amr_stats):
             seq = ' '.join(amr_seq.linearize_amr(instance))
             print >> outf, seq
 
-def sequence2amr(toks, lemmas, amrseqs, cate_to_repr, out_amr_file):
+def read_lines(path):
+    with open(path, 'r') as f:
+        for line in f:
+            yield line.strip()
+
+def parse_cate_map(line):
+    curr_map = {}
+    if line:
+        fields = line.split('##')
+        for map_tok in fields:
+            fs = map_tok.strip().split('++')
+            if len(fs) != 5:
+                raise ValueError('Malformed category map entry %r in line: %s' % (map_tok, line))
+            start = int(fs[1])
+            end = int(fs[2])
+            curr_map[fs[0]] = (start, end, fs[3], fs[4])
+    return curr_map
+
+def zip_streams(*streams):
+    """zip line streams of files that must have the same number of lines"""
+    missing = object()
+    for items in izip_longest(*streams, fillvalue=missing):
+        if missing in items:
+            raise ValueError('input files have different numbers of lines')
+        yield items
+
+def read_restore_inputs(tok_file, lemma_file, amrseq_file, map_file):
+    """yield (index, tokens, lemmas, amrseq, category map) of each sentence, reading the files in step"""
+    streams = zip_streams((line.split() for line in read_lines(tok_file)),
+                          (line.split() for line in read_lines(lemma_file)),
+                          read_lines(amrseq_file),
+                          (parse_cate_map(line) for line in read_lines(map_file)))
+    for i, (tok_seq, lemma_seq, amrseq, repr_map) in enumerate(streams):
+        yield (i, tok_seq, lemma_seq, amrseq, repr_map)
+
+def restore_chunk(chunk):
+    """
+    restore the amr graphs of a chunk of sentences from read_restore_inputs;
+    returns their Pennman strings, the progress lines and, if restoring failed,
+    the traceback, so that chunks restored in other processes are reported in
+    order and a failing worker does not leave the parent waiting
+    """
     amr_seq = AMR_seq()
+    buf = []
+    log = []
+    try:
+        for (i, tok_seq, lemma_seq, s, repr_map) in chunk:
+            log.append('No ' + str(i) + ':' + ' '.join(tok_seq))
+            restored_amr = amr_seq.restore_amr(tok_seq, lemma_seq, s, repr_map)
+            start = len(buf)
+            write_amrs([restored_amr], buf.append)
+            if any('NONE' in piece for piece in buf[start:]):
+                log.append(s)
+                log.append(str(repr_map))
+    except BaseException: # restore_amr exits on some malformed sequences
+        return ''.join(buf), log, traceback.format_exc()
+    return ''.join(buf), log, None
+
+#Apply func to every chunk, in num_jobs forked processes if num_jobs > 1, and yield
+#the results in chunk order; at most 2*num_jobs chunks are read ahead.
+def map_chunks(func, chunks, num_jobs):
+    if num_jobs <= 1:
+        for chunk in chunks:
+            yield func(chunk)
+        return
+    pool = multiprocessing.Pool(num_jobs)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(func, (chunk,)))
+            if len(pending) >= 2 * num_jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+def iter_chunks(items, chunk_size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def sequence2amr(instances, out_amr_file, num_jobs=1, chunk_size=32):
+    """restore the instances of read_restore_inputs and write their graphs to out_amr_file in input order"""
     with open(out_amr_file, 'w') as outf:
         print 'Restoring AMR graphs ...'
-        for i, (s, repr_map) in enumerate(zip(amrseqs, cate_to_repr)):
-            print 'No ' + str(i) + ':' + ' '.join(toks[i])
-            #print repr_map
-            restored_amr = amr_seq.restore_amr(toks[i], lemmas[i], s, repr_map)
-            if not restored_amr:
-                print >> outf, '(a / amr-unknown)'
-                print >> outf, ''
-                continue
-            if 'NONE' in restored_amr.to_amr_string():
-                print s
-                print repr_map
-            print >> outf, restored_amr.to_amr_string()
-            print >> outf, ''
-        outf.close()
+        for amr_text, log, error in map_chunks(restore_chunk, iter_chunks(instances, chunk_size), num_jobs):
+            for line in log:
+                print line
+            outf.write(amr_text)
+            if error:
+                print >> sys.stderr, error
+                sys.exit(1)
 
 def isSpecial(symbol):
     for l in ['ENT', 'NE', 'VERB', 'SURF', 'CONST']:
@@ -643,6 +737,7 @@ if __name__ == "__main__":
 
     gflags.DEFINE_boolean("seq2amr", False, "If sequence to amr")
     gflags.DEFINE_boolean("amr2seq", False, "If amr to sequence")
+    gflags.DEFINE_integer("jobs", 1, "number of processes to restore the AMR graphs with")
     argv = FLAGS(sys.argv)
 
     amr_file = os.path.join(FLAGS.data_dir, 'amr')
@@ -653,38 +748,11 @@ if __name__ == "__main__":
     lemma_file = os.path.join(FLAGS.data_dir, 'lemmatized_token')
     pos_file = os.path.join(FLAGS.data_dir, 'pos')
     map_file = os.path.join(FLAGS.data_dir, 'cate_map')
-    cate_to_repr = []   #Maintain a map for each sentence
-
-    comment_list, amr_list = readAMR(amr_file)
-    if FLAGS.seq2amr:
-        amrseqs = [line.strip() for line in open(FLAGS.amrseq_file, 'r')]
-        for line in open(map_file):
-            curr_map = {}
-            if line.strip():
-                fields = line.strip().split('##')
-                for map_tok in fields:
-                    fs = map_tok.strip().split('++')
-                    try:
-                        assert len(fs) == 5, line
-                    except:
-                        print line
-                        print fields
-                        print curr_map
-                        print fs
-                        sys.exit(1)
-                    start = int(fs[1])
-                    end = int(fs[2])
-                    curr_map[fs[0]] = (start, end, fs[3], fs[4])
-            cate_to_repr.append(curr_map)
-        assert len(cate_to_repr) == len(amrseqs)
-
-    sents = [line.strip().split() for line in open(sent_file, 'r')]
-    toks = [line.strip().split() for line in open(tok_file, 'r')]
-    lemmas = [line.strip().split() for line in open(lemma_file, 'r')]
-    poss = [line.strip().split() for line in open(pos_file, 'r')]
 
     if FLAGS.amr2seq:
-        amr_graphs = [AMR.parse_string(amr_string) for amr_string in amr_list]
+        toks = [line.strip().split() for line in open(tok_file, 'r')]
+        poss = [line.strip().split() for line in open(pos_file, 'r')]
+        comment_list, amr_graphs = loadAMR(amr_file)
         alignments = [line.strip().split() for line in open(alignment_file, 'r')]
 
         ##################
@@ -694,8 +762,7 @@ if __name__ == "__main__":
             train_amr_graphs = amr_graphs
         else:
             train_amr_file = os.path.join(FLAGS.train_data_dir, "amr")
-            _ , train_amr_list = readAMR(train_amr_file)
-            train_amr_graphs = [AMR.parse_string(amr_string) for amr_string in train_amr_list]
+            _ , train_amr_graphs = loadAMR(train_amr_file)
 
         amr_stats = AMR_stats()
         amr_stats.collect_stats(train_amr_graphs)
@@ -706,6 +773,7 @@ if __name__ == "__main__":
 
     if FLAGS.seq2amr:
         amr_result_file = os.path.join(FLAGS.data_dir, 'amr.%s' % FLAGS.version)
-        sequence2amr(toks, lemmas, amrseqs, cate_to_repr, amr_result_file)
+        instances = read_restore_inputs(tok_file, lemma_file, FLAGS.amrseq_file, map_file)
+        sequence2amr(instances, amr_result_file, FLAGS.jobs)
 
 
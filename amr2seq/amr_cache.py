@@ -0,0 +1,67 @@
+#!/usr/bin/python
+'''
+On-disk cache for parsed AMR files and other data derived from a file.
+
+Parsing the AMR text file dominates the start-up time of categorize_amr.py and
+amr2seq.py. load_cached keeps the parsed objects as a cPickle file whose name
+holds the SHA-1 of the source file and CACHE_VERSION, so an edited source file
+or a new CACHE_VERSION (bump it whenever the graph classes of amr2seq or
+data_prep change) is never served from an old cache; stale cache files of the
+same source are removed when a new one is written. The graphs refer to their
+nodes by label or index, so they pickle within the default recursion limit;
+a result that does not is returned without being cached.
+
+data_prep/amr_cache.py is a link to amr2seq/amr_cache.py, so that both
+directories import the same module.
+'''
+import cPickle
+import glob
+import hashlib
+import os
+import sys
+
+CACHE_VERSION = 2
+
+def file_digest(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def cache_prefix(path, kind, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(path))
+    return os.path.join(cache_dir, '.%s.%s.' % (os.path.basename(path), kind))
+
+def cache_file(path, kind, cache_dir=None):
+    return '%sv%d.%s.pkl' % (cache_prefix(path, kind, cache_dir), CACHE_VERSION, file_digest(path))
+
+def load_cached(path, kind, parse, cache_dir=None):
+    """Return parse(path), read from the cache when the source is unchanged.
+    kind names the parser, so that different parses of one file do not clash."""
+    curr_cache = cache_file(path, kind, cache_dir)
+    if os.path.exists(curr_cache):
+        try:
+            with open(curr_cache, 'rb') as f:
+                return cPickle.load(f)
+        except Exception as e:
+            print >> sys.stderr, 'Ignoring unreadable cache %s: %s' % (curr_cache, e)
+
+    result = parse(path)
+
+    tmp_cache = '%s.%d.tmp' % (curr_cache, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(curr_cache)):
+            os.makedirs(os.path.dirname(curr_cache))
+        with open(tmp_cache, 'wb') as f:
+            cPickle.dump(result, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_cache, curr_cache)
+        for stale in glob.glob(cache_prefix(path, kind, cache_dir) + 'v*.pkl'):
+            if stale != curr_cache:
+                os.remove(stale)
+    except (IOError, OSError, RuntimeError, cPickle.PicklingError) as e:
+        print >> sys.stderr, 'Could not write cache %s: %s' % (curr_cache, e)
+        if os.path.exists(tmp_cache):
+            os.remove(tmp_cache)
+    return result
@@ -67,6 +67,9 @@ class AMR(defaultdict):
 
         self.reentrance_triples = []
 
+        # dfs order and its position id index, see traversal()
+        self.traversal_cache = None
+
     @classmethod
     def parse_string(cls,amr_string,RENAME_NODE=False):
         """
@@ -378,14 +381,33 @@ class AMR(defaultdict):
             raise ParserError, "mismatched parenthesis"
         return amr
 
+    def traversal(self):
+        """
+        return the dfs ordered nodes and edges together with the position id
+        index (seqID -> variable and variable -> seqID of its first visit);
+        computed once and kept until the graph is changed through one of the
+        mutating methods below. Code that edits self[...] or self.roots
+        directly should call invalidate_traversal afterwards.
+        """
+        if self.traversal_cache is None:
+            result = self.dfs_order()
+            var_of_pid = {}
+            pid_of_var = {}
+            if result is not None:
+                for node in result[0]:
+                    if node.seqID not in var_of_pid:
+                        var_of_pid[node.seqID] = node.node_label
+                    if node.node_label not in pid_of_var:
+                        pid_of_var[node.node_label] = node.seqID
+            self.traversal_cache = (result, var_of_pid, pid_of_var)
+        return self.traversal_cache
+
+    def invalidate_traversal(self):
+        self.traversal_cache = None
+
     def get_variable(self,posID):
         """return variable given postition ID"""
-        reent_var = None
-        seq = self.dfs()[0]
-        for node in seq:
-            if node.seqID == posID:
-                return node.node_label
-        return None
+        return self.traversal()[1].get(posID)
 
     def get_match(self, subgraph):
         """find the subgraph"""
@@ -410,11 +432,7 @@ class AMR(defaultdict):
         return None, None
 
     def get_pid(self,var):
-        seq = self.dfs()[0]
-        for node in seq:
-            if node.node_label == var:
-                return node.seqID
-        return None
+        return self.traversal()[2].get(var)
         '''
         posn_queue = posID.split('.')
         var_list = self.roots
@@ -478,6 +496,7 @@ class AMR(defaultdict):
     '''
 
     def _add_reentrance(self,parent,relation,reentrance):
+        self.invalidate_traversal()
         if reentrance:
             self.reentrance_triples.append((parent,relation,reentrance[0]))
 
@@ -485,6 +504,7 @@ class AMR(defaultdict):
         """
         Add a (parent, relation, child) triple to the DAG.
         """
+        self.invalidate_traversal()
         if type(child) is not tuple:
             child = (child,)
         if parent in child:
@@ -519,34 +539,37 @@ class AMR(defaultdict):
         """
         from collections import deque
         visited_nodes = set()
+        visited_triples = set()
+        reentrance = set(self.reentrance_triples)
         amr_triples = []
         sequence = []
         nid = 0
 
         for i,r in enumerate(self.roots):
             seqID = str(i)
-            queue = deque([((r,),None, 0, seqID)]) # node, incoming edge and depth
+            queue = deque([((r,),None,None, 0, seqID)]) # node, incoming edge, parent and depth
             amr_triples.append(('root','ROOT',r))
             while queue:
-                next,rel,depth,seqID = queue.popleft()
+                next,rel,parent,depth,seqID = queue.popleft()
                 for n in next:
-                    firsthit = (parent,rel,n) not in self.reentrance_triples
+                    firsthit = (parent,rel,n) not in reentrance
                     leaf = False if self[n] else True
 
-                    node = Node(rel,n,firsthit,leaf,depth,seqID)
+                    node = Node(parent,rel,n,firsthit,leaf,depth,seqID)
                     #nid += 1
                     sequence.append(node)
-                    if n in visited_nodes or (parent,rel,n) in self.reentrance_triples:
+                    if n in visited_nodes or (parent,rel,n) in reentrance:
                         continue
                     visited_nodes.add(n)
-                    p = len([child for rel,child in self[n].items() if (n,rel,child[0]) not in self.reentrance_triples]) - 1
+                    p = len([child for rel,child in self[n].items() if (n,rel,child[0]) not in reentrance]) - 1
                     for rel,child in reversed(self[n].items()):
-                        if not (rel,n,child[0]) in amr_triples:
-                            if (n,rel,child[0]) not in self.reentrance_triples:
-                                queue.append((child,rel,depth+1,seqID+'.'+str(p)))
+                        if not (rel,n,child[0]) in visited_triples:
+                            if (n,rel,child[0]) not in reentrance:
+                                queue.append((child,rel,n,depth+1,seqID+'.'+str(p)))
                                 p -= 1
                             else:
-                                queue.append((child,rel,depth+1,None))
+                                queue.append((child,rel,n,depth+1,None))
+                            visited_triples.add((rel,n,child[0]))
                             amr_triples.append((rel,n,child[0]))
 
 
@@ -565,13 +588,18 @@ class AMR(defaultdict):
     def dfs(self):
         """
         depth first search for the graph
-        return dfs ordered nodes and edges
+        return dfs ordered nodes and edges, shared with the traversal cache
         TO-DO: this visiting order information can be obtained
         through the reading order of amr strings; modify the class
         to OrderedDefaultDict;
         """
+        return self.traversal()[0]
+
+    def dfs_order(self):
         visited_nodes = set()
         visited_edges = []
+        edge_set = set()
+        reentrance = set(self.reentrance_triples)
         sequence = []
 
         for i,r in enumerate(self.roots):
@@ -582,8 +610,8 @@ class AMR(defaultdict):
             while stack:
                 next,rel,parent,depth,seqID = stack.pop()
                 for n in next:
-                    if self.reentrance_triples:
-                        firsthit = (parent,rel,n) not in self.reentrance_triples
+                    if reentrance:
+                        firsthit = (parent,rel,n) not in reentrance
                     else:
                         firsthit = n not in visited_nodes
                     leaf = False if self[n] else True
@@ -594,21 +622,22 @@ class AMR(defaultdict):
                     sequence.append(node)
 
                     # same StrLiteral/Quantity/Polarity should not be revisited
-                    if self.reentrance_triples: # for being the same with the amr string readed in
-                        if n in visited_nodes or (parent,rel,n) in self.reentrance_triples:
+                    if reentrance: # for being the same with the amr string readed in
+                        if n in visited_nodes or (parent,rel,n) in reentrance:
                             continue
                     else:
                         if n in visited_nodes:
                             continue
 
                     visited_nodes.add(n)
-                    p = len([child for rel,child in self[n].items() if (n,rel,child[0]) not in self.reentrance_triples]) - 1
+                    p = len([child for rel,child in self[n].items() if (n,rel,child[0]) not in reentrance]) - 1
                     for rel, child in reversed(self[n].items()):
                         #print rel,child
-                        if not (rel, n, child[0]) in visited_edges:
+                        if not (rel, n, child[0]) in edge_set:
                             #if child[0] not in visited_nodes or isinstance(child[0],(StrLiteral,Quantity)):
+                            edge_set.add((rel,n,child[0]))
                             visited_edges.append((rel,n,child[0]))
-                            if (n,rel,child[0]) not in self.reentrance_triples:
+                            if (n,rel,child[0]) not in reentrance:
                                 stack.append((child,rel,n,depth+1,seqID+'.'+str(p)))
                                 p -= 1
                             else:
@@ -624,6 +653,7 @@ class AMR(defaultdict):
 
     def replace_node(self, h_idx, idx):
         """for coreference, replace all occurrence of node idx to h_idx"""
+        self.invalidate_traversal()
         visited_nodes = set()
         visited_edges = set()
 
@@ -660,6 +690,7 @@ class AMR(defaultdict):
 
     def replace_head(self,old_head,new_head,KEEP_OLD=True):
         """change the focus of current sub graph"""
+        self.invalidate_traversal()
         for rel,child in self[old_head].items():
             if child != (new_head,):
                 self[new_head].append(rel,child)
@@ -670,6 +701,7 @@ class AMR(defaultdict):
 
     def replace_rel(self,h_idx,old_rel,new_rel):
         """replace the h_idx's old_rel to new_rel"""
+        self.invalidate_traversal()
         for v in self[h_idx].getall(old_rel):
             self[h_idx].append(new_rel,v)
         del self[h_idx][old_rel]
@@ -766,9 +798,15 @@ class AMR(defaultdict):
         return named_entity_nums,entity_nums,predicate_nums,variable_nums,const_nums,reentrancy_nums
 
     def to_amr_string(self):
+        buf = []
+        self.write_amr(buf.append)
+        return ''.join(buf)
 
-        amr_string = ""
-
+    def write_amr(self, write):
+        """
+        serialize the graph in Pennman notation piece by piece through write,
+        e.g. the append of a list buffer or the write of an open file
+        """
         seq = self.dfs()[0]
 
         #always begin with root
@@ -777,42 +815,53 @@ class AMR(defaultdict):
         for node in seq:
             if node.trace == None:
                 if node.firsthit and node.node_label in self.node_to_concepts:
-                    amr_string += "(%s / %s"%(node.node_label,self.node_to_concepts[node.node_label])
+                    write("(%s / %s"%(node.node_label,self.node_to_concepts[node.node_label]))
                 else:
-                    amr_string += "(%s"%(node.node_label)
+                    write("(%s"%(node.node_label))
             else:
                 if node.depth >= dep_rec:
                     dep_rec = node.depth
                 else:
-                    amr_string += "%s"%((dep_rec-node.depth)*')')
+                    write((dep_rec-node.depth)*')')
                     dep_rec = node.depth
 
 
                 if not node.leaf:
                     if node.firsthit and node.node_label in self.node_to_concepts:
-                        amr_string += "\n%s:%s (%s / %s"%(node.depth*"\t",node.trace,node.node_label,self.node_to_concepts[node.node_label])
+                        write("\n%s:%s (%s / %s"%(node.depth*"\t",node.trace,node.node_label,self.node_to_concepts[node.node_label]))
                     else:
-                        amr_string += "\n%s:%s %s"%(node.depth*"\t",node.trace,node.node_label)
+                        write("\n%s:%s %s"%(node.depth*"\t",node.trace,node.node_label))
 
                 else:
                     if node.firsthit and node.node_label in self.node_to_concepts:
-                        amr_string += "\n%s:%s (%s / %s)"%(node.depth*"\t",node.trace,node.node_label,self.node_to_concepts[node.node_label])
+                        write("\n%s:%s (%s / %s)"%(node.depth*"\t",node.trace,node.node_label,self.node_to_concepts[node.node_label]))
                     else:
                         if isinstance(node.node_label,StrLiteral):
-                            amr_string += '\n%s:%s "%s"'%(node.depth*"\t",node.trace,node.node_label)
+                            write('\n%s:%s "%s"'%(node.depth*"\t",node.trace,node.node_label))
                         else:
-                            amr_string += "\n%s:%s %s"%(node.depth*"\t",node.trace,node.node_label)
+                            write("\n%s:%s %s"%(node.depth*"\t",node.trace,node.node_label))
 
         if dep_rec != 0:
-            amr_string += "%s"%((dep_rec)*')')
+            write((dep_rec)*')')
         else:
-            amr_string += ')'
-
-        return amr_string
+            write(')')
 
     def __reduce__(self):
         t = defaultdict.__reduce__(self)
-        return (t[0], ()) + (self.__dict__,) + t[3:]
+        state = dict(self.__dict__, traversal_cache=None)
+        return (t[0], ()) + (state,) + t[3:]
+
+def write_amrs(amrs, write, unknown='(a / amr-unknown)'):
+    """
+    serialize a batch of graphs through write, each followed by an empty line;
+    a graph that could not be restored (None) is written as unknown
+    """
+    for amr in amrs:
+        if amr:
+            amr.write_amr(write)
+        else:
+            write(unknown)
+        write('\n\n')
 
 if __name__ == "__main__":
 
@@ -0,0 +1 @@
+../amr_cache.py
\ No newline at end of file
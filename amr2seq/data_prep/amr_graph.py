@@ -1,5 +1,6 @@
 #!/usr/bin/env python2.7
 import sys, re
+from array import array
 import amr
 from amr import *
 import amr_parser
@@ -10,13 +11,38 @@ from collections import deque, defaultdict
 from re_utils import extract_patterns, delete_pattern
 from constants import *
 
+#__slots__ classes need their pickle state spelled out. State pickled before
+#the slots were added is a plain __dict__ without index, which
+#AMRGraph.__setstate__ fills in; protocol 2 pickles made without these hooks
+#hold a (None, slot dict) pair.
+def get_slot_state(obj):
+    return dict((name, getattr(obj, name)) for name in obj.__slots__ if hasattr(obj, name))
+
+def set_slot_state(obj, state):
+    if isinstance(state, tuple):
+        state = state[1]
+    for name, value in state.iteritems():
+        if name in obj.__slots__:
+            setattr(obj, name, value)
+    if not hasattr(obj, 'index'):
+        obj.index = None
+
 class AMREdge(object):
+    __slots__ = ('label', 'head', 'tail', 'is_coref', 'graph', 'index')
+
     def __init__(self, label, graph, h_node, t_node = None):
         self.label = label
         self.head = h_node
         self.tail = t_node
         self.is_coref = False #Denoting the tail node is a reentrance
         self.graph = graph
+        self.index = None #Position in graph.edges
+
+    def __getstate__(self):
+        return get_slot_state(self)
+
+    def __setstate__(self, state):
+        set_slot_state(self, state)
 
     def __str__(self):
         return self.label
@@ -29,6 +55,8 @@ class AMREdge(object):
 
 '''There is some difference between leaf variables and the constant'''
 class AMRNode(object):
+    __slots__ = ('v_edges', 'c_edge', 'p_edges', 'is_const', 'use_quote', 'has_reentrance', 'graph', 'index')
+
     def __init__(self, graph, is_const = False):
         self.v_edges = []   #edges for relations
         self.c_edge = None #edge for node variable
@@ -37,6 +65,13 @@ class AMRNode(object):
         self.use_quote = False
         self.has_reentrance = False
         self.graph = graph
+        self.index = None #Position in graph.nodes
+
+    def __getstate__(self):
+        return get_slot_state(self)
+
+    def __setstate__(self, state):
+        set_slot_state(self, state)
 
     # for traversal
     def get_unvisited_children(self, visited, is_sort = True):
@@ -80,19 +115,16 @@ class AMRNode(object):
         return edges
 
     def get_all_descendent(self):
-        visited = set()
-        queue = []
-        for i in range(len(self.v_edges)):
-            n, node = self.get_child(i)
-            visited.add(n)
-            queue.append(node)
-        while len(queue) > 0:
-            cur_node = queue.pop(0)
-            for i in range(len(cur_node.v_edges)):
-                n, node = cur_node.get_child(i)
+        child_offsets = self.graph.child_offsets
+        child_nodes = self.graph.child_nodes
+        visited = set(child_nodes[child_offsets[self.index]:child_offsets[self.index+1]])
+        queue = deque(child_nodes[child_offsets[self.index]:child_offsets[self.index+1]])
+        while queue:
+            cur = queue.popleft()
+            for n in child_nodes[child_offsets[cur]:child_offsets[cur+1]]:
                 if n not in visited:
                     visited.add(n)
-                    queue.append(node)
+                    queue.append(n)
         return visited
 
     # more node types
@@ -231,11 +263,10 @@ class AMRGraph(object):
 
         self.dict = {}
         label_to_node = {}
-        self.nodes = []   #used to record all the nodes
-        self.node_dict = {}
-        self.edges = []
-        self.edge_dict = {}
+        self.nodes = []   #used to record all the nodes, node.index is the position here
+        self.edges = []   #edge.index is the position here
         self.root = None
+        self.has_cycle = None
 
         self.ne_index = 0
         self.ent_index = 0
@@ -248,18 +279,14 @@ class AMRGraph(object):
             self.dict[curr_var] = var_values[i] #maintain a dict for all the variable values
 
             #Setting a constant edge for a node: the variable name
-            if curr_var not in label_to_node.keys(): #Haven't created a node for the current variable yet
+            if curr_var not in label_to_node: #Haven't created a node for the current variable yet
                 curr_node = AMRNode(self)
-                self.node_dict[curr_node] = len(self.nodes)
-                self.nodes.append(curr_node)
-                curr_node_index = self.node_dict[curr_node]
+                curr_node_index = self.add_node(curr_node)
 
                 if i == 0:
                     self.root = curr_node_index
                 const_edge = AMREdge(curr_var, self, curr_node_index)
-                self.edge_dict[const_edge] = len(self.edges)
-                self.edges.append(const_edge)
-                curr_edge_index = self.edge_dict[const_edge]
+                curr_edge_index = self.add_edge(const_edge)
 
                 curr_node.set_const_edge(curr_edge_index) #The const edge is set immediately after the initialization of a node
                 label_to_node[curr_var] = curr_node_index
@@ -272,15 +299,13 @@ class AMRGraph(object):
             if curr_var in rel_links:
                 for rel, linked_val, is_var, is_coref in rel_links[curr_var]:
                     if is_var:
-                        assert linked_val in label_to_node.keys(), 'Current coref variable %s is not a node yet' % linked_val
+                        assert linked_val in label_to_node, 'Current coref variable %s is not a node yet' % linked_val
                         tail_node_index = label_to_node[linked_val] #Find the existed linked node index
                         edge = AMREdge(rel, self, curr_node_index, tail_node_index)
                         if is_coref:  #The node for this variable has already been generated
                             edge.set_coref(True)
 
-                        self.edge_dict[edge] = len(self.edges)
-                        self.edges.append(edge)
-                        curr_edge_index = self.edge_dict[edge]
+                        curr_edge_index = self.add_edge(edge)
 
                         curr_node.add_incoming(curr_edge_index)
 
@@ -300,26 +325,64 @@ class AMRGraph(object):
                                 linked_val = linked_val.replace('/', '@@@@')
                                 print >> sys.stderr, linked_val
 
-                        self.node_dict[tail_node] = len(self.nodes)
-                        self.nodes.append(tail_node)
-                        tail_node_index = self.node_dict[tail_node]
+                        tail_node_index = self.add_node(tail_node)
 
                         tail_const = AMREdge(linked_val, self, tail_node_index)
-
-                        self.edge_dict[tail_const] = len(self.edges)
-                        self.edges.append(tail_const)
-                        tail_edge_index = self.edge_dict[tail_const]
+                        tail_edge_index = self.add_edge(tail_const)
 
                         tail_node.set_const_edge(tail_edge_index)
                         edge = AMREdge(rel, self, curr_node_index, tail_node_index)
-
-                        self.edge_dict[edge] = len(self.edges)
-                        self.edges.append(edge)
-                        curr_edge_index = self.edge_dict[edge]
+                        curr_edge_index = self.add_edge(edge)
 
                         curr_node.add_incoming(curr_edge_index)
                         tail_node.add_parent_edge(curr_edge_index)
 
+        self.build_adjacency()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        #Graphs pickled before nodes and edges knew their index have neither the
+        #indices nor the adjacency arrays
+        if 'child_offsets' not in state:
+            self.__dict__.pop('node_dict', None)
+            self.__dict__.pop('edge_dict', None)
+            for (i, node) in enumerate(self.nodes):
+                node.index = i
+            for (i, edge) in enumerate(self.edges):
+                edge.index = i
+            self.has_cycle = None
+            self.build_adjacency()
+
+    def add_node(self, node):
+        node.index = len(self.nodes)
+        self.nodes.append(node)
+        return node.index
+
+    def add_edge(self, edge):
+        edge.index = len(self.edges)
+        self.edges.append(edge)
+        return edge.index
+
+    #Compressed (CSR) child and parent adjacency: the relation edges going out of
+    #node n are child_edges[child_offsets[n]:child_offsets[n+1]], in v_edges
+    #order, leading to child_nodes at the same positions; likewise for p_edges.
+    def build_adjacency(self):
+        self.child_offsets = array('i', [0])
+        self.child_edges = array('i')
+        self.child_nodes = array('i')
+        self.parent_offsets = array('i', [0])
+        self.parent_edges = array('i')
+        self.parent_nodes = array('i')
+        for node in self.nodes:
+            for edge_index in node.v_edges:
+                self.child_edges.append(edge_index)
+                self.child_nodes.append(self.edges[edge_index].tail)
+            self.child_offsets.append(len(self.child_edges))
+            for edge_index in node.p_edges:
+                self.parent_edges.append(edge_index)
+                self.parent_nodes.append(self.edges[edge_index].head)
+            self.parent_offsets.append(len(self.parent_edges))
+
     def setStats(self, stats):
         self.stats = stats
 
@@ -407,14 +470,13 @@ class AMRGraph(object):
 
     def get_ancestors(self, n, stop_if_see = None):
         set_n = {n:('',-1)}
-        queue = [n,]
-        while len(queue) > 0:
-            cur = queue.pop(0)
-            for ei in self.nodes[cur].p_edges:
-                e = self.edges[ei]
-                prn = e.head
+        queue = deque([n])
+        while queue:
+            cur = queue.popleft()
+            for i in xrange(self.parent_offsets[cur], self.parent_offsets[cur+1]):
+                prn = self.parent_nodes[i]
                 if prn not in set_n:
-                    set_n[prn] = (e.label, cur)
+                    set_n[prn] = (self.edges[self.parent_edges[i]].label, cur)
                     queue.append(prn)
                 if stop_if_see != None and prn in stop_if_see:
                     return (set_n, prn)
@@ -559,22 +621,27 @@ class AMRGraph(object):
         #print all nodes info
         print 'Nodes information:'
         print 'Number of nodes: %s' % len(self.nodes)
-        for node in self.node_dict.keys():
-            print str(node), ',', self.node_dict[node]
+        for node in self.nodes:
+            print str(node), ',', node.index
 
         #print all edges info
         print 'Edges information'
         print 'Number of edges: %s' % len(self.edges)
-        for edge in self.edge_dict.keys():
-            print edge.label, ',', self.edge_dict[edge]
+        for edge in self.edges:
+            print edge.label, ',', edge.index
 
+    #The graph does not change after construction, so the answer is computed once
     def check_self_cycle(self):
-        visited_nodes = set()
-        sequence = []
-        root_node = self.nodes[self.root]
-        if len(root_node.p_edges) > 0:
+        if self.has_cycle is None:
+            self.has_cycle = self.find_self_cycle()
+        return self.has_cycle
+
+    def find_self_cycle(self):
+        if self.parent_offsets[self.root+1] > self.parent_offsets[self.root]:
             return True
 
+        visited_nodes = set()
+        sequence = []
         stack = [(self.root, 0)]
         while stack:
             curr_node_index, depth = stack.pop()
@@ -586,14 +653,11 @@ class AMRGraph(object):
                 sequence[depth] = curr_node_index
 
             visited_nodes.add(curr_node_index)
-            curr_node = self.nodes[curr_node_index]
-            if len(curr_node.v_edges) > 0:
-                for edge_index in reversed(curr_node.v_edges):  #depth first search
-                    curr_edge = self.edges[edge_index]
-                    child_index = curr_edge.tail
-                    if child_index in sequence[:depth+1]:
-                        return True
-                    stack.append((child_index, depth+1))
+            for i in xrange(self.child_offsets[curr_node_index+1]-1, self.child_offsets[curr_node_index]-1, -1):  #depth first search
+                child_index = self.child_nodes[i]
+                if child_index in sequence[:depth+1]:
+                    return True
+                stack.append((child_index, depth+1))
         return False
 
     #Given a set of fragments, find the way they connect in the graph
@@ -1042,7 +1106,7 @@ class AMRGraph(object):
         frag = AMRFragment(n_edges, n_nodes, self)
 
         curr_node = node
-        curr_node_index = self.node_dict[curr_node]
+        curr_node_index = curr_node.index
         root_src = curr_node_index
 
         frag.set_root(curr_node_index)
@@ -1075,7 +1139,7 @@ class AMRGraph(object):
 
         curr_node = node
         #opt_srcs = []
-        curr_node_index = self.node_dict[curr_node]
+        curr_node_index = curr_node.index
         root_src = curr_node_index
 
         frag.set_root(curr_node_index)
@@ -1293,7 +1357,7 @@ class AMRGraph(object):
             curr_node_label = str(curr_c_edge)
 
             if par_rel == None:   #There is no relation going into this node
-                if not is_coref and curr_node_label in self.dict.keys():
+                if not is_coref and curr_node_label in self.dict:
                     s += "(%s / %s" % (curr_node_label, self.dict[curr_node_label])
                 else:
                     s += "(%s" % curr_node_label
@@ -1303,15 +1367,15 @@ class AMRGraph(object):
                 dep_rec = depth
 
                 if curr_node.is_leaf():
-                    if not is_coref and curr_node_label in self.dict.keys(): #In this case, current node is variable and is visited for the first time. Leaf variable
+                    if not is_coref and curr_node_label in self.dict: #In this case, current node is variable and is visited for the first time. Leaf variable
                         s += "\n%s:%s (%s / %s)"  % (depth*"\t", par_rel, curr_node_label, self.dict[curr_node_label])
                     else:
-                        if curr_node_label not in self.dict.keys() and curr_node.use_quote:
+                        if curr_node_label not in self.dict and curr_node.use_quote:
                             s += '\n%s:%s "%s"' % (depth*"\t", par_rel, curr_node_label)
                         else:
                             s += "\n%s:%s %s" % (depth*"\t", par_rel, curr_node_label)
                 else:
-                    if not is_coref and curr_node_label in self.dict.keys(): #In this case, current node is variable and is visited for the first time. Not leaf variable
+                    if not is_coref and curr_node_label in self.dict: #In this case, current node is variable and is visited for the first time. Not leaf variable
                         s += "\n%s:%s (%s / %s"  % (depth*"\t", par_rel, curr_node_label, self.dict[curr_node_label])
                     else:
                         s += "\n%s:%s %s" % (depth*"\t", par_rel, curr_node_label)
@@ -1416,7 +1480,7 @@ class AMRGraph(object):
 
             else:
                 if not par_rel:   #There is no relation going into this node
-                    if not is_coref and curr_node_label in self.dict.keys():
+                    if not is_coref and curr_node_label in self.dict:
                         s += "(%s / %s" % (curr_node_label, self.dict[curr_node_label])
                     else:
                         s += "(%s" % curr_node_label
@@ -1426,15 +1490,15 @@ class AMRGraph(object):
                     dep_rec = depth
 
                     if curr_node.is_leaf():
-                        if not is_coref and curr_node_label in self.dict.keys(): #In this case, current node is variable and is visited for the first time. Leaf variable
+                        if not is_coref and curr_node_label in self.dict: #In this case, current node is variable and is visited for the first time. Leaf variable
                             s += "\n%s:%s (%s / %s)"  % (depth*"\t", par_rel, curr_node_label, self.dict[curr_node_label])
                         else:
-                            if curr_node_label not in self.dict.keys() and curr_node.use_quote:
+                            if curr_node_label not in self.dict and curr_node.use_quote:
                                 s += '\n%s:%s "%s"' % (depth*"\t", par_rel, curr_node_label)
                             else:
                                 s += "\n%s:%s %s" % (depth*"\t", par_rel, curr_node_label)
                     else:
-                        if not is_coref and curr_node_label in self.dict.keys(): #In this case, current node is variable and is visited for the first time. Not leaf variable
+                        if not is_coref and curr_node_label in self.dict: #In this case, current node is variable and is visited for the first time. Not leaf variable
                             s += "\n%s:%s (%s / %s"  % (depth*"\t", par_rel, curr_node_label, self.dict[curr_node_label])
                         else:
                             s += "\n%s:%s %s" % (depth*"\t", par_rel, curr_node_label)
@@ -5,6 +5,7 @@ import os
 import amr_graph
 from amr_graph import *
 from re_utils import *
+from amr_cache import load_cached
 
 def get_amr_line(input_f):
     """Read the amr file. AMRs are separated by a blank line."""
@@ -27,8 +28,13 @@ def get_amr_line(input_f):
          #cur_amr.append(line.strip())
     return "".join(cur_amr)
 
-#Load a list of amr graph objects
-def load_amr_graphs(amr_file):
+#Load a list of amr graph objects, from the parsed-AMR cache if the file is unchanged
+def load_amr_graphs(amr_file, use_cache=True, cache_dir=None):
+    if use_cache:
+        return load_cached(amr_file, 'amrgraph', parse_amr_graphs, cache_dir)
+    return parse_amr_graphs(amr_file)
+
+def parse_amr_graphs(amr_file):
 
     f = open(amr_file, 'r')
     amr_line = get_amr_line(f)
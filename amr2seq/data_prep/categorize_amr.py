@@ -5,6 +5,8 @@ import pickle
 import os
 import re
 import cPickle
+import multiprocessing
+from cStringIO import StringIO
 from amr_graph import *
 from amr_utils import *
 import logger
@@ -483,8 +485,287 @@ def categorizedSpans(all_alignments, node_to_label):
 
     return span_map, end_index_map, visited
 
+#Read-only inputs of the sentence functions below. They are set before the
+#worker pool starts, so forked workers share them without copying.
+shared_data = {}
+
+#Apply func to every sentence index, in num_jobs forked processes if num_jobs > 1,
+#and yield the results in sentence order.
+def map_sentences(func, num_sents, num_jobs):
+    if num_jobs <= 1:
+        for sent_index in xrange(num_sents):
+            yield func(sent_index)
+        return
+    pool = multiprocessing.Pool(num_jobs)
+    try:
+        chunksize = max(1, num_sents / (num_jobs * 16))
+        for result in pool.imap(func, xrange(num_sents), chunksize):
+            yield result
+    finally:
+        pool.terminate()
+
+#Linearize the training sentence sent_index with the inputs in shared_data.
+#Returns the amr, token and map sequences with the alignment counts.
+def linearize_train_sent(sent_index):
+    amr = shared_data['amr_graphs'][sent_index]
+    tok_seq = shared_data['toks'][sent_index]
+    pos_seq = shared_data['poss'][sent_index]
+    alignment_seq = shared_data['alignments'][sent_index]
+    amr_statistics = shared_data['amr_statistics']
+    args = shared_data['args']
+
+    has_cycle = False
+    singleton_num = 0.0
+    multiple_num = 0.0
+    total_num = 0.0
+    empty_num = 0.0
+
+    logger.writeln('Sentence #%d' % (sent_index+1))
+    logger.writeln(' '.join(tok_seq))
+
+    amr.setStats(amr_statistics)
+
+    edge_alignment = bitarray(len(amr.edges))
+    if edge_alignment.count() != 0:
+        edge_alignment ^= edge_alignment
+    assert edge_alignment.count() == 0
+
+    if amr.check_self_cycle():
+        has_cycle = True
+
+    amr.set_sentence(tok_seq)
+    amr.set_poss(pos_seq)
+
+    aligned_fragments = []
+    reentrancies = {}  #Map multiple spans as reentrancies, keeping only one as original, others as connections
+
+    has_multiple = False
+    no_alignment = False
+
+    aligned_set = set()
+
+    (opt_toks, role_toks, node_to_span, edge_to_span, temp_aligned) = extractNodeMapping(alignment_seq, amr)
+
+    temp_unaligned = set(xrange(len(pos_seq))) - temp_aligned
+
+    all_frags = []
+    all_alignments = defaultdict(list)
+
+    ####Extract named entities#####
+    for (frag, wiki_label) in amr.extract_entities():
+        if len(opt_toks) == 0:
+            logger.writeln("No alignment for the entity found")
+
+        (aligned_indexes, entity_spans) = all_aligned_spans(frag, opt_toks, role_toks, temp_unaligned)
+        root_node = amr.nodes[frag.root]
+
+        entity_mention_toks = root_node.namedEntityMention()
+
+        total_num += 1.0
+        if entity_spans:
+            entity_spans = removeRedundant(tok_seq, entity_spans, entity_mention_toks)
+            if len(entity_spans) == 1:
+                singleton_num += 1.0
+                logger.writeln('Single fragment')
+                for (frag_start, frag_end) in entity_spans:
+                    logger.writeln(' '.join(tok_seq[frag_start:frag_end]))
+                    all_alignments[frag.root].append((frag_start, frag_end, wiki_label))
+                    temp_aligned |= set(xrange(frag_start, frag_end))
+            else:
+                multiple_num += 1.0
+                logger.writeln('Multiple fragment')
+                logger.writeln(aligned_indexes)
+                logger.writeln(' '.join([tok_seq[index] for index in aligned_indexes]))
+
+                for (frag_start, frag_end) in entity_spans:
+                    logger.writeln(' '.join(tok_seq[frag_start:frag_end]))
+                    all_alignments[frag.root].append((frag_start, frag_end, wiki_label))
+                    temp_aligned |= set(xrange(frag_start, frag_end))
+        else:
+            empty_num += 1.0
+
+    ####Process date entities
+    date_entity_frags = amr.extract_all_dates()
+    for frag in date_entity_frags:
+        all_date_indices, index_to_attr = getDateAttr(frag)
+        covered_toks, non_covered, index_to_toks = getSpanSide(tok_seq, alignment_seq, frag, temp_unaligned)
+
+        covered_set = set(covered_toks)
+
+        all_spans = getContinuousSpans(covered_toks, temp_unaligned, covered_set)
+        if all_spans:
+            temp_spans = []
+            for span_start, span_end in all_spans:
+                if span_start > 0 and (span_start-1) in temp_unaligned:
+                    if tok_seq[span_start-1] in str(frag) and tok_seq[0] in '0123456789':
+                        temp_spans.append((span_start-1, span_end))
+                    else:
+                        temp_spans.append((span_start, span_end))
+                else:
+                    temp_spans.append((span_start, span_end))
+            all_spans = temp_spans
+            all_spans = removeDateRedundant(all_spans)
+            for span_start, span_end in all_spans:
+                all_alignments[frag.root].append((span_start, span_end, None))
+                temp_aligned |= set(xrange(span_start, span_end))
+                if len(non_covered) == 0:
+                    print 'Dates: %s' % ' '.join(tok_seq[span_start:span_end])
+        else:
+            for index in temp_unaligned:
+                curr_tok = tok_seq[index]
+                found = False
+                for un_tok in non_covered:
+                    if curr_tok[0] in '0123456789' and curr_tok in un_tok:
+                        print 'recovered: %s' % curr_tok
+                        found = True
+                        break
+                if found:
+                    all_alignments[frag.root].append((index, index+1, None))
+                    temp_aligned.add(index)
+                    print 'Date: %s' % tok_seq[index]
+
+    #Verbalization list
+    verb_map = {}
+    for (index, curr_tok) in enumerate(tok_seq):
+        if curr_tok in VERB_LIST:
+
+            for subgraph in VERB_LIST[curr_tok]:
+
+                matched_frags = amr.matchSubgraph(subgraph)
+                if matched_frags:
+                    temp_aligned.add(index)
+
+                for (node_index, ex_rels) in matched_frags:
+                    all_alignments[node_index].append((index, index+1, None))
+                    verb_map[node_index] = subgraph
+
+    #####Load verbalization list #####
+    for node_index in node_to_span:
+        if node_index in all_alignments:
+            continue
+
+        all_alignments[node_index] = node_to_span[node_index]
+
+    ##Based on the alignment from node index to spans in the string
+    temp_unaligned = set(xrange(len(pos_seq))) - temp_aligned
+
+    assert len(tok_seq) == len(pos_seq)
+
+    amr_seq, cate_tok_seq, map_seq = categorizeParallelSequences(amr, tok_seq, all_alignments, temp_unaligned, verb_map, args.min_prd_freq, args.min_var_freq)
+    return (amr_seq, cate_tok_seq, map_seq, (has_cycle, singleton_num, multiple_num, total_num, empty_num))
+
+#Run func(sent_index) and also return what it logged and printed, so that the parent
+#writes both in sentence order whichever process linearized the sentence. A worker
+#that exits would leave Pool.imap waiting forever, so SystemExit becomes an error
+#that imap raises in the parent.
+def run_captured(func, sent_index):
+    log_f = logger.file
+    stdout = sys.stdout
+    logger.file = StringIO()
+    sys.stdout = StringIO()
+    try:
+        result = func(sent_index)
+        return (result, logger.file.getvalue(), sys.stdout.getvalue())
+    except SystemExit as e:
+        stdout.write(sys.stdout.getvalue())
+        raise RuntimeError('Linearizing sentence %d exited with status %s' % (sent_index, e.code))
+    finally:
+        logger.file = log_f
+        sys.stdout = stdout
+
+def linearize_train_sent_captured(sent_index):
+    return run_captured(linearize_train_sent, sent_index)
+
+def linearize_test_sent_captured(sent_index):
+    return run_captured(linearize_test_sent, sent_index)
+
+#Build the linearized token sequence and category map of the sentence sent_index
+def linearize_test_sent(sent_index):
+    tok_seq = shared_data['toks'][sent_index]
+    pos_seq = shared_data['poss'][sent_index]
+    entities_in_sent = shared_data['all_entities'][sent_index]
+    all_dates = shared_data['all_dates']
+    mle_map = shared_data['mle_map']
+
+    print 'snt: %d' % sent_index
+    n_toks = len(tok_seq)
+    aligned_set = set()
+
+    all_spans = []
+    date_spans = all_dates[sent_index]
+    date_set = set()
+
+    #Align dates
+    for (start, end) in date_spans:
+        if end - start > 1:
+            new_aligned = set(xrange(start, end))
+            aligned_set |= new_aligned
+            entity_name = ' '.join(tok_seq[start:end])
+            if entity_name in mle_map:
+                entity_typ = mle_map[entity_name]
+            else:
+                entity_typ = ('DATE', "date-entity", "NONE")
+            all_spans.append((start, end, entity_typ))
+            print 'Date:', start, end
+        else:
+            date_set.add(start)
+
+    #First align multi tokens
+    for (start, end, entity_typ) in entities_in_sent:
+        if end - start > 1:
+            new_aligned = set(xrange(start, end))
+            if len(aligned_set & new_aligned) != 0:
+                continue
+            aligned_set |= new_aligned
+            entity_name = ' '.join(tok_seq[start:end])
+            if entity_name in mle_map:
+                entity_typ = mle_map[entity_name]
+            else:
+                entity_typ = ('NE_person', "person", '-')
+            all_spans.append((start, end, entity_typ))
+
+    #Single token
+    for (index, curr_tok) in enumerate(tok_seq):
+        if index in aligned_set:
+            continue
+
+        curr_pos = pos_seq[index]
+        aligned_set.add(index)
+
+        if curr_tok in mle_map:
+            (category, node_repr, wiki_label) = mle_map[curr_tok]
+            if category.lower() == 'none':
+                all_spans.append((index, index+1, (curr_tok, "NONE", "NONE")))
+            else:
+                all_spans.append((index, index+1, mle_map[curr_tok]))
+        else:
+
+            if curr_tok[0] in '\"\'.':
+                print 'weird token: %s, %s' % (curr_tok, curr_pos)
+                continue
+            if index in date_set:
+                entity_typ = ('DATE', "date-entity", "NONE")
+                all_spans.append((index, index+1, entity_typ))
+            elif curr_tok in VERB_LIST:
+                node_repr = VERB_LIST[curr_tok][0].keys()[0]
+                entity_typ = ('VERBAL', node_repr, "NONE")
+                all_spans.append((index, index+1, entity_typ))
+
+            elif curr_pos[0] == 'V':
+                node_repr = '%s-01' % curr_tok
+                all_spans.append((index, index+1, ('-VERB-', node_repr, "NONE")))
+            else:
+                node_repr = curr_tok
+                all_spans.append((index, index+1, ('-SURF-', curr_tok, "NONE")))
+
+    all_spans = sorted(all_spans, key=lambda span: (span[0], span[1]))
+    print all_spans
+    linearized_tokseq, map_repr_seq = getIndexedForm(all_spans)
+    return (linearized_tokseq, map_repr_seq)
+
 def linearize_amr(args):
-    logger.file = open(os.path.join(args.run_dir, 'logger'), 'w')
+    log_f = open(os.path.join(args.run_dir, 'logger'), 'w')
+    logger.file = log_f
 
     amr_file = os.path.join(args.data_dir, 'amr')
     alignment_file = os.path.join(args.data_dir, 'alignment')
@@ -494,7 +775,7 @@ def linearize_amr(args):
         tok_file = os.path.join(args.data_dir, 'token')
     pos_file = os.path.join(args.data_dir, 'pos')
 
-    amr_graphs = load_amr_graphs(amr_file)
+    amr_graphs = load_amr_graphs(amr_file, not args.no_amr_cache, args.amr_cache_dir)
     alignments = [line.strip().split() for line in open(alignment_file, 'r')]
     toks = [line.strip().split() for line in open(tok_file, 'r')]
     poss = [line.strip().split() for line in open(pos_file, 'r')]
@@ -528,142 +809,18 @@ def linearize_amr(args):
         tokseq_wf = open(tok_seq_file, 'w')
         mapseq_wf = open(map_seq_file, 'w')
 
-        for (sent_index, (tok_seq, pos_seq, alignment_seq, amr)) in enumerate(zip(toks, poss, alignments, amr_graphs)):
-
-            logger.writeln('Sentence #%d' % (sent_index+1))
-            logger.writeln(' '.join(tok_seq))
-
-            amr.setStats(amr_statistics)
-
-            edge_alignment = bitarray(len(amr.edges))
-            if edge_alignment.count() != 0:
-                edge_alignment ^= edge_alignment
-            assert edge_alignment.count() == 0
-
-            has_cycle = False
-            if amr.check_self_cycle():
-                num_self_cycle += 1
-                has_cycle = True
-
-            amr.set_sentence(tok_seq)
-            amr.set_poss(pos_seq)
-
-            aligned_fragments = []
-            reentrancies = {}  #Map multiple spans as reentrancies, keeping only one as original, others as connections
-
-            has_multiple = False
-            no_alignment = False
-
-            aligned_set = set()
+        shared_data.update(amr_graphs=amr_graphs, toks=toks, poss=poss, alignments=alignments, amr_statistics=amr_statistics, args=args)
+        results = map_sentences(linearize_train_sent_captured, len(amr_graphs), args.jobs)
+        for ((amr_seq, cate_tok_seq, map_seq, counts), log, out) in results:
+            sys.stdout.write(out)
+            log_f.write(log)
+            log_f.flush()
+            num_self_cycle += counts[0]
+            singleton_num += counts[1]
+            multiple_num += counts[2]
+            total_num += counts[3]
+            empty_num += counts[4]
 
-            (opt_toks, role_toks, node_to_span, edge_to_span, temp_aligned) = extractNodeMapping(alignment_seq, amr)
-
-            temp_unaligned = set(xrange(len(pos_seq))) - temp_aligned
-
-            all_frags = []
-            all_alignments = defaultdict(list)
-
-            ####Extract named entities#####
-            for (frag, wiki_label) in amr.extract_entities():
-                if len(opt_toks) == 0:
-                    logger.writeln("No alignment for the entity found")
-
-                (aligned_indexes, entity_spans) = all_aligned_spans(frag, opt_toks, role_toks, temp_unaligned)
-                root_node = amr.nodes[frag.root]
-
-                entity_mention_toks = root_node.namedEntityMention()
-
-                total_num += 1.0
-                if entity_spans:
-                    entity_spans = removeRedundant(tok_seq, entity_spans, entity_mention_toks)
-                    if len(entity_spans) == 1:
-                        singleton_num += 1.0
-                        logger.writeln('Single fragment')
-                        for (frag_start, frag_end) in entity_spans:
-                            logger.writeln(' '.join(tok_seq[frag_start:frag_end]))
-                            all_alignments[frag.root].append((frag_start, frag_end, wiki_label))
-                            temp_aligned |= set(xrange(frag_start, frag_end))
-                    else:
-                        multiple_num += 1.0
-                        logger.writeln('Multiple fragment')
-                        logger.writeln(aligned_indexes)
-                        logger.writeln(' '.join([tok_seq[index] for index in aligned_indexes]))
-
-                        for (frag_start, frag_end) in entity_spans:
-                            logger.writeln(' '.join(tok_seq[frag_start:frag_end]))
-                            all_alignments[frag.root].append((frag_start, frag_end, wiki_label))
-                            temp_aligned |= set(xrange(frag_start, frag_end))
-                else:
-                    empty_num += 1.0
-
-            ####Process date entities
-            date_entity_frags = amr.extract_all_dates()
-            for frag in date_entity_frags:
-                all_date_indices, index_to_attr = getDateAttr(frag)
-                covered_toks, non_covered, index_to_toks = getSpanSide(tok_seq, alignment_seq, frag, temp_unaligned)
-
-                covered_set = set(covered_toks)
-
-                all_spans = getContinuousSpans(covered_toks, temp_unaligned, covered_set)
-                if all_spans:
-                    temp_spans = []
-                    for span_start, span_end in all_spans:
-                        if span_start > 0 and (span_start-1) in temp_unaligned:
-                            if tok_seq[span_start-1] in str(frag) and tok_seq[0] in '0123456789':
-                                temp_spans.append((span_start-1, span_end))
-                            else:
-                                temp_spans.append((span_start, span_end))
-                        else:
-                            temp_spans.append((span_start, span_end))
-                    all_spans = temp_spans
-                    all_spans = removeDateRedundant(all_spans)
-                    for span_start, span_end in all_spans:
-                        all_alignments[frag.root].append((span_start, span_end, None))
-                        temp_aligned |= set(xrange(span_start, span_end))
-                        if len(non_covered) == 0:
-                            print 'Dates: %s' % ' '.join(tok_seq[span_start:span_end])
-                else:
-                    for index in temp_unaligned:
-                        curr_tok = tok_seq[index]
-                        found = False
-                        for un_tok in non_covered:
-                            if curr_tok[0] in '0123456789' and curr_tok in un_tok:
-                                print 'recovered: %s' % curr_tok
-                                found = True
-                                break
-                        if found:
-                            all_alignments[frag.root].append((index, index+1, None))
-                            temp_aligned.add(index)
-                            print 'Date: %s' % tok_seq[index]
-
-            #Verbalization list
-            verb_map = {}
-            for (index, curr_tok) in enumerate(tok_seq):
-                if curr_tok in VERB_LIST:
-
-                    for subgraph in VERB_LIST[curr_tok]:
-
-                        matched_frags = amr.matchSubgraph(subgraph)
-                        if matched_frags:
-                            temp_aligned.add(index)
-
-                        for (node_index, ex_rels) in matched_frags:
-                            all_alignments[node_index].append((index, index+1, None))
-                            verb_map[node_index] = subgraph
-
-            #####Load verbalization list #####
-            for node_index in node_to_span:
-                if node_index in all_alignments:
-                    continue
-
-                all_alignments[node_index] = node_to_span[node_index]
-
-            ##Based on the alignment from node index to spans in the string
-            temp_unaligned = set(xrange(len(pos_seq))) - temp_aligned
-
-            assert len(tok_seq) == len(pos_seq)
-
-            amr_seq, cate_tok_seq, map_seq = categorizeParallelSequences(amr, tok_seq, all_alignments, temp_unaligned, verb_map, args.min_prd_freq, args.min_var_freq)
             print >> amrseq_wf, ' '.join(amr_seq)
             print >> tokseq_wf, ' '.join(cate_tok_seq)
             print >> mapseq_wf, '##'.join(map_seq)  #To separate single space
@@ -694,82 +851,10 @@ def linearize_amr(args):
         tokseq_wf = open(tokseq_result, 'w')
         dev_map_wf = open(dev_map_file, 'w')
 
-        for (sent_index, (tok_seq, pos_seq, entities_in_sent)) in enumerate(zip(toks, poss, all_entities)):
-            print 'snt: %d' % sent_index
-            n_toks = len(tok_seq)
-            aligned_set = set()
-
-            all_spans = []
-            date_spans = all_dates[sent_index]
-            date_set = set()
-
-            #Align dates
-            for (start, end) in date_spans:
-                if end - start > 1:
-                    new_aligned = set(xrange(start, end))
-                    aligned_set |= new_aligned
-                    entity_name = ' '.join(tok_seq[start:end])
-                    if entity_name in mle_map:
-                        entity_typ = mle_map[entity_name]
-                    else:
-                        entity_typ = ('DATE', "date-entity", "NONE")
-                    all_spans.append((start, end, entity_typ))
-                    print 'Date:', start, end
-                else:
-                    date_set.add(start)
-
-            #First align multi tokens
-            for (start, end, entity_typ) in entities_in_sent:
-                if end - start > 1:
-                    new_aligned = set(xrange(start, end))
-                    if len(aligned_set & new_aligned) != 0:
-                        continue
-                    aligned_set |= new_aligned
-                    entity_name = ' '.join(tok_seq[start:end])
-                    if entity_name in mle_map:
-                        entity_typ = mle_map[entity_name]
-                    else:
-                        entity_typ = ('NE_person', "person", '-')
-                    all_spans.append((start, end, entity_typ))
-
-            #Single token
-            for (index, curr_tok) in enumerate(tok_seq):
-                if index in aligned_set:
-                    continue
-
-                curr_pos = pos_seq[index]
-                aligned_set.add(index)
-
-                if curr_tok in mle_map:
-                    (category, node_repr, wiki_label) = mle_map[curr_tok]
-                    if category.lower() == 'none':
-                        all_spans.append((index, index+1, (curr_tok, "NONE", "NONE")))
-                    else:
-                        all_spans.append((index, index+1, mle_map[curr_tok]))
-                else:
-
-                    if curr_tok[0] in '\"\'.':
-                        print 'weird token: %s, %s' % (curr_tok, curr_pos)
-                        continue
-                    if index in date_set:
-                        entity_typ = ('DATE', "date-entity", "NONE")
-                        all_spans.append((index, index+1, entity_typ))
-                    elif curr_tok in VERB_LIST:
-                        node_repr = VERB_LIST[curr_tok][0].keys()[0]
-                        entity_typ = ('VERBAL', node_repr, "NONE")
-                        all_spans.append((index, index+1, entity_typ))
-
-                    elif curr_pos[0] == 'V':
-                        node_repr = '%s-01' % curr_tok
-                        all_spans.append((index, index+1, ('-VERB-', node_repr, "NONE")))
-                    else:
-                        node_repr = curr_tok
-                        all_spans.append((index, index+1, ('-SURF-', curr_tok, "NONE")))
-
-            all_spans = sorted(all_spans, key=lambda span: (span[0], span[1]))
-            print all_spans
-            linearized_tokseq, map_repr_seq = getIndexedForm(all_spans)
-
+        shared_data.update(toks=toks, poss=poss, all_entities=all_entities, all_dates=all_dates, mle_map=mle_map)
+        for ((linearized_tokseq, map_repr_seq), log, out) in map_sentences(linearize_test_sent_captured, len(toks), args.jobs):
+            sys.stdout.write(out)
+            logger.write(log)
             print >> tokseq_wf, ' '.join(linearized_tokseq)
             print >> dev_map_wf, '##'.join(map_repr_seq)
 
@@ -873,6 +958,11 @@ if __name__ == '__main__':
     argparser.add_argument("--min_prd_freq", type=int, default=50, help="threshold for filtering predicates")
     argparser.add_argument("--min_var_freq", type=int, default=50, help="threshold for filtering non predicate variables")
     argparser.add_argument("--index_unknown", action="store_true", help="if to index the unknown predicates or non predicate variables")
+    argparser.add_argument("--jobs", type=int, default=1, help="number of processes to linearize the sentences with")
+    argparser.add_argument("--no_amr_cache", action="store_true", help="if to reparse the AMR file instead of using the parsed-AMR cache")
+    argparser.add_argument("--amr_cache_dir", type=str, help="directory of the parsed-AMR cache, defaults to the directory of the AMR file")
 
     args = argparser.parse_args()
+    if args.jobs < 1:
+        argparser.error('--jobs must be at least 1')
     linearize_amr(args)
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+'''
+Consolidated store of the word2pred_*, ent2frag_* and label2frag_* shards.
+
+The shards used to be unpickled and merged on every run of load_mappings.
+open_store merges them once into a sqlite file in the statistics directory,
+one pickled value per key, and rebuilds it only when STORE_VERSION or the
+shards (names, sizes, modification times) change. MappingStore opens the file
+on first use and unpickles only the keys that are looked up, so loading is
+immediate, and processes reading one store share it through the page cache
+instead of each holding the merged dicts.
+
+Fragments keep a reference to the graph of their sentence, which the shards
+pickled once per sentence. The store does the same: each graph, and the stats
+attached to it by setStats, is a row of its own table, values refer to it by
+id, and it is unpickled once per process when a value needs it.
+'''
+import cPickle
+import cStringIO
+import glob
+import os
+import sqlite3
+from collections import defaultdict
+
+STORE_VERSION = 2
+STORE_NAME = 'mappings.sqlite'
+MAPPING_KINDS = ('word2pred', 'ent2frag', 'label2frag')
+
+#Shards are merged in byte order of their file names, which is the order ls
+#listed the usual <kind>_<n> names in; where shards disagree, later ones win.
+def shard_files(stats_dir, kind):
+    return sorted(glob.glob(os.path.join(stats_dir, '%s_*' % kind)))
+
+def shard_signature(stats_dir):
+    fields = ['v%d' % STORE_VERSION]
+    for kind in MAPPING_KINDS:
+        for file in shard_files(stats_dir, kind):
+            st = os.stat(file)
+            fields.append('%s:%d:%d' % (os.path.basename(file), st.st_size, int(st.st_mtime)))
+    return '\n'.join(fields)
+
+def encode_key(key):
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return key
+
+def load_shard(file):
+    with open(file, 'rb') as f:
+        return cPickle.load(f)
+
+#Merge the shards the way load_mappings always did: predicate counts are summed
+#and each token keeps its most frequent predicate; for entities and labels,
+#later shards win.
+def merge_shards(stats_dir):
+    word2predicate = {}
+    for file in shard_files(stats_dir, 'word2pred'):
+        stats = load_shard(file)
+        for curr_tok in stats:
+            if curr_tok not in word2predicate:
+                word2predicate[curr_tok] = defaultdict(int)
+            for pred in stats[curr_tok]:
+                word2predicate[curr_tok][pred] += stats[curr_tok][pred]
+
+    word2most = {}
+    for tok in word2predicate:
+        pred2freq = sorted(word2predicate[tok].items(), key=lambda item: (item[1], item[0]))
+        word2most[tok] = pred2freq[-1][0]
+
+    ent2frag = {}
+    for file in shard_files(stats_dir, 'ent2frag'):
+        ent2frag.update(load_shard(file))
+
+    label2frag = {}
+    for file in shard_files(stats_dir, 'label2frag'):
+        label2frag.update(load_shard(file))
+
+    return {'word2pred': word2most, 'ent2frag': ent2frag, 'label2frag': label2frag}
+
+#Objects that many values share: the graphs of fragments and their stats
+def find_shared(mappings):
+    shared = {}
+    for kind in MAPPING_KINDS:
+        for value in mappings[kind].itervalues():
+            graph = getattr(value, 'graph', None)
+            if graph is None or id(graph) in shared:
+                continue
+            shared[id(graph)] = (len(shared), graph)
+            stats = getattr(graph, 'stats', None)
+            if stats is not None and id(stats) not in shared:
+                shared[id(stats)] = (len(shared), stats)
+    return shared
+
+#Pickle value with the shared objects other than itself replaced by their ids
+def dump_value(value, shared):
+    f = cStringIO.StringIO()
+    pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+    def persistent_id(obj):
+        if obj is not value and id(obj) in shared:
+            return str(shared[id(obj)][0])
+        return None
+    pickler.persistent_id = persistent_id
+    pickler.dump(value)
+    return sqlite3.Binary(f.getvalue())
+
+def build_store(stats_dir, store_path):
+    signature = shard_signature(stats_dir)
+    mappings = merge_shards(stats_dir)
+    shared = find_shared(mappings)
+
+    tmp_path = '%s.%d.tmp' % (store_path, os.getpid())
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)')
+    conn.execute('CREATE TABLE mappings (kind TEXT, key BLOB, value BLOB, PRIMARY KEY (kind, key))')
+    conn.execute('CREATE TABLE shared (id INTEGER PRIMARY KEY, value BLOB)')
+    conn.execute('INSERT INTO meta VALUES (?, ?)', ('signature', signature))
+    conn.executemany('INSERT INTO shared VALUES (?, ?)',
+                     ((shared_id, dump_value(obj, shared)) for (shared_id, obj) in shared.itervalues()))
+    for kind in MAPPING_KINDS:
+        conn.executemany('INSERT INTO mappings VALUES (?, ?, ?)',
+                         ((kind, sqlite3.Binary(encode_key(key)), dump_value(value, shared))
+                          for (key, value) in mappings[kind].iteritems()))
+    conn.commit()
+    conn.close()
+    os.rename(tmp_path, store_path)
+
+def store_signature(store_path):
+    if not os.path.exists(store_path):
+        return None
+    try:
+        conn = sqlite3.connect(store_path)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE name = 'signature'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+class MappingTable(object):
+    '''Read-only dict view of one kind of mapping in a MappingStore.'''
+    def __init__(self, store, kind):
+        self.store = store
+        self.kind = kind
+        self.values = {}
+
+    def lookup(self, key):
+        if key not in self.values:
+            row = self.store.connection().execute('SELECT value FROM mappings WHERE kind = ? AND key = ?',
+                                                  (self.kind, sqlite3.Binary(encode_key(key)))).fetchone()
+            self.values[key] = self.store.load_value(row[0]) if row else None
+        return self.values[key]
+
+    def __contains__(self, key):
+        return self.lookup(key) is not None
+
+    def __getitem__(self, key):
+        value = self.lookup(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self.lookup(key)
+        return default if value is None else value
+
+class MappingStore(object):
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.conn = None
+        self.conn_pid = None
+        self.shared = {}
+
+    #sqlite connections must not cross a fork, so each process opens its own
+    def connection(self):
+        if self.conn is None or self.conn_pid != os.getpid():
+            self.conn = sqlite3.connect(self.store_path)
+            self.conn_pid = os.getpid()
+        return self.conn
+
+    def load_value(self, data):
+        unpickler = cPickle.Unpickler(cStringIO.StringIO(str(data)))
+        unpickler.persistent_load = self.load_shared
+        return unpickler.load()
+
+    def load_shared(self, shared_id):
+        if shared_id not in self.shared:
+            row = self.connection().execute('SELECT value FROM shared WHERE id = ?', (int(shared_id),)).fetchone()
+            self.shared[shared_id] = self.load_value(row[0])
+        return self.shared[shared_id]
+
+    def table(self, kind):
+        assert kind in MAPPING_KINDS, kind
+        return MappingTable(self, kind)
+
+#Open the mapping store of stats_dir, building it from the shards if it is missing or stale
+def open_store(stats_dir):
+    store_path = os.path.join(stats_dir, STORE_NAME)
+    if store_signature(store_path) != shard_signature(stats_dir):
+        build_store(stats_dir, store_path)
+    return MappingStore(store_path)
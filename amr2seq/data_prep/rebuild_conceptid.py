@@ -9,6 +9,8 @@ import hypergraph
 from fragment_hypergraph import FragmentHGNode, FragmentHGEdge
 from amr_graph import *
 from amr_utils import *
+from amr_cache import load_cached
+from mapping_store import open_store
 import logger
 import gflags
 from HRGSample import *
@@ -111,52 +113,10 @@ def read_sentence(input_f):
             return sent_map
     return []
 
+#Mappings from the statistics shards, read lazily from the consolidated mapping store
 def load_mappings(stats_dir):
-    word2pred_files = os.popen('ls %s/word2pred_*' % stats_dir).read().split()
-    ent2frag_files = os.popen('ls %s/ent2frag_*' % stats_dir).read().split()
-    label2frag_files = os.popen('ls %s/label2frag_*' % stats_dir).read().split()
-
-    #assert len(stats_files) == 8
-    word2predicate = {}
-    ent2frag = {}
-    label2frag = {}
-
-    stop_words = set([line.strip() for line in open('./stop_words', 'r')])
-    non_map_words = set(['am', 'is', 'are', 'be', 'a', 'an', 'the'])
-
-    unknown_set = set()
-
-    for file in word2pred_files:
-        f = open(file, 'rb')
-        stats = cPickle.load(f)
-
-        for curr_tok in stats:
-            if curr_tok not in word2predicate:
-                word2predicate[curr_tok] = defaultdict(int)
-            for pred in stats[curr_tok]:
-                word2predicate[curr_tok][pred] += stats[curr_tok][pred]
-
-    word2most = {}
-    for tok in word2predicate:
-        pred2freq = sorted(word2predicate[tok].items(), key=lambda item: (item[1], item[0]))
-        word2most[tok] = pred2freq[-1][0]
-
-    for file in ent2frag_files:
-
-        f = open(file, 'rb')
-        stats = cPickle.load(f)
-
-        for ent in stats:
-            ent2frag[ent] = stats[ent]
-
-    for file in label2frag_files:
-        f = open(file, 'rb')
-        stats = cPickle.load(f)
-
-        for label in stats:
-            label2frag[label] = stats[label]
-
-    return (word2most, ent2frag, label2frag)
+    store = open_store(stats_dir)
+    return (store.table('word2pred'), store.table('ent2frag'), store.table('label2frag'))
 
 def preprocess_tok(toks, aligned_toks):
     for (i, tok) in enumerate(toks):
@@ -197,15 +157,8 @@ def concept_id(args):
     special_words = set(['a', 'the', 'an', 'it', 'its', 'are', 'been', 'have', 'has', 'had'])
     begin_words = set(['if', 'it'])
 
-    tok_map = {}
-    lemma_map = {}
-    tok_f = open(args.tok_map, 'rb')
-    tok_map = cPickle.load(tok_f)
-    tok_f.close()
-
-    lemma_f = open(args.lemma_map, 'rb')
-    lemma_map = cPickle.load(lemma_f)
-    lemma_f.close()
+    tok_map = load_top_index(args.tok_map)
+    lemma_map = load_top_index(args.lemma_map)
 
     new_tok_f = open('%s.temp' % args.tok_file, 'w')
     new_lemma_f = open('%s.temp' % args.lemma_file, 'w')
@@ -267,11 +220,7 @@ def concept_id(args):
             curr_ent = '_'.join(toks[start:end])
             curr_lex = ' '.join(toks[start:end])
             if curr_lex in tok_map:
-                items = tok_map[curr_lex][''].items()
-                assert len(items) > 0
-                items = sorted(items, key=lambda it: it[1])
-
-                (lhs, frag_part) = items[-1][0]
+                (lhs, frag_part) = tok_map[curr_lex][''][0]
                 if lhs.strip() == 'Nothing':
                     continue
 
@@ -541,83 +490,58 @@ def wrong_ext(item):
         return True
     return False
 
+#The top candidate of every context of every surface string in a pickled
+#{surface: {context: {(lhs, frag_str): count}}} map, as
+#{surface: {context: ((lhs, frag_str), whether find_maps may use it)}}
+def build_top_index(map_file):
+    with open(map_file, 'rb') as map_f:
+        count_map = cPickle.load(map_f)
+    top_index = {}
+    for (surface, ctx_map) in count_map.iteritems():
+        curr_tops = {}
+        for (ctx_typ, counts) in ctx_map.iteritems():
+            curr_item = top_item(counts)
+            curr_tops[ctx_typ] = (curr_item, not (is_entity(curr_item) or wrong_ext(curr_item)))
+        top_index[surface] = curr_tops
+    return top_index
+
+#Load the top-candidate index of a tok or lemma map, built once and saved next to the map
+def load_top_index(map_file):
+    return load_cached(map_file, 'top', build_top_index)
+
+def first_usable(tops, ctx_groups):
+    for ctx_typ in ctx_groups:
+        if ctx_typ in tops:
+            (curr_item, usable) = tops[ctx_typ]
+            if usable:
+                return curr_item
+    return None
+
+#tok_map and lemma_map are top-candidate indexes from load_top_index
 def find_maps(seq_str, lem_seq_str, tok_map, lemma_map, contexts):
-    if seq_str in tok_map or lem_seq_str in lemma_map:
-        (word_groups, lemma_groups, second_word_groups, second_lemma_groups, pos_tag_groups) = get_groups(contexts)
-
-    if seq_str in tok_map:
-        for ctx_typ in word_groups:
-            if ctx_typ in tok_map[seq_str]:
-                curr_item = top_item(tok_map[seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        for ctx_typ in lemma_groups:
-            if ctx_typ in tok_map[seq_str]:
-                curr_item = top_item(tok_map[seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        for ctx_typ in second_word_groups:
-            if ctx_typ in tok_map[seq_str]:
-                curr_item = top_item(tok_map[seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        for ctx_typ in second_lemma_groups:
-            if ctx_typ in tok_map[seq_str]:
-                curr_item = top_item(tok_map[seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-    if lem_seq_str in lemma_map:
-        for ctx_typ in word_groups:
-            if ctx_typ in lemma_map[lem_seq_str]:
-                curr_item = top_item(lemma_map[lem_seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        for ctx_typ in lemma_groups:
-            if ctx_typ in lemma_map[lem_seq_str]:
-                curr_item = top_item(lemma_map[lem_seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        for ctx_typ in second_word_groups:
-            if ctx_typ in lemma_map[lem_seq_str]:
-                curr_item = top_item(lemma_map[lem_seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        for ctx_typ in second_lemma_groups:
-            if ctx_typ in lemma_map[lem_seq_str]:
-                curr_item = top_item(lemma_map[lem_seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-    if seq_str in tok_map:
-        for ctx_typ in pos_tag_groups:
-            if ctx_typ in tok_map[seq_str]:
-                curr_item = top_item(tok_map[seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        assert '' in tok_map[seq_str]
-        curr_item = top_item(tok_map[seq_str][''])
-        if not (is_entity(curr_item) or wrong_ext(curr_item)):
-            return curr_item
-
-    if lem_seq_str in lemma_map:
-        for ctx_typ in pos_tag_groups:
-            if ctx_typ in lemma_map[lem_seq_str]:
-                curr_item = top_item(lemma_map[lem_seq_str][ctx_typ])
-                if not (is_entity(curr_item) or wrong_ext(curr_item)):
-                    return curr_item
-
-        assert '' in lemma_map[lem_seq_str]
-        curr_item = top_item(lemma_map[lem_seq_str][''])
-        if not (is_entity(curr_item) or wrong_ext(curr_item)):
-            return curr_item
+    tok_tops = tok_map.get(seq_str)
+    lemma_tops = lemma_map.get(lem_seq_str)
+    if tok_tops is None and lemma_tops is None:
+        return None
+
+    (word_groups, lemma_groups, second_word_groups, second_lemma_groups, pos_tag_groups) = get_groups(contexts)
+    first_groups = word_groups + lemma_groups + second_word_groups + second_lemma_groups
+    for tops in (tok_tops, lemma_tops):
+        if tops is not None:
+            curr_item = first_usable(tops, first_groups)
+            if curr_item:
+                return curr_item
+
+    for tops in (tok_tops, lemma_tops):
+        if tops is not None:
+            curr_item = first_usable(tops, pos_tag_groups)
+            if curr_item:
+                return curr_item
+
+            assert '' in tops
+            (curr_item, usable) = tops['']
+            if usable:
+                return curr_item
 
     return None
 
@@ -625,11 +549,7 @@ def retrieve_map(tok, tok_map):
     if tok not in tok_map:
         return (False, None)
 
-    items = tok_map[tok][''].items()
-    assert len(items) > 0
-    items = sorted(items, key=lambda it: it[1])
-
-    (lhs, frag_part) = items[-1][0]
+    (lhs, frag_part) = tok_map[tok][''][0]
     if lhs.strip() == 'Nothing':
         return (False, None)
 
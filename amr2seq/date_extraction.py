@@ -19,6 +19,8 @@ def monthAbbre(month_map):
         abbr_map[abbr_m] = month_map[m]
     return abbr_map
 
+abbr_months = monthAbbre(months)
+
 def lowerMap(orig_map):
     new_map = {}
     for tok in orig_map:
@@ -32,31 +34,22 @@ def lowerSet(orig_set):
         new_set.add(tok.lower())
     return new_set
 
-def extractTemplate(s):
-    fields = s.split()
-    template = []
-    #month_map = lowerMap(months)
-    month_map = months
-    abbr_month = monthAbbre(month_map)
-
-    #day_map = lowerSet(days)
-    day_map = days
-    #abbr_day = monthAbbre(day_map)
+#The template field of a single token
+def tokenClass(tok):
+    if isYear(tok):
+        return 'YEAR'
+    elif tok in months or tok in abbr_months:
+        return 'MONTH'
+    elif tok in days:
+        return 'DAY'
+    elif tok in day_zone:
+        return 'DAY_ZONE'
+    elif isNum(tok):
+        return 'NUM%d' % len(tok)
+    return tok
 
-    for tok in fields:
-        if isYear(tok):
-            template.append('YEAR')
-        elif tok in month_map or tok in abbr_month:
-            template.append('MONTH')
-        elif tok in day_map:
-            template.append('DAY')
-        elif tok in day_zone:
-            template.append('DAY_ZONE')
-        elif isNum(tok):
-            template.append('NUM%d' % len(tok))
-        else:
-            template.append(tok)
-    return ' '.join(template)
+def extractTemplate(s):
+    return ' '.join([tokenClass(tok) for tok in s.split()])
 
 def dateRepr(toks):
     rels = []
@@ -139,6 +132,55 @@ def loadTemplates(file):
             temp_map[fields[0]] = int(fields[1])
     return temp_map
 
+#Compile the template map into a trie over token classes. Each node maps a
+#token class to its child node, and None to the template ending at the node.
+def buildTemplateTrie(tempt_map):
+    trie = {}
+    for tempt in tempt_map:
+        fields = tempt.split()
+        if ' '.join(fields) != tempt: #Can never equal a joined template
+            continue
+        node = trie
+        for field in fields:
+            node = node.setdefault(field, {})
+        node[None] = tempt
+    return trie
+
+#Whether a span starting with token tok and matching template tempt is a date
+def isDateSpan(tempt, tok):
+    if tempt == 'NUM1' or tempt == 'NUM2' or tempt == 'NUM3' or tempt == 'DAY_ZONE':
+        return False
+    if tempt == 'NUM6':
+        month = int(tok[2:4])
+        if month > 12:
+            return False
+        day = int(tok[4:])
+        if day > 31:
+            return False
+    return True
+
+#Scan the tokens from left to right, taking the longest date span at each start
+def matchDates(toks, tempt_trie):
+    classes = [tokenClass(tok) for tok in toks]
+    n_toks = len(toks)
+    dates_in_line = []
+    start = 0
+    while start < n_toks:
+        node = tempt_trie
+        longest_end = None
+        for end in xrange(start, n_toks):
+            node = node.get(classes[end])
+            if node is None:
+                break
+            if None in node and isDateSpan(node[None], toks[start]):
+                longest_end = end + 1
+        if longest_end is None:
+            start += 1
+        else:
+            dates_in_line.append((start, longest_end))
+            start = longest_end
+    return dates_in_line
+
 def isYear(tok):
     if isNum(tok) and len(tok) == 4:
         first_two = int(tok[:2])
@@ -176,41 +218,12 @@ def mergeDates(dates_in_line, toks):
     return new_spans
 
 def extractDates(file, template_file):
-    tempt_map = loadTemplates(template_file)
+    tempt_trie = buildTemplateTrie(loadTemplates(template_file))
     for line in open(file):
         if line.strip():
             #print line.strip()
-            dates_in_line = []
             toks = line.strip().split()
-            n_toks = len(toks)
-            aligned = set()
-            for start in xrange(n_toks):
-                if start in aligned:
-                    continue
-                for length in xrange(n_toks+1, 0, -1):
-                    end = start + length
-                    if end > n_toks:
-                        continue
-
-                    span_set = set(xrange(start, end))
-                    if len(span_set & aligned) != 0:
-                        continue
-
-                    curr_tempt = extractTemplate(' '.join(toks[start:end]))
-                    if curr_tempt in tempt_map:
-                        if curr_tempt == 'NUM1' or curr_tempt == 'NUM2' or curr_tempt == 'NUM3' or curr_tempt == 'DAY_ZONE':
-                            continue
-                        if curr_tempt == 'NUM6':
-                            month = int(toks[start][2:4])
-                            if month > 12:
-                                continue
-                            day = int(toks[start][4:])
-                            if day > 31:
-                                continue
-
-                        dates_in_line.append((start, end))
-                        aligned |= span_set
-                        break
+            dates_in_line = matchDates(toks, tempt_trie)
             #print dates_in_line
             dates_in_line = mergeDates(dates_in_line, toks)
             dates_in_line = ['%d-%d' % (start ,end) for (start, end) in dates_in_line]
@@ -124,7 +124,6 @@ def compute_files(user1, user2, file_list, dir_pre, start_num):
         match_total += best_match_num
         test_total += (len(test_inst) + len(test_rel1) + len(test_rel2))
         gold_total += (len(gold_inst) + len(gold_rel1) + len(gold_rel2))
-        smatch.match_triple_dict.clear()
     (precision, recall, f_score) = smatch.compute_f(match_total, test_total, gold_total)
     return "%.2f" % f_score
 
@@ -8,14 +8,33 @@ For detailed description of smatch, see http://www.isi.edu/natural-language/amr/
 """
 
 import amr
+import array
+import collections
+import itertools
+import multiprocessing
 import os
 import random
 import sys
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only needed by the vectorized hill-climbing engine (--engine numpy)
+    np = None
+
 # total number of iteration in smatch computation
 iteration_num = 5
 
+# adaptive restart number: if positive, an AMR pair gets one random restart per restart_nodes nodes
+# of its larger AMR, but never more than iteration_num - 1 restarts.
+# Default 0 (always iteration_num - 1 restarts)
+restart_nodes = 0
+
+# time budget of one AMR pair in seconds. No random restart is started once it is used up.
+# Default 0 (no time budget)
+pair_time_budget = 0
+
 # verbose output switch.
 # Default false (no verbose output)
 verbose = False
@@ -24,6 +43,11 @@ verbose = False
 # Default true (compute a single score for all AMRs in two files)
 single_score = True
 
+# hill-climbing engine.
+# "dict" (default) evaluates move/swap gains one by one on weight_dict,
+# "numpy" compiles weight_dict into arrays and scores all gains in bulk
+engine = "dict"
+
 # precision and recall output switch.
 # Default false (do not output precision and recall, just output F score)
 pr_flag = False
@@ -34,10 +58,70 @@ ERROR_LOG = sys.stderr
 # Debug log location
 DEBUG_LOG = sys.stderr
 
-# dictionary to save pre-computed node mapping and its resulting triple match count
-# key: tuples of node mapping
-# value: the matching triple count
-match_triple_dict = {}
+# maximum number of node mappings whose triple match count is cached for one AMR pair
+match_cache_size = 100000
+
+
+class AMRParseError(Exception):
+    """
+    Raised by score_amr_pair when an AMR of the pair cannot be parsed or its nodes cannot be renamed
+
+    """
+    pass
+
+
+class MatchCache(object):
+    """
+    LRU cache of pre-computed node mappings and their resulting triple match count.
+    Key: the node mapping packed into a string of 32-bit integers (much smaller than a tuple of the whole mapping).
+         hash(tuple(mapping)) would be smaller still, but different mappings of small integers often share a hash.
+    Value: the matching triple count
+    One cache is only valid for the weight_dict of one AMR pair. get_best_match() creates a new one for every call,
+    so the matching functions can be used by several threads at the same time.
+
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = match_cache_size
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, mapping):
+        """
+        Return the saved triple match count of mapping, or None if it is not cached
+
+        """
+        key = array.array('i', mapping).tostring()
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        # re-insert as the most recently used entry
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, mapping, match_num):
+        """
+        Save the triple match count of mapping, evicting the least recently used entry if the cache is full
+
+        """
+        key = array.array('i', mapping).tostring()
+        self.entries.pop(key, None)
+        self.entries[key] = match_num
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
 
 
 def get_amr_line(input_f):
@@ -82,6 +166,23 @@ def build_arg_parser():
                              'instead of a single document-level smatch score (Default: false)')
     parser.add_argument('--pr', action='store_true', default=False,
                         help="Output precision and recall as well as the f-score. Default: false")
+    parser.add_argument('--engine', choices=['dict', 'numpy'], default='dict',
+                        help="Hill-climbing engine. numpy gives the same result and is faster on large AMRs. "
+                             "Default: dict")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of processes scoring AMR pairs in parallel (Default: 1)")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Seed the random restarts of every AMR pair from this number and the pair number, "
+                             "so that scores are reproducible (Default: 0 with --jobs, otherwise unseeded)")
+    parser.add_argument('--restart_nodes', type=int, default=0,
+                        help="Give an AMR pair one random restart per this many nodes of its larger AMR, "
+                             "up to the restart number. Default: 0 (always use the restart number)")
+    parser.add_argument('--time_budget', type=float, default=0,
+                        help="Do not start another random restart after this many seconds on one AMR pair. "
+                             "Default: 0 (no budget)")
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help="Print the restart and hill-climbing iteration numbers of every AMR pair "
+                             "to stderr. Default: false")
     return parser
 
 
@@ -102,13 +203,31 @@ def build_arg_parser2():
                            'a single document-level smatch score (Default: False)')
     parser.add_option('--pr', "--precision_recall", action='store_true', dest="pr",
                       help="Output precision and recall as well as the f-score. Default: false")
-    parser.set_defaults(r=4, v=False, ms=False, pr=False)
+    parser.add_option("--engine", dest="engine", type="choice", choices=["dict", "numpy"],
+                      help="Hill-climbing engine. numpy gives the same result and is faster on large AMRs. "
+                           "Default: dict")
+    parser.add_option("--jobs", dest="jobs", type="int",
+                      help="Number of processes scoring AMR pairs in parallel (Default: 1)")
+    parser.add_option("--seed", dest="seed", type="int",
+                      help="Seed the random restarts of every AMR pair from this number and the pair number, "
+                           "so that scores are reproducible (Default: 0 with --jobs, otherwise unseeded)")
+    parser.add_option("--restart_nodes", dest="restart_nodes", type="int",
+                      help="Give an AMR pair one random restart per this many nodes of its larger AMR, "
+                           "up to the restart number (Default: 0, always use the restart number)")
+    parser.add_option("--time_budget", dest="time_budget", type="float",
+                      help="Do not start another random restart after this many seconds on one AMR pair "
+                           "(Default: 0, no budget)")
+    parser.add_option("--stats", action='store_true', dest="stats",
+                      help="Print the restart and hill-climbing iteration numbers of every AMR pair to stderr "
+                           "(Default: false)")
+    parser.set_defaults(r=4, v=False, ms=False, pr=False, engine="dict", jobs=1, seed=None,
+                        restart_nodes=0, time_budget=0, stats=False)
     return parser
 
 
 def get_best_match(instance1, attribute1, relation1,
                    instance2, attribute2, relation2,
-                   prefix1, prefix2):
+                   prefix1, prefix2, rng=None, cache=None, stats=None):
     """
     Get the highest triple match number between two sets of triples via hill-climbing.
     Arguments:
@@ -120,11 +239,17 @@ def get_best_match(instance1, attribute1, relation1,
         relation2: relation triples of AMR 2 (relation name, node 1 name, node 2 name)
         prefix1: prefix label for AMR 1
         prefix2: prefix label for AMR 2
+        rng: random.Random instance for the initial mappings (optional, default: reseeded module random)
+        cache: MatchCache for this AMR pair (optional, default: a new one)
+        stats: dictionary to fill with the search statistics (optional): "restarts" (random restarts run),
+               "iterations" (hill-climbing steps taken in all rounds) and "stop" (why the search ended:
+               "bound", "time" or "restarts")
     Returns:
         best_match: the node mapping that results in the highest triple matching number
         best_match_num: the highest triple matching number
 
     """
+    start_time = time.time()
     # Compute candidate pool - all possible node match candidates.
     # In the hill-climbing, we only consider candidate in this pool to save computing time.
     # weight_dict is a dictionary that maps a pair of node
@@ -136,34 +261,67 @@ def get_best_match(instance1, attribute1, relation1,
         print >> DEBUG_LOG, candidate_mappings
         print >> DEBUG_LOG, "Weight dictionary"
         print >> DEBUG_LOG, weight_dict
+    if cache is None:
+        cache = MatchCache()
+    if engine == "numpy":
+        weight_arrays = compile_weight_dict(weight_dict, candidate_mappings, len(instance1), len(instance2))
+    # no mapping can match more triples than the smaller AMR has
+    match_bound = min(len(instance1) + len(attribute1) + len(relation1),
+                      len(instance2) + len(attribute2) + len(relation2))
+    round_num = iteration_num
+    if restart_nodes > 0:
+        node_num = max(len(instance1), len(instance2))
+        round_num = min(iteration_num, 1 + (node_num + restart_nodes - 1) // restart_nodes)
+    if stats is None:
+        stats = {}
+    stats["restarts"] = 0
+    stats["iterations"] = 0
+    stats["stop"] = "restarts"
     best_match_num = 0
     # initialize best match mapping
     # the ith entry is the node index in AMR 2 which maps to the ith node in AMR 1
     best_mapping = [-1] * len(instance1)
-    for i in range(0, iteration_num):
+    for i in range(0, round_num):
+        if i > 0:
+            if best_match_num >= match_bound:
+                # the best possible mapping is found already
+                stats["stop"] = "bound"
+                break
+            if 0 < pair_time_budget <= time.time() - start_time:
+                stats["stop"] = "time"
+                break
+            stats["restarts"] += 1
         if verbose:
             print >> DEBUG_LOG, "Iteration", i
         if i == 0:
             # smart initialization used for the first round
-            cur_mapping = smart_init_mapping(candidate_mappings, instance1, instance2)
+            cur_mapping = smart_init_mapping(candidate_mappings, instance1, instance2, rng)
         else:
             # random initialization for the other round
-            cur_mapping = random_init_mapping(candidate_mappings)
+            cur_mapping = random_init_mapping(candidate_mappings, rng)
+        if engine == "numpy":
+            (cur_mapping, match_num, climb_num) = hill_climb_numpy(cur_mapping, weight_arrays)
+            stats["iterations"] += climb_num
+            if match_num > best_match_num:
+                best_mapping = cur_mapping[:]
+                best_match_num = match_num
+            continue
         # compute current triple match number
-        match_num = compute_match(cur_mapping, weight_dict)
+        match_num = compute_match(cur_mapping, weight_dict, cache)
         if verbose:
             print >> DEBUG_LOG, "Node mapping at start", cur_mapping
             print >> DEBUG_LOG, "Triple match number at start:", match_num
         while True:
             # get best gain
             (gain, new_mapping) = get_best_gain(cur_mapping, candidate_mappings, weight_dict,
-                                                len(instance2), match_num)
+                                                len(instance2), match_num, cache)
             if verbose:
                 print >> DEBUG_LOG, "Gain after the hill-climbing", gain
             # hill-climbing until there will be no gain for new node mapping
             if gain <= 0:
                 break
             # otherwise update match_num and mapping
+            stats["iterations"] += 1
             match_num += gain
             cur_mapping = new_mapping[:]
             if verbose:
@@ -172,6 +330,10 @@ def get_best_match(instance1, attribute1, relation1,
         if match_num > best_match_num:
             best_mapping = cur_mapping[:]
             best_match_num = match_num
+    if verbose and engine != "numpy":
+        print >> DEBUG_LOG, "Match cache hits:", cache.hits, "misses:", cache.misses, "size:", len(cache)
+    if best_match_num >= match_bound:
+        stats["stop"] = "bound"
     return best_mapping, best_match_num
 
 
@@ -202,18 +364,17 @@ def compute_pool(instance1, attribute1, relation1,
 
 
     """
-    candidate_mapping = []
+    candidate_mapping = [set() for _ in instance1]
     weight_dict = {}
-    for i in range(0, len(instance1)):
-        # each candidate mapping is a set of node indices
-        candidate_mapping.append(set())
-        for j in range(0, len(instance2)):
-            # if both triples are instance triples and have the same value
-            if instance1[i][0].lower() == instance2[j][0].lower() \
-                    and instance1[i][2].lower() == instance2[j][2].lower():
-                # get node index by stripping the prefix
-                node1_index = int(instance1[i][1][len(prefix1):])
-                node2_index = int(instance2[j][1][len(prefix2):])
+    # Triples of AMR 2 are indexed by their lowercased relation name (and value), and each triple of AMR 1 is only
+    # joined with its bucket, instead of being compared with every triple of AMR 2.
+    # Buckets keep the triple order, so the pool is built in the same order as by comparing all pairs.
+    for (triples1, index2) in ((instance1, index_triples(instance2, prefix2)),
+                               (attribute1, index_triples(attribute2, prefix2))):
+        for (name, node1, value) in triples1:
+            node1_index = int(node1[len(prefix1):])
+            # if both triples are instance triples (or attribute triples) and have the same value
+            for node2_index in index2.get((name.lower(), value.lower()), ()):
                 candidate_mapping[node1_index].add(node2_index)
                 node_pair = (node1_index, node2_index)
                 # use -1 as key in weight_dict for instance triples and attribute triples
@@ -222,83 +383,89 @@ def compute_pool(instance1, attribute1, relation1,
                 else:
                     weight_dict[node_pair] = {}
                     weight_dict[node_pair][-1] = 1
-    for i in range(0, len(attribute1)):
-        for j in range(0, len(attribute2)):
-            # if both attribute relation triple have the same relation name and value
-            if attribute1[i][0].lower() == attribute2[j][0].lower() \
-                    and attribute1[i][2].lower() == attribute2[j][2].lower():
-                node1_index = int(attribute1[i][1][len(prefix1):])
-                node2_index = int(attribute2[j][1][len(prefix2):])
-                candidate_mapping[node1_index].add(node2_index)
-                node_pair = (node1_index, node2_index)
-                # use -1 as key in weight_dict for instance triples and attribute triples
-                if node_pair in weight_dict:
-                    weight_dict[node_pair][-1] += 1
-                else:
-                    weight_dict[node_pair] = {}
-                    weight_dict[node_pair][-1] = 1
-    for i in range(0, len(relation1)):
-        for j in range(0, len(relation2)):
-            # if both relation share the same name
-            if relation1[i][0].lower() == relation2[j][0].lower():
-                node1_index_amr1 = int(relation1[i][1][len(prefix1):])
-                node1_index_amr2 = int(relation2[j][1][len(prefix2):])
-                node2_index_amr1 = int(relation1[i][2][len(prefix1):])
-                node2_index_amr2 = int(relation2[j][2][len(prefix2):])
-                # add mapping between two nodes
-                candidate_mapping[node1_index_amr1].add(node1_index_amr2)
-                candidate_mapping[node2_index_amr1].add(node2_index_amr2)
-                node_pair1 = (node1_index_amr1, node1_index_amr2)
-                node_pair2 = (node2_index_amr1, node2_index_amr2)
-                if node_pair2 != node_pair1:
-                    # update weight_dict weight. Note that we need to update both entries for future search
-                    # i.e weight_dict[node_pair1][node_pair2]
-                    #     weight_dict[node_pair2][node_pair1]
-                    if node1_index_amr1 > node2_index_amr1:
-                        # swap node_pair1 and node_pair2
-                        node_pair1 = (node2_index_amr1, node2_index_amr2)
-                        node_pair2 = (node1_index_amr1, node1_index_amr2)
-                    if node_pair1 in weight_dict:
-                        if node_pair2 in weight_dict[node_pair1]:
-                            weight_dict[node_pair1][node_pair2] += 1
-                        else:
-                            weight_dict[node_pair1][node_pair2] = 1
+    relation_index2 = {}
+    for (name, node1, node2) in relation2:
+        relation_index2.setdefault(name.lower(), []).append((int(node1[len(prefix2):]),
+                                                             int(node2[len(prefix2):])))
+    for (name, node1, node2) in relation1:
+        node1_index_amr1 = int(node1[len(prefix1):])
+        node2_index_amr1 = int(node2[len(prefix1):])
+        # if both relation share the same name
+        for (node1_index_amr2, node2_index_amr2) in relation_index2.get(name.lower(), ()):
+            # add mapping between two nodes
+            candidate_mapping[node1_index_amr1].add(node1_index_amr2)
+            candidate_mapping[node2_index_amr1].add(node2_index_amr2)
+            node_pair1 = (node1_index_amr1, node1_index_amr2)
+            node_pair2 = (node2_index_amr1, node2_index_amr2)
+            if node_pair2 != node_pair1:
+                # update weight_dict weight. Note that we need to update both entries for future search
+                # i.e weight_dict[node_pair1][node_pair2]
+                #     weight_dict[node_pair2][node_pair1]
+                if node1_index_amr1 > node2_index_amr1:
+                    # swap node_pair1 and node_pair2
+                    node_pair1 = (node2_index_amr1, node2_index_amr2)
+                    node_pair2 = (node1_index_amr1, node1_index_amr2)
+                if node_pair1 in weight_dict:
+                    if node_pair2 in weight_dict[node_pair1]:
+                        weight_dict[node_pair1][node_pair2] += 1
                     else:
-                        weight_dict[node_pair1] = {}
-                        weight_dict[node_pair1][-1] = 0
                         weight_dict[node_pair1][node_pair2] = 1
-                    if node_pair2 in weight_dict:
-                        if node_pair1 in weight_dict[node_pair2]:
-                            weight_dict[node_pair2][node_pair1] += 1
-                        else:
-                            weight_dict[node_pair2][node_pair1] = 1
+                else:
+                    weight_dict[node_pair1] = {}
+                    weight_dict[node_pair1][-1] = 0
+                    weight_dict[node_pair1][node_pair2] = 1
+                if node_pair2 in weight_dict:
+                    if node_pair1 in weight_dict[node_pair2]:
+                        weight_dict[node_pair2][node_pair1] += 1
                     else:
-                        weight_dict[node_pair2] = {}
-                        weight_dict[node_pair2][-1] = 0
                         weight_dict[node_pair2][node_pair1] = 1
                 else:
-                    # two node pairs are the same. So we only update weight_dict once.
-                    # this generally should not happen.
-                    if node_pair1 in weight_dict:
-                        weight_dict[node_pair1][-1] += 1
-                    else:
-                        weight_dict[node_pair1] = {}
-                        weight_dict[node_pair1][-1] = 1
+                    weight_dict[node_pair2] = {}
+                    weight_dict[node_pair2][-1] = 0
+                    weight_dict[node_pair2][node_pair1] = 1
+            else:
+                # two node pairs are the same. So we only update weight_dict once.
+                # this generally should not happen.
+                if node_pair1 in weight_dict:
+                    weight_dict[node_pair1][-1] += 1
+                else:
+                    weight_dict[node_pair1] = {}
+                    weight_dict[node_pair1][-1] = 1
     return candidate_mapping, weight_dict
 
 
-def smart_init_mapping(candidate_mapping, instance1, instance2):
+def index_triples(triples, prefix):
+    """
+    Index instance or attribute triples by their lowercased relation name and value
+    Arguments:
+        triples: instance triples or attribute triples (relation name, node name, value)
+        prefix: prefix label of the node names
+    Returns:
+        a dictionary from (lowercased relation, lowercased value) to the list of node indices of the
+        matching triples, in triple order
+
+    """
+    index = {}
+    for (name, node, value) in triples:
+        index.setdefault((name.lower(), value.lower()), []).append(int(node[len(prefix):]))
+    return index
+
+
+def smart_init_mapping(candidate_mapping, instance1, instance2, rng=None):
     """
     Initialize mapping based on the concept mapping (smart initialization)
     Arguments:
         candidate_mapping: candidate node match list
         instance1: instance triples of AMR 1
         instance2: instance triples of AMR 2
+        rng: random.Random instance (optional). If not given, the module random is reseeded and used.
     Returns:
         initialized node mapping between two AMRs
 
     """
-    random.seed()
+    if rng is None:
+        random.seed()
+        rng = random
     matched_dict = {}
     result = []
     # list to store node indices that have no concept match
@@ -327,7 +494,7 @@ def smart_init_mapping(candidate_mapping, instance1, instance2):
         candidates = list(candidate_mapping[i])
         while len(candidates) > 0:
             # get a random node index from candidates
-            rid = random.randint(0, len(candidates) - 1)
+            rid = rng.randint(0, len(candidates) - 1)
             if candidates[rid] in matched_dict:
                 candidates.pop(rid)
             else:
@@ -337,17 +504,20 @@ def smart_init_mapping(candidate_mapping, instance1, instance2):
     return result
 
 
-def random_init_mapping(candidate_mapping):
+def random_init_mapping(candidate_mapping, rng=None):
     """
     Generate a random node mapping.
     Args:
         candidate_mapping: candidate_mapping: candidate node match list
+        rng: random.Random instance (optional). If not given, the module random is reseeded and used.
     Returns:
         randomly-generated node mapping between two AMRs
 
     """
-    # if needed, a fixed seed could be passed here to generate same random (to help debugging)
-    random.seed()
+    # pass a seeded rng to generate same random mappings (to help debugging)
+    if rng is None:
+        random.seed()
+        rng = random
     matched_dict = {}
     result = []
     for c in candidate_mapping:
@@ -359,7 +529,7 @@ def random_init_mapping(candidate_mapping):
         found = False
         while len(candidates) > 0:
             # randomly generate an index in [0, length of candidates)
-            rid = random.randint(0, len(candidates) - 1)
+            rid = rng.randint(0, len(candidates) - 1)
             # check if it has already been matched
             if candidates[rid] in matched_dict:
                 candidates.pop(rid)
@@ -373,11 +543,12 @@ def random_init_mapping(candidate_mapping):
     return result
 
 
-def compute_match(mapping, weight_dict):
+def compute_match(mapping, weight_dict, cache=None):
     """
     Given a node mapping, compute match number based on weight_dict.
     Args:
     mappings: a list of node index in AMR 2. The ith element (value j) means node i in AMR 1 maps to node j in AMR 2.
+    cache: MatchCache of the AMR pair (optional)
     Returns:
     matching triple number
     Complexity: O(m*n) , m is the node number of AMR 1, n is the node number of AMR 2
@@ -387,10 +558,12 @@ def compute_match(mapping, weight_dict):
     if verbose:
         print >> DEBUG_LOG, "Computing match for mapping"
         print >> DEBUG_LOG, mapping
-    if tuple(mapping) in match_triple_dict:
-        if verbose:
-            print >> DEBUG_LOG, "saved value", match_triple_dict[tuple(mapping)]
-        return match_triple_dict[tuple(mapping)]
+    if cache is not None:
+        saved_num = cache.get(mapping)
+        if saved_num is not None:
+            if verbose:
+                print >> DEBUG_LOG, "saved value", saved_num
+            return saved_num
     match_num = 0
     # i is node index in AMR 1, m is node index in AMR 2
     for i, m in enumerate(mapping):
@@ -420,12 +593,13 @@ def compute_match(mapping, weight_dict):
                     print >> DEBUG_LOG, "relation match with", key, weight_dict[current_node_pair][key]
     if verbose:
         print >> DEBUG_LOG, "match computing complete, result:", match_num
-    # update match_triple_dict
-    match_triple_dict[tuple(mapping)] = match_num
+    # update the match cache
+    if cache is not None:
+        cache.put(mapping, match_num)
     return match_num
 
 
-def move_gain(mapping, node_id, old_id, new_id, weight_dict, match_num):
+def move_gain(mapping, node_id, old_id, new_id, weight_dict, match_num, cache=None):
     """
     Compute the triple match number gain from the move operation
     Arguments:
@@ -435,6 +609,7 @@ def move_gain(mapping, node_id, old_id, new_id, weight_dict, match_num):
         new_id: new node in to which node_id is mapped
         weight_dict: weight dictionary
         match_num: the original triple matching number
+        cache: MatchCache of the AMR pair (optional)
     Returns:
         the triple match gain number (might be negative)
 
@@ -447,8 +622,10 @@ def move_gain(mapping, node_id, old_id, new_id, weight_dict, match_num):
     new_mapping_list = mapping[:]
     new_mapping_list[node_id] = new_id
     # if this mapping is already been investigated, use saved one to avoid duplicate computing
-    if tuple(new_mapping_list) in match_triple_dict:
-        return match_triple_dict[tuple(new_mapping_list)] - match_num
+    if cache is not None:
+        saved_num = cache.get(new_mapping_list)
+        if saved_num is not None:
+            return saved_num - match_num
     gain = 0
     # add the triple match incurred by new_mapping to gain
     if new_mapping in weight_dict:
@@ -466,12 +643,13 @@ def move_gain(mapping, node_id, old_id, new_id, weight_dict, match_num):
                 gain -= weight_dict[old_mapping][-1]
             elif mapping[k[0]] == k[1]:
                 gain -= weight_dict[old_mapping][k]
-    # update match number dictionary
-    match_triple_dict[tuple(new_mapping_list)] = match_num + gain
+    # update the match cache
+    if cache is not None:
+        cache.put(new_mapping_list, match_num + gain)
     return gain
 
 
-def swap_gain(mapping, node_id1, mapping_id1, node_id2, mapping_id2, weight_dict, match_num):
+def swap_gain(mapping, node_id1, mapping_id1, node_id2, mapping_id2, weight_dict, match_num, cache=None):
     """
     Compute the triple match number gain from the swapping
     Arguments:
@@ -482,6 +660,7 @@ def swap_gain(mapping, node_id1, mapping_id1, node_id2, mapping_id2, weight_dict
     mapping_id2: the node index in AMR 2 node 2 maps to (in the current mapping)
     weight_dict: weight dictionary
     match_num: the original matching triple number
+    cache: MatchCache of the AMR pair (optional)
     Returns:
     the gain number (might be negative)
 
@@ -491,8 +670,10 @@ def swap_gain(mapping, node_id1, mapping_id1, node_id2, mapping_id2, weight_dict
     # After swapping, node_id1 maps to mapping_id2 and node_id2 maps to mapping_id1
     new_mapping_list[node_id1] = mapping_id2
     new_mapping_list[node_id2] = mapping_id1
-    if tuple(new_mapping_list) in match_triple_dict:
-        return match_triple_dict[tuple(new_mapping_list)] - match_num
+    if cache is not None:
+        saved_num = cache.get(new_mapping_list)
+        if saved_num is not None:
+            return saved_num - match_num
     gain = 0
     new_mapping1 = (node_id1, mapping_id2)
     new_mapping2 = (node_id2, mapping_id1)
@@ -533,11 +714,12 @@ def swap_gain(mapping, node_id1, mapping_id1, node_id2, mapping_id2, weight_dict
                 continue
             elif mapping[key[0]] == key[1]:
                 gain -= weight_dict[old_mapping2][key]
-    match_triple_dict[tuple(new_mapping_list)] = match_num + gain
+    if cache is not None:
+        cache.put(new_mapping_list, match_num + gain)
     return gain
 
 
-def get_best_gain(mapping, candidate_mappings, weight_dict, instance_len, cur_match_num):
+def get_best_gain(mapping, candidate_mappings, weight_dict, instance_len, cur_match_num, cache=None):
     """
     Hill-climbing method to return the best gain swap/move can get
     Arguments:
@@ -546,6 +728,7 @@ def get_best_gain(mapping, candidate_mappings, weight_dict, instance_len, cur_ma
     weight_dict: the weight dictionary
     instance_len: the number of the nodes in AMR 2
     cur_match_num: current triple match number
+    cache: MatchCache of the AMR pair (optional)
     Returns:
     the best gain we can get via swap/move operation
 
@@ -573,7 +756,7 @@ def get_best_gain(mapping, candidate_mappings, weight_dict, instance_len, cur_ma
                 # (i, m) -> (i, nm)
                 if verbose:
                     print >> DEBUG_LOG, "Remap node", i, "from ", nid, "to", nm
-                mv_gain = move_gain(mapping, i, nid, nm, weight_dict, cur_match_num)
+                mv_gain = move_gain(mapping, i, nid, nm, weight_dict, cur_match_num, cache)
                 if verbose:
                     print >> DEBUG_LOG, "Move gain:", mv_gain
                     new_mapping = mapping[:]
@@ -599,7 +782,7 @@ def get_best_gain(mapping, candidate_mappings, weight_dict, instance_len, cur_ma
                 print >> DEBUG_LOG, "Before swapping:", i, "-", m, ",", j, "-", m2
                 print >> DEBUG_LOG, mapping
                 print >> DEBUG_LOG, "After swapping:", i, "-", m2, ",", j, "-", m
-            sw_gain = swap_gain(mapping, i, m, j, m2, weight_dict, cur_match_num)
+            sw_gain = swap_gain(mapping, i, m, j, m2, weight_dict, cur_match_num, cache)
             if verbose:
                 print >> DEBUG_LOG, "Swap gain:", sw_gain
                 new_mapping = mapping[:]
@@ -637,6 +820,175 @@ def get_best_gain(mapping, candidate_mappings, weight_dict, instance_len, cur_ma
     return largest_gain, cur_mapping
 
 
+def compile_weight_dict(weight_dict, candidate_mapping, instance_len1, instance_len2):
+    """
+    Compile weight_dict into numpy arrays for the vectorized hill-climbing.
+    A node pair (i, j) is flattened to the index i * instance_len2 + j.
+    Arguments:
+        weight_dict: the weight dictionary from compute_pool
+        candidate_mapping: the candidate mapping list from compute_pool
+        instance_len1: the number of the nodes in AMR 1
+        instance_len2: the number of the nodes in AMR 2
+    Returns:
+        unary: (instance_len1, instance_len2) array of instance/attribute triple matches of each node pair
+        candidate: (instance_len1, instance_len2) boolean array, True if node i in AMR 1 can map to node j in AMR 2
+        rel_row, rel_col, rel_weight: relation triple matches between two node pairs, in CSR (row-sorted) order.
+                                      Every relation is stored in both directions, like in weight_dict.
+        rel_key: rel_row * (instance_len1 * instance_len2) + rel_col, sorted, to look up a single weight
+
+    """
+    pair_num = instance_len1 * instance_len2
+    unary = np.zeros((instance_len1, instance_len2), dtype=np.int64)
+    candidate = np.zeros((instance_len1, instance_len2), dtype=bool)
+    for i, candidates in enumerate(candidate_mapping):
+        candidate[i, list(candidates)] = True
+    rows = []
+    cols = []
+    weights = []
+    for node_pair, pair_weights in weight_dict.items():
+        row = node_pair[0] * instance_len2 + node_pair[1]
+        for key, weight in pair_weights.items():
+            if key == -1:
+                unary[node_pair] = weight
+            else:
+                rows.append(row)
+                cols.append(key[0] * instance_len2 + key[1])
+                weights.append(weight)
+    rel_key = np.array(rows, dtype=np.int64) * pair_num + np.array(cols, dtype=np.int64)
+    order = np.argsort(rel_key)
+    rel_key = rel_key[order]
+    rel_row = rel_key // pair_num
+    rel_col = rel_key % pair_num
+    rel_weight = np.array(weights, dtype=np.int64)[order]
+    return unary, candidate, rel_row, rel_col, rel_weight, rel_key
+
+
+def score_pairs_numpy(mapping, weight_arrays):
+    """
+    Compute, for every node pair (i, j), the triple match number node i in AMR 1 would get by mapping to node j
+    in AMR 2 while all other nodes keep their current mapping.
+    Arguments:
+        mapping: current node mapping (numpy integer array)
+        weight_arrays: compiled weight arrays from compile_weight_dict
+    Returns:
+        score: (instance_len1, instance_len2) array of triple match numbers
+        cur_score: score of each node under its current mapping (0 for unmapped nodes)
+
+    """
+    (unary, candidate, rel_row, rel_col, rel_weight, rel_key) = weight_arrays
+    instance_len1, instance_len2 = unary.shape
+    other_node = rel_col // instance_len2
+    # relation matches with node pairs in the current mapping, except with the node being remapped itself
+    active = (mapping[other_node] == rel_col % instance_len2) & (rel_row // instance_len2 != other_node)
+    context = np.bincount(rel_row[active], weights=rel_weight[active], minlength=unary.size)
+    score = unary + context.astype(np.int64).reshape(unary.shape)
+    cur_score = np.where(mapping >= 0, score[np.arange(instance_len1), np.maximum(mapping, 0)], 0)
+    return score, cur_score
+
+
+def relation_weight_numpy(node1, mapping1, node2, mapping2, weight_arrays):
+    """
+    Look up the relation triple matches between node pairs (node1, mapping1) and (node2, mapping2), elementwise.
+    Pairs with an unmapped node (-1) get 0.
+
+    """
+    (unary, candidate, rel_row, rel_col, rel_weight, rel_key) = weight_arrays
+    if len(rel_key) == 0:
+        return np.zeros(len(node1), dtype=np.int64)
+    instance_len2 = unary.shape[1]
+    keys = (node1 * instance_len2 + mapping1) * unary.size + node2 * instance_len2 + mapping2
+    pos = np.minimum(np.searchsorted(rel_key, keys), len(rel_key) - 1)
+    found = (rel_key[pos] == keys) & (mapping1 >= 0) & (mapping2 >= 0)
+    return np.where(found, rel_weight[pos], 0)
+
+
+def get_best_gain_numpy(mapping, weight_arrays):
+    """
+    Vectorized version of get_best_gain. All move and swap gains are computed at once from the compiled weight
+    arrays, and ties are broken in the same order as get_best_gain (moves by node in AMR 1, then by node in AMR 2;
+    swaps by node pair), so both return the same mapping.
+    Arguments:
+        mapping: current node mapping (numpy integer array)
+        weight_arrays: compiled weight arrays from compile_weight_dict
+    Returns:
+        the best gain we can get via swap/move operation, and the resulting mapping
+
+    """
+    (unary, candidate, rel_row, rel_col, rel_weight, rel_key) = weight_arrays
+    (score, cur_score) = score_pairs_numpy(mapping, weight_arrays)
+    largest_gain = 0
+    cur_mapping = mapping.copy()
+    # move: remap node i to a candidate node that is unmatched in AMR 2
+    unmatched = np.ones(unary.shape[1], dtype=bool)
+    unmatched[mapping[mapping >= 0]] = False
+    moves = np.flatnonzero(candidate & unmatched)
+    if len(moves) > 0:
+        mv_gain = (score - cur_score[:, np.newaxis]).ravel()[moves]
+        best = np.argmax(mv_gain)
+        if mv_gain[best] > largest_gain:
+            largest_gain = mv_gain[best]
+            (node1, node2) = divmod(moves[best], unary.shape[1])
+            cur_mapping = mapping.copy()
+            cur_mapping[node1] = node2
+    # swap: (i, m) (j, m2) -> (i, m2) (j, m) for i < j
+    (node1, node2) = np.triu_indices(len(mapping), 1)
+    if len(node1) > 0:
+        m1 = mapping[node1]
+        m2 = mapping[node2]
+        new_score1 = np.where(m2 >= 0, score[node1, np.maximum(m2, 0)], 0)
+        new_score2 = np.where(m1 >= 0, score[node2, np.maximum(m1, 0)], 0)
+        # score already counts relations with the other node's current mapping; replace them with the swapped one
+        sw_gain = new_score1 + new_score2 \
+            - relation_weight_numpy(node1, m2, node2, m2, weight_arrays) \
+            - relation_weight_numpy(node2, m1, node1, m1, weight_arrays) \
+            + relation_weight_numpy(node1, m2, node2, m1, weight_arrays) \
+            - cur_score[node1] - cur_score[node2] \
+            + relation_weight_numpy(node1, m1, node2, m2, weight_arrays)
+        best = np.argmax(sw_gain)
+        if sw_gain[best] > largest_gain:
+            largest_gain = sw_gain[best]
+            cur_mapping = mapping.copy()
+            cur_mapping[node1[best]] = m2[best]
+            cur_mapping[node2[best]] = m1[best]
+    return int(largest_gain), cur_mapping
+
+
+def hill_climb_numpy(mapping, weight_arrays):
+    """
+    Hill-climb from an initial mapping with the vectorized move/swap gains.
+    Arguments:
+        mapping: initial node mapping (list)
+        weight_arrays: compiled weight arrays from compile_weight_dict
+    Returns:
+        the node mapping at the local optimum (list), its triple match number and the number of
+        hill-climbing steps taken
+
+    """
+    cur_mapping = np.array(mapping, dtype=np.int64)
+    (score, cur_score) = score_pairs_numpy(cur_mapping, weight_arrays)
+    unary = weight_arrays[0]
+    unary_match = np.where(cur_mapping >= 0, unary[np.arange(len(cur_mapping)), np.maximum(cur_mapping, 0)], 0)
+    # every relation match is counted by both of its node pairs
+    match_num = int(unary_match.sum() + (cur_score.sum() - unary_match.sum()) // 2)
+    if verbose:
+        print >> DEBUG_LOG, "Node mapping at start", mapping
+        print >> DEBUG_LOG, "Triple match number at start:", match_num
+    climb_num = 0
+    while True:
+        (gain, new_mapping) = get_best_gain_numpy(cur_mapping, weight_arrays)
+        if verbose:
+            print >> DEBUG_LOG, "Gain after the hill-climbing", gain
+        if gain <= 0:
+            break
+        climb_num += 1
+        match_num += gain
+        cur_mapping = new_mapping
+        if verbose:
+            print >> DEBUG_LOG, "Update triple match number to:", match_num
+            print >> DEBUG_LOG, "Current mapping:", list(cur_mapping)
+    return [int(m) for m in cur_mapping], match_num, climb_num
+
+
 def print_alignment(mapping, instance1, instance2):
     """
     print the alignment based on a node mapping
@@ -685,6 +1037,115 @@ def compute_f(match_num, test_num, gold_num):
         return precision, recall, 0.00
 
 
+def get_amr_pairs(input_f1, input_f2):
+    """
+    Read AMR pairs from two files, one AMR of each file at a time.
+    Args:
+        input_f1: file containing the AMRs of set 1 (test)
+        input_f2: file containing the AMRs of set 2 (gold)
+    Yields:
+        (AMR 1, AMR 2) one-line strings, until either file runs out of AMRs
+
+    """
+    while True:
+        cur_amr1 = get_amr_line(input_f1)
+        cur_amr2 = get_amr_line(input_f2)
+        if cur_amr1 == "" and cur_amr2 == "":
+            break
+        if cur_amr1 == "":
+            print >> ERROR_LOG, "Error: File 1 has less AMRs than file 2"
+            print >> ERROR_LOG, "Ignoring remaining AMRs"
+            break
+        if cur_amr2 == "":
+            print >> ERROR_LOG, "Error: File 2 has less AMRs than file 1"
+            print >> ERROR_LOG, "Ignoring remaining AMRs"
+            break
+        yield cur_amr1, cur_amr2
+
+
+def score_amr_pair(cur_amr1, cur_amr2, sent_num=1, rng=None, stats=None):
+    """
+    Compute the best matching triple number of one AMR pair
+    Args:
+        cur_amr1: AMR 1 (test) in one-line form
+        cur_amr2: AMR 2 (gold) in one-line form
+        sent_num: pair number, used in verbose output
+        rng: random.Random instance for the random restarts (optional)
+        stats: dictionary to fill with the search statistics of get_best_match (optional)
+    Returns:
+        best matching triple number, triple number of AMR 1, triple number of AMR 2
+    Raises:
+        AMRParseError if either AMR cannot be parsed or renamed
+
+    """
+    try:
+        amr1 = amr.AMR.parse_AMR_line(cur_amr1)
+        amr2 = amr.AMR.parse_AMR_line(cur_amr2)
+    except Exception as e:
+        raise AMRParseError(e)
+    prefix1 = "a"
+    prefix2 = "b"
+    try:
+        # Rename node to "a1", "a2", .etc
+        amr1.rename_node(prefix1)
+        # Renaming node to "b1", "b2", .etc
+        amr2.rename_node(prefix2)
+    except Exception as e:
+        raise AMRParseError(e)
+    (instance1, attributes1, relation1) = amr1.get_triples()
+    (instance2, attributes2, relation2) = amr2.get_triples()
+    if verbose:
+        # print parse results of two AMRs
+        print >> DEBUG_LOG, "AMR pair", sent_num
+        print >> DEBUG_LOG, "============================================"
+        print >> DEBUG_LOG, "AMR 1 (one-line):", cur_amr1
+        print >> DEBUG_LOG, "AMR 2 (one-line):", cur_amr2
+        print >> DEBUG_LOG, "Instance triples of AMR 1:", len(instance1)
+        print >> DEBUG_LOG, instance1
+        print >> DEBUG_LOG, "Attribute triples of AMR 1:", len(attributes1)
+        print >> DEBUG_LOG, attributes1
+        print >> DEBUG_LOG, "Relation triples of AMR 1:", len(relation1)
+        print >> DEBUG_LOG, relation1
+        print >> DEBUG_LOG, "Instance triples of AMR 2:", len(instance2)
+        print >> DEBUG_LOG, instance2
+        print >> DEBUG_LOG, "Attribute triples of AMR 2:", len(attributes2)
+        print >> DEBUG_LOG, attributes2
+        print >> DEBUG_LOG, "Relation triples of AMR 2:", len(relation2)
+        print >> DEBUG_LOG, relation2
+    (best_mapping, best_match_num) = get_best_match(instance1, attributes1, relation1,
+                                                    instance2, attributes2, relation2,
+                                                    prefix1, prefix2, rng, stats=stats)
+    if verbose:
+        print >> DEBUG_LOG, "best match number", best_match_num
+        print >> DEBUG_LOG, "best node mapping", best_mapping
+        print >> DEBUG_LOG, "Best node mapping alignment:", print_alignment(best_mapping, instance1, instance2)
+    test_triple_num = len(instance1) + len(attributes1) + len(relation1)
+    gold_triple_num = len(instance2) + len(attributes2) + len(relation2)
+    return best_match_num, test_triple_num, gold_triple_num
+
+
+def score_amr_pair_job(job):
+    """
+    Score one AMR pair, in the main process or in a worker process of the pool
+    Args:
+        job: (pair number, AMR 1, AMR 2, seed). If seed is not None, the pair gets its own random generator
+             seeded from the seed and the pair number, so its score does not depend on which process runs it.
+    Returns:
+        (match number, test triple number, gold triple number, search statistics), or AMR 1 itself (a string) if the pair
+        cannot be parsed
+
+    """
+    (sent_num, cur_amr1, cur_amr2, seed) = job
+    rng = None
+    if seed is not None:
+        rng = random.Random(seed * 1000003 + sent_num)
+    stats = {}
+    try:
+        return score_amr_pair(cur_amr1, cur_amr2, sent_num, rng, stats) + (stats,)
+    except AMRParseError:
+        return cur_amr1
+
+
 def main(arguments):
     """
     Main function of smatch score calculation
@@ -694,7 +1155,9 @@ def main(arguments):
     global iteration_num
     global single_score
     global pr_flag
-    global match_triple_dict
+    global engine
+    global restart_nodes
+    global pair_time_budget
     # set the iteration number
     # total iteration number = restart number + 1
     iteration_num = arguments.r + 1
@@ -704,77 +1167,46 @@ def main(arguments):
         verbose = True
     if arguments.pr:
         pr_flag = True
+    if arguments.engine == "numpy":
+        if np is None:
+            print >> ERROR_LOG, "--engine numpy requires numpy"
+            exit(1)
+        engine = "numpy"
+    restart_nodes = arguments.restart_nodes
+    pair_time_budget = arguments.time_budget
+    seed = arguments.seed
+    if seed is None and arguments.jobs > 1:
+        seed = 0
     # matching triple number
     total_match_num = 0
     # triple number in test file
     total_test_num = 0
     # triple number in gold file
     total_gold_num = 0
-    # sentence number
-    sent_num = 1
     # Read amr pairs from two files
-    while True:
-        cur_amr1 = get_amr_line(args.f[0])
-        cur_amr2 = get_amr_line(args.f[1])
-        if cur_amr1 == "" and cur_amr2 == "":
-            break
-        if cur_amr1 == "":
-            print >> ERROR_LOG, "Error: File 1 has less AMRs than file 2"
-            print >> ERROR_LOG, "Ignoring remaining AMRs"
-            break
-        if cur_amr2 == "":
-            print >> ERROR_LOG, "Error: File 2 has less AMRs than file 1"
-            print >> ERROR_LOG, "Ignoring remaining AMRs"
-            break
-        try:
-            amr1 = amr.AMR.parse_AMR_line(cur_amr1)
-            amr2 = amr.AMR.parse_AMR_line(cur_amr2)
-        except:
-            print cur_amr1
-            sys.stdout.flush()
-            sys.exit(0)
-
-        prefix1 = "a"
-        prefix2 = "b"
-        try:
-            # Rename node to "a1", "a2", .etc
-            amr1.rename_node(prefix1)
-            # Renaming node to "b1", "b2", .etc
-            amr2.rename_node(prefix2)
-        except:
-            print cur_amr1
+    amr_pairs = get_amr_pairs(arguments.f[0], arguments.f[1])
+    jobs = ((sent_num, cur_amr1, cur_amr2, seed)
+            for sent_num, (cur_amr1, cur_amr2) in enumerate(amr_pairs, 1))
+    pool = None
+    if arguments.jobs > 1:
+        # workers are forked after the settings above, so they share them
+        pool = multiprocessing.Pool(arguments.jobs)
+        results = pool.imap(score_amr_pair_job, jobs, 8)
+    else:
+        results = itertools.imap(score_amr_pair_job, jobs)
+    # imap returns results in input order
+    for sent_num, result in enumerate(results, 1):
+        if isinstance(result, str):
+            # AMR pair that cannot be parsed
+            print result
             sys.stdout.flush()
+            if pool is not None:
+                pool.terminate()
             sys.exit(0)
-
-        (instance1, attributes1, relation1) = amr1.get_triples()
-        (instance2, attributes2, relation2) = amr2.get_triples()
-        if verbose:
-            # print parse results of two AMRs
-            print >> DEBUG_LOG, "AMR pair", sent_num
-            print >> DEBUG_LOG, "============================================"
-            print >> DEBUG_LOG, "AMR 1 (one-line):", cur_amr1
-            print >> DEBUG_LOG, "AMR 2 (one-line):", cur_amr2
-            print >> DEBUG_LOG, "Instance triples of AMR 1:", len(instance1)
-            print >> DEBUG_LOG, instance1
-            print >> DEBUG_LOG, "Attribute triples of AMR 1:", len(attributes1)
-            print >> DEBUG_LOG, attributes1
-            print >> DEBUG_LOG, "Relation triples of AMR 1:", len(relation1)
-            print >> DEBUG_LOG, relation1
-            print >> DEBUG_LOG, "Instance triples of AMR 2:", len(instance2)
-            print >> DEBUG_LOG, instance2
-            print >> DEBUG_LOG, "Attribute triples of AMR 2:", len(attributes2)
-            print >> DEBUG_LOG, attributes2
-            print >> DEBUG_LOG, "Relation triples of AMR 2:", len(relation2)
-            print >> DEBUG_LOG, relation2
-        (best_mapping, best_match_num) = get_best_match(instance1, attributes1, relation1,
-                                                        instance2, attributes2, relation2,
-                                                        prefix1, prefix2)
-        if verbose:
-            print >> DEBUG_LOG, "best match number", best_match_num
-            print >> DEBUG_LOG, "best node mapping", best_mapping
-            print >> DEBUG_LOG, "Best node mapping alignment:", print_alignment(best_mapping, instance1, instance2)
-        test_triple_num = len(instance1) + len(attributes1) + len(relation1)
-        gold_triple_num = len(instance2) + len(attributes2) + len(relation2)
+        (best_match_num, test_triple_num, gold_triple_num, stats) = result
+        if arguments.stats:
+            print >> DEBUG_LOG, "AMR pair %d: %d restarts, %d hill-climbing iterations, stopped by %s" % \
+                (sent_num, stats["restarts"], stats["iterations"], stats["stop"])
         if not single_score:
             # if each AMR pair should have a score, compute and output it here
             (precision, recall, best_f_score) = compute_f(best_match_num,
@@ -789,9 +1221,9 @@ def main(arguments):
         total_match_num += best_match_num
         total_test_num += test_triple_num
         total_gold_num += gold_triple_num
-        # clear the matching triple dictionary for the next AMR pair
-        match_triple_dict.clear()
-        sent_num += 1
+    if pool is not None:
+        pool.close()
+        pool.join()
     if verbose:
         print >> DEBUG_LOG, "Total match number, total triple number in AMR 1, and total triple number in AMR 2:"
         print >> DEBUG_LOG, total_match_num, total_test_num, total_gold_num
@@ -803,8 +1235,8 @@ def main(arguments):
             print "Precision: %.2f" % precision
             print "Recall: %.2f" % recall
         print "Document F-score: %.2f" % best_f_score
-    args.f[0].close()
-    args.f[1].close()
+    arguments.f[0].close()
+    arguments.f[1].close()
 
 if __name__ == "__main__":
     parser = None
@@ -0,0 +1,106 @@
+'''Minibatches of index matrices for the attention encoder-decoder.
+
+The arrays are the -1 padded (num_seq, max_len) matrices returned by
+_util.load_split. Sequences are filtered and the target side is wrapped in
+start/end tokens once, up front; each batch is then cut out with NumPy fancy
+indexing, walking the data as one random permutation per epoch.
+'''
+import Queue
+import threading
+import numpy as np
+
+
+def add_start_end(dst_np, start_ix, end_ix):
+    # Prepend start_ix to rows that lack it and append end_ix after the last
+    # token, in the same way the old per-batch loops did.
+    num_seq, max_len = dst_np.shape
+    seq_len = (dst_np >= 0).sum(axis = 1)
+    offset = (dst_np[:, 0] != start_ix).astype('int32')
+
+    rows = np.arange(num_seq)
+    out = -np.ones((num_seq, max_len + 2), dtype = 'int32')
+    out[rows[:, None], np.arange(max_len)[None, :] + offset[:, None]] = dst_np
+    out[offset == 1, 0] = start_ix
+    need_end = dst_np[:, -1] != end_ix
+    out[rows[need_end], (seq_len + offset)[need_end]] = end_ix
+    return out
+
+
+class BatchIterator(object):
+    '''Callable returning (src, src_mask, dst, label, mask) training batches.
+
+    Parameters
+    ----------
+    src_np, dst_np : ndarray (num_seq, max_len) of int32
+        Source and target token indices, padded with -1.
+    batch_size : int
+        Number of sequences per batch.
+    start_ix, end_ix : int
+        Indices of the target start and end tokens.
+    min_src_len : int, optional
+        Skip pairs whose source has fewer tokens than this. Defaults to 6.
+    prefetch : int, optional
+        If positive, a background thread keeps this many batches ready while
+        the caller trains on the current one. Defaults to 0 (no thread).
+    rng : :class:`numpy.random.RandomState` or int, optional
+        Random number generator, or seed, for the epoch permutations.
+    '''
+
+    def __init__(self, src_np, dst_np, batch_size, start_ix, end_ix,
+                 min_src_len = 6, prefetch = 0, rng = None):
+        if rng is None or isinstance(rng, int):
+            rng = np.random.RandomState(rng)
+        self.rng = rng
+        self.batch_size = batch_size
+
+        keep = np.nonzero((src_np >= 0).sum(axis = 1) >= min_src_len)[0]
+        if len(keep) < batch_size:
+            raise ValueError('only %d sequences with at least %d tokens, '
+                             'need %d for a batch' % (len(keep), min_src_len, batch_size))
+        self.src = src_np[keep]
+        self.src_len = (self.src >= 0).sum(axis = 1)
+        self.dst = add_start_end(dst_np[keep], start_ix, end_ix)
+
+        self._order = np.zeros((0, ), dtype = 'int64')
+        self._queue = None
+        if prefetch > 0:
+            self._queue = Queue.Queue(maxsize = prefetch)
+            worker = threading.Thread(target = self._fill)
+            worker.daemon = True
+            worker.start()
+
+    def __len__(self):
+        return len(self.src) // self.batch_size
+
+    def __call__(self):
+        if self._queue is None:
+            return self.next_batch()
+        return self._queue.get()
+
+    def _fill(self):
+        while True:
+            self._queue.put(self.next_batch())
+
+    def next_indices(self):
+        # Walk one permutation per epoch, dropping the incomplete tail batch.
+        if len(self._order) < self.batch_size:
+            self._order = self.rng.permutation(len(self.src))
+        idx = self._order[:self.batch_size]
+        self._order = self._order[self.batch_size:]
+        return idx
+
+    def next_batch(self):
+        idx = self.next_indices()
+
+        # Time-major (max_len, batch_size) matrices. The source is cut to the
+        # longest sequence in the batch; attention ignores masked positions.
+        src = np.ascontiguousarray(self.src[idx, :self.src_len[idx].max()].T)
+        src_mask = (src >= 0).astype('float32')
+
+        dst = np.ascontiguousarray(self.dst[idx].T)
+        label = np.zeros(dst.shape, dtype = 'int32')
+        mask = np.zeros(dst.shape, dtype = 'float32')
+        # position j predicts the token at j + 1.
+        label[:-1] = np.maximum(dst[1:], 0)
+        mask[:-1] = dst[1:] >= 0
+        return src, src_mask, dst, label, mask
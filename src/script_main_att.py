@@ -8,8 +8,8 @@ import pdb
 import theanets
 import climate
 import theano as T
-import random
 import _util
+import _batch
 
 logging = climate.get_logger(__name__)
 
@@ -46,150 +46,21 @@ if __name__ == '__main__':
     save_dir=cf.get('OUTPUT', 'save_dir')
 
     # NOw, we can load the vocab and the fea.
-    src_w2ix, src_ix2w = load_vocab(src_vocab_fn)
-    dst_w2ix, dst_ix2w = load_vocab_dst(dst_vocab_fn)
+    src_w2ix, src_ix2w = _util.load_vocab(src_vocab_fn)
+    dst_w2ix, dst_ix2w = _util.load_vocab_dst(dst_vocab_fn)
 
-    src_train_np = load_split(src_w2ix, src_train_fn)
-    src_val_np = load_split(src_w2ix, src_val_fn)
+    src_train_np = _util.load_split(src_w2ix, src_train_fn)
+    src_val_np = _util.load_split(src_w2ix, src_val_fn)
     
 
-    dst_train_np = load_split(dst_w2ix, dst_train_fn)
-    dst_val_np = load_split(dst_w2ix, dst_val_fn)
-
-    train_range = range(src_train_np.shape[0])
-    def batch_train():
-        random.shuffle(train_range)
-
-        src = np.zeros((src_train_np.shape[1], batch_size, len(src_w2ix)), dtype = 'float32')
-        #src_mask = np.zeros((src_train_np.shape[1], batch_size), dtype = 'int32')
-        src_mask = np.zeros((src_train_np.shape[1], batch_size), dtype = 'float32')
-
-        dst = np.zeros((dst_train_np.shape[1] + 2, batch_size, len(dst_w2ix)), dtype = 'float32')
-        label = np.zeros((dst_train_np.shape[1] + 2, batch_size), dtype = 'int32')
-        mask = np.zeros((dst_train_np.shape[1] + 2, batch_size), dtype = 'float32')
-        #dst_mask = np.zeros((dst_train_np.shape[1], batch_size, len(dst_w2ix)), dtype = 'float32')
-        #for i in range(batch_size):
-        i = 0
-        idx = 0
-        indices = []
-        while True:
-            src_i = src_train_np[train_range[i],:]
-            i += 1
-
-            num_el = 0
-            pos_s = [ pos for pos in src_i if pos >= 0 ]
-            num_el = len(pos_s)
-
-            if num_el < 6:
-                continue
-            
-            for j,pos in enumerate(src_i):
-                if pos < 0:
-                    break
-                src[j, idx, pos] = 1
-                src_mask[j, idx] = 1
-            indices.append(i)
-            idx += 1
-            if idx == batch_size:
-                break
-
-        for i in range(batch_size):
-            dst_i = dst_train_np[train_range[indices[i]],:]
-            dst_np = np.zeros((dst_i.size + 2,), dtype = 'int32')
-            dst_np[:] = -1
-
-            seq_len = [ el for el in dst_i if el >= 0 ]
-            seq_len = len(seq_len)
-
-            if dst_i[0] != dst_w2ix[start_tok]:
-                dst_np[0] = dst_w2ix[start_tok]
-                dst_np[1:1+dst_i.size] = dst_i
-                if dst_i[-1] != dst_w2ix[end_tok]:
-                    dst_np[1+seq_len] = dst_w2ix[end_tok]
-            else:
-                dst_np[0:dst_i.size] = dst_i
-                if dst_i[-1] != dst_w2ix[end_tok]:
-                    dst_np[seq_len] = dst_w2ix[end_tok]
-            for j,pos in enumerate(dst_np):
-                if pos < 0:
-                    break
-                dst[j, i, pos] = 1
-                if j >= 1:
-                    # this is the prediction.
-                    label[j-1,i] = pos
-                    mask[j-1,i] = 1
-
-        print (src_mask.sum(axis = 0))
-        print (mask.sum(axis = 0))
-        return src, src_mask, dst, label, mask
-
-    val_range = range(src_val_np.shape[0])
-    def batch_val():
-        random.shuffle(val_range)
-
-        src = np.zeros((src_val_np.shape[1], batch_size, len(src_w2ix)), dtype = 'float32')
-        #src_mask = np.zeros((src_val_np.shape[1], batch_size), dtype = 'int32')
-        src_mask = np.zeros((src_val_np.shape[1], batch_size), dtype = 'float32')
-
-        dst = np.zeros((dst_val_np.shape[1] + 2, batch_size, len(dst_w2ix)), dtype = 'float32')
-        label = np.zeros((dst_val_np.shape[1] + 2, batch_size), dtype = 'int32')
-        mask = np.zeros((dst_val_np.shape[1] + 2, batch_size), dtype = 'float32')
- 
-        #for i in range(batch_size):
-        i = 0
-        idx = 0
-        indices = []
-        while True:
-            src_i = src_val_np[val_range[i],:]
-            i += 1
-
-            num_el = 0
-            pos_s = [ pos for pos in src_i if pos >= 0 ]
-            num_el = len(pos_s)
-
-            if num_el < 6:
-                continue
- 
-            for j,pos in enumerate(src_i):
-                if pos < 0:
-                    break
-                src[j, idx, pos] = 1
-                src_mask[j, idx] = 1
-            indices.append(i)
-            idx += 1
-            if idx == batch_size:
-                break
-
-        for i in range(batch_size):
-            dst_i = dst_val_np[val_range[indices[i]],:]
-            dst_np = np.zeros((dst_i.size + 2,), dtype = 'int32')
-            dst_np[:] = -1
-
-            seq_len = [ el for el in dst_i if el >= 0 ]
-            seq_len = len(seq_len)
-
-            if dst_i[0] != dst_w2ix[start_tok]:
-                dst_np[0] = dst_w2ix[start_tok]
-                dst_np[1:1+dst_i.size] = dst_i
-                if dst_i[-1] != dst_w2ix[end_tok]:
-                    dst_np[1+seq_len] = dst_w2ix[end_tok]
-            else:
-                dst_np[0:dst_i.size] = dst_i
-                if dst_i[-1] != dst_w2ix[end_tok]:
-                    dst_np[seq_len] = dst_w2ix[end_tok]
-            for j,pos in enumerate(dst_np):
-                if pos < 0:
-                    break
-                dst[j, i, pos] = 1
-                if j >= 1:
-                    # this is the prediction.
-                    label[j-1,i] = pos
-                    mask[j-1,i] = 1
-        if mask.sum() == 0:
-            logging.error('Should not happen')
-        print (src_mask.sum(axis = 0))
-        print (mask.sum(axis = 0))
-        return src, src_mask, dst, label, mask
+    dst_train_np = _util.load_split(dst_w2ix, dst_train_fn)
+    dst_val_np = _util.load_split(dst_w2ix, dst_val_fn)
+
+    start_ix, end_ix = dst_w2ix[_util.start_tok], dst_w2ix[_util.end_tok]
+    batch_train = _batch.BatchIterator(src_train_np, dst_train_np, batch_size,
+            start_ix, end_ix, prefetch = 4)
+    batch_val = _batch.BatchIterator(src_val_np, dst_val_np, batch_size,
+            start_ix, end_ix, prefetch = 1)
 
     def layer_input_encdec(src_size, dst_size, emb_size):
         return dict(src_size = src_size, dst_size = dst_size, emb_size = emb_size)
@@ -219,7 +90,8 @@ if __name__ == '__main__':
             layer_lstm_dec(h_size),
             (len(dst_w2ix), 'softmax')),
             weighted=True,
-            encdec = True
+            encdec = True,
+            index_input = True
         )
         e.train(
             batch_train,
@@ -2,12 +2,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import array
 import gzip
 import os
 import re
 import tarfile
 import pdb
 
+import numpy as np
+from six.moves import xrange  # pylint: disable=redefined-builtin
+from six.moves import zip  # pylint: disable=redefined-builtin
 from tensorflow.python.platform import gfile
 
 # Special vocabulary symbols - we always put them at the start.
@@ -204,3 +208,145 @@ def prepare_amr_data(data_dir, src_vocab_size, dst_vocab_size, src_fn, dst_fn, t
   return (src_train_ids_path, dst_train_ids_path,
           src_dev_ids_path, dst_dev_ids_path,
           src_vocab_path, dst_vocab_path)
+
+
+# Binary token-id corpus: a pair of aligned .ids files stored as flat int32
+# arrays that are memory-mapped at load time, so that no per-sentence Python
+# lists are kept and several processes share one page-cache copy.
+CORPUS_VERSION = 1
+_CORPUS_PARTS = ["source", "source_offsets", "target", "target_offsets",
+                 "lengths", "bucket_ids", "buckets", "version"]
+
+
+def _corpus_file(corpus_path, part):
+  return "%s.%s.npy" % (corpus_path, part)
+
+
+def assign_buckets(lengths, buckets):
+  """Find the first bucket each pair fits into, as read_data does.
+
+  Args:
+    lengths: int array (num_pairs, 2) of source lengths and target lengths
+      (the latter including EOS_ID).
+    buckets: list of (source_size, target_size) pairs.
+
+  Returns:
+    int32 array of bucket ids, -1 for pairs that fit into no bucket.
+  """
+  bucket_ids = -np.ones(len(lengths), dtype=np.int32)
+  for bucket_id in reversed(xrange(len(buckets))):
+    source_size, target_size = buckets[bucket_id]
+    fits = (lengths[:, 0] < source_size) & (lengths[:, 1] < target_size)
+    bucket_ids[fits] = bucket_id
+  return bucket_ids
+
+
+def ids_to_corpus(source_path, target_path, corpus_path, buckets):
+  """Convert aligned token-id files into a binary corpus, if not done already.
+
+  The corpus is a set of .npy files starting with corpus_path: flat int32
+  source and target tokens, their int64 offsets (pair n is
+  tokens[offsets[n]:offsets[n + 1]]), the source and target lengths (the
+  latter counting the EOS_ID that read_data appends) and the bucket ids for
+  the given buckets.
+
+  Args:
+    source_path: path to the file with token-ids for the source language.
+    target_path: path to the file with token-ids for the target language.
+    corpus_path: path prefix of the corpus files to create.
+    buckets: list of (source_size, target_size) pairs to precompute bucket
+      ids for.
+  """
+  version_path = _corpus_file(corpus_path, "version")
+  if gfile.Exists(version_path):
+    if (os.path.getmtime(version_path) >= os.path.getmtime(source_path) and
+        os.path.getmtime(version_path) >= os.path.getmtime(target_path) and
+        int(np.load(version_path)) == CORPUS_VERSION):
+      return
+  print("Creating corpus %s from %s and %s" %
+        (corpus_path, source_path, target_path))
+  tokens = {"source": array.array("i"), "target": array.array("i")}
+  sizes = {"source": array.array("i"), "target": array.array("i")}
+  with gfile.GFile(source_path, mode="r") as source_file:
+    with gfile.GFile(target_path, mode="r") as target_file:
+      counter = 0
+      for source, target in zip(source_file, target_file):
+        counter += 1
+        if counter % 100000 == 0:
+          print("  converting line %d" % counter)
+        for side, line in (("source", source), ("target", target)):
+          ids = [int(x) for x in line.split()]
+          tokens[side].extend(ids)
+          sizes[side].append(len(ids))
+  arrays = {}
+  for side in ("source", "target"):
+    arrays[side] = np.array(tokens[side], dtype=np.int32)
+    arrays[side + "_offsets"] = np.zeros(counter + 1, dtype=np.int64)
+    arrays[side + "_offsets"][1:] = np.cumsum(sizes[side])
+  lengths = np.empty((counter, 2), dtype=np.int32)
+  lengths[:, 0] = sizes["source"]
+  lengths[:, 1] = np.array(sizes["target"]) + 1
+  arrays["lengths"] = lengths
+  arrays["bucket_ids"] = assign_buckets(lengths, buckets)
+  arrays["buckets"] = np.array(buckets, dtype=np.int32).reshape(-1, 2)
+  # The version is written last, so an interrupted conversion is redone.
+  for part in _CORPUS_PARTS[:-1]:
+    np.save(_corpus_file(corpus_path, part), arrays[part])
+  np.save(version_path, np.array(CORPUS_VERSION, dtype=np.int32))
+
+
+class CorpusBucket(object):
+  """The pairs of one bucket of a memory-mapped corpus.
+
+  Behaves like the lists of read_data: len(bucket) is the number of pairs and
+  bucket[i] is a (source_ids, target_ids) pair of lists, with EOS_ID appended
+  to the target. Only the indexed pair is copied out of the mapped arrays.
+  """
+
+  def __init__(self, corpus, indices):
+    self.corpus = corpus
+    self.indices = indices
+
+  def __len__(self):
+    return len(self.indices)
+
+  def __getitem__(self, i):
+    n = self.indices[i]
+    corpus = self.corpus
+    source = corpus["source"][corpus["source_offsets"][n]:
+                              corpus["source_offsets"][n + 1]]
+    target = corpus["target"][corpus["target_offsets"][n]:
+                              corpus["target_offsets"][n + 1]]
+    return source.tolist(), target.tolist() + [EOS_ID]
+
+  def __iter__(self):
+    for i in xrange(len(self.indices)):
+      yield self[i]
+
+
+def load_corpus(corpus_path, buckets, max_size=None):
+  """Memory-map a corpus made by ids_to_corpus and put its pairs into buckets.
+
+  Args:
+    corpus_path: path prefix of the corpus files.
+    buckets: list of (source_size, target_size) pairs; if they differ from the
+      buckets of the corpus, bucket ids are recomputed.
+    max_size: maximum number of pairs to use; if 0 or None, all of them.
+
+  Returns:
+    data_set: a list of len(buckets) CorpusBucket objects, in place of the
+      lists returned by read_data.
+  """
+  version = int(np.load(_corpus_file(corpus_path, "version")))
+  if version != CORPUS_VERSION:
+    raise ValueError("Corpus %s has version %d, expected %d."
+                     % (corpus_path, version, CORPUS_VERSION))
+  corpus = dict((part, np.load(_corpus_file(corpus_path, part), mmap_mode="r"))
+                for part in _CORPUS_PARTS[:-1])
+  bucket_ids = corpus["bucket_ids"]
+  if corpus["buckets"].tolist() != [list(bucket) for bucket in buckets]:
+    bucket_ids = assign_buckets(corpus["lengths"], buckets)
+  if max_size:
+    bucket_ids = bucket_ids[:max_size]
+  return [CorpusBucket(corpus, np.nonzero(bucket_ids == bucket_id)[0])
+          for bucket_id in xrange(len(buckets))]
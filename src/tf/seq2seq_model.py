@@ -19,8 +19,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import random
-
 import numpy as np
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
@@ -172,6 +170,10 @@ class Seq2SeqModel(object):
 
     self.saver = tf.train.Saver(tf.all_variables())
 
+    # Reusable batch buffers of get_batch, by bucket and batch size.
+    self._batch_buffers = {}
+    self._last_target = np.zeros([0], dtype=np.int32)
+
   def step(self, session, encoder_inputs, decoder_inputs, target_weights,
            bucket_id, forward_only):
     """Run a step of the model feeding the given inputs.
@@ -214,7 +216,9 @@ class Seq2SeqModel(object):
 
     # Since our targets are decoder inputs shifted by one, we need one more.
     last_target = self.decoder_inputs[decoder_size].name
-    input_feed[last_target] = np.zeros([self.batch_size], dtype=np.int32)
+    if len(self._last_target) != self.batch_size:
+      self._last_target = np.zeros([self.batch_size], dtype=np.int32)
+    input_feed[last_target] = self._last_target
 
     # Output feed: depends on whether we do a backward step or not.
     if not forward_only:
@@ -232,62 +236,80 @@ class Seq2SeqModel(object):
     else:
       return None, outputs[0], outputs[1:]  # No gradient norm, loss, outputs.
 
-  def get_batch(self, data, bucket_id):
+  def get_batch(self, data, bucket_id, reuse_buffer=False):
     """Get a random batch of data from the specified bucket, prepare for step.
 
     To feed data in step(..) it must be a list of batch-major vectors, while
-    data here contains single length-major cases. So the main logic of this
-    function is to re-index data cases to be in the proper format for feeding.
+    data here contains single length-major cases. Only the sampled cases are
+    read and padded, so memory-mapped buckets of data_utils.load_corpus are
+    never copied as a whole.
 
     Args:
       data: a tuple of size len(self.buckets) in which each element contains
         lists of pairs of input and output data that we use to create a batch.
       bucket_id: integer, which bucket to get the batch for.
+      reuse_buffer: if True, pad into matrices kept by the model for this
+        bucket and batch size instead of allocating new ones; the returned
+        vectors are then overwritten by the next get_batch call.
 
     Returns:
       The triple (encoder_inputs, decoder_inputs, target_weights) for
       the constructed batch that has the proper format to call step(...) later.
     """
+    # Get a random batch of encoder and decoder inputs from data.
+    bucket = data[bucket_id]
+    indices = np.random.randint(len(bucket), size=self.batch_size)
+    pairs = [bucket[i] for i in indices]
+    out = None
+    if reuse_buffer:
+      key = (bucket_id, self.batch_size)
+      if key not in self._batch_buffers:
+        encoder_size, decoder_size = self.buckets[bucket_id]
+        self._batch_buffers[key] = (
+            np.empty((encoder_size, self.batch_size), dtype=np.int32),
+            np.empty((decoder_size, self.batch_size), dtype=np.int32),
+            np.empty((decoder_size, self.batch_size), dtype=np.float32))
+      out = self._batch_buffers[key]
+    return self._pad_batch(pairs, bucket_id, out)
+
+  def prepare_batch(self, pairs, bucket_id):
+    """Prepare the given (input, output) pairs for step(..) as one batch.
+
+    Args:
+      pairs: list of self.batch_size pairs of input and output data that fit
+        into the bucket; the output may be empty when decoding.
+      bucket_id: integer, which bucket the batch is for.
+
+    Returns:
+      The triple (encoder_inputs, decoder_inputs, target_weights), as in
+      get_batch; the n-th batch entry comes from pairs[n].
+    """
+    return self._pad_batch(pairs, bucket_id, None)
+
+  def _pad_batch(self, pairs, bucket_id, out):
+    """Pad (input, output) pairs into time-major matrices as step(..) inputs.
+
+    Encoder inputs are padded and then reversed, decoder inputs get an extra
+    "GO" symbol and are padded then; column n holds pairs[n]. The matrices
+    are the triple out kept by get_batch, or new ones if out is None.
+    """
     encoder_size, decoder_size = self.buckets[bucket_id]
-    encoder_inputs, decoder_inputs = [], []
-
-    # Get a random batch of encoder and decoder inputs from data,
-    # pad them if needed, reverse encoder inputs and add GO to decoder.
-    for _ in xrange(self.batch_size):
-      encoder_input, decoder_input = random.choice(data[bucket_id])
-
-      # Encoder inputs are padded and then reversed.
-      encoder_pad = [data_utils.PAD_ID] * (encoder_size - len(encoder_input))
-      encoder_inputs.append(list(reversed(encoder_input + encoder_pad)))
-
-      # Decoder inputs get an extra "GO" symbol, and are padded then.
-      decoder_pad_size = decoder_size - len(decoder_input) - 1
-      decoder_inputs.append([data_utils.GO_ID] + decoder_input +
-                            [data_utils.PAD_ID] * decoder_pad_size)
-
-    # Now we create batch-major vectors from the data selected above.
-    batch_encoder_inputs, batch_decoder_inputs, batch_weights = [], [], []
-
-    # Batch encoder inputs are just re-indexed encoder_inputs.
-    for length_idx in xrange(encoder_size):
-      batch_encoder_inputs.append(
-          np.array([encoder_inputs[batch_idx][length_idx]
-                    for batch_idx in xrange(self.batch_size)], dtype=np.int32))
-
-    # Batch decoder inputs are re-indexed decoder_inputs, we create weights.
-    for length_idx in xrange(decoder_size):
-      batch_decoder_inputs.append(
-          np.array([decoder_inputs[batch_idx][length_idx]
-                    for batch_idx in xrange(self.batch_size)], dtype=np.int32))
-
-      # Create target_weights to be 0 for targets that are padding.
-      batch_weight = np.ones(self.batch_size, dtype=np.float32)
-      for batch_idx in xrange(self.batch_size):
-        # We set weight to 0 if the corresponding target is a PAD symbol.
-        # The corresponding target is decoder_input shifted by 1 forward.
-        if length_idx < decoder_size - 1:
-          target = decoder_inputs[batch_idx][length_idx + 1]
-        if length_idx == decoder_size - 1 or target == data_utils.PAD_ID:
-          batch_weight[batch_idx] = 0.0
-      batch_weights.append(batch_weight)
-    return batch_encoder_inputs, batch_decoder_inputs, batch_weights
+    if out is None:
+      out = (np.empty((encoder_size, len(pairs)), dtype=np.int32),
+             np.empty((decoder_size, len(pairs)), dtype=np.int32),
+             np.empty((decoder_size, len(pairs)), dtype=np.float32))
+    batch_encoder, batch_decoder, batch_weights = out
+    batch_encoder.fill(data_utils.PAD_ID)
+    batch_decoder.fill(data_utils.PAD_ID)
+    batch_decoder[0] = data_utils.GO_ID
+    for n, (encoder_input, decoder_input) in enumerate(pairs):
+      if encoder_input:
+        batch_encoder[encoder_size - len(encoder_input):, n] = \
+            encoder_input[::-1]
+      batch_decoder[1:len(decoder_input) + 1, n] = decoder_input
+    # Create target_weights to be 0 for targets that are padding.
+    # The corresponding target is decoder_input shifted by 1 forward.
+    np.not_equal(batch_decoder[1:], data_utils.PAD_ID, out=batch_weights[:-1])
+    batch_weights[-1] = 0.0
+    # Rows of the time-major matrices are the batch-major vectors.
+    return list(batch_encoder), list(batch_decoder), list(batch_weights)
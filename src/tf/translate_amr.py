@@ -65,12 +65,21 @@ tf.app.flags.DEFINE_string("data_dir", "./data", "Data directory")
 tf.app.flags.DEFINE_string("train_dir", "./model", "Training directory.")
 tf.app.flags.DEFINE_integer("max_train_data_size", 0,
                             "Limit on the size of training data (0: no limit).")
+tf.app.flags.DEFINE_boolean("binary_corpus", False,
+                            "Convert the token-id files once into a binary "
+                            "corpus and memory-map it instead of parsing them.")
 tf.app.flags.DEFINE_integer("steps_per_checkpoint", 2000,
                             "How many training steps to do per checkpoint.")
 tf.app.flags.DEFINE_boolean("decode", False,
                             "Set to True for interactive decoding.")
 tf.app.flags.DEFINE_boolean("use_lstm", False,
                             "Set to True for LSTM cell")
+tf.app.flags.DEFINE_string("decode_input", "",
+                           "With --decode, decode this token file in batches "
+                           "of --batch_size instead of reading standard input.")
+tf.app.flags.DEFINE_string("decode_output", "",
+                           "File to write the --decode_input outputs to, one "
+                           "per line in input order (default: standard output).")
 tf.app.flags.DEFINE_boolean("self_test", False,
                             "Run a self-test if this is set to True.")
 
@@ -97,7 +106,13 @@ def read_data(source_path, target_path, max_size=None):
       (source, target) pairs read from the provided data files that fit
       into the n-th bucket, i.e., such that len(source) < _buckets[n][0] and
       len(target) < _buckets[n][1]; source and target are lists of token-ids.
+      With --binary_corpus, data_set[n] is a data_utils_amr.CorpusBucket that
+      reads the pairs from the memory-mapped corpus instead.
   """
+  if FLAGS.binary_corpus:
+    corpus_path = "%s.%s.corpus" % (source_path, os.path.basename(target_path))
+    data_utils_amr.ids_to_corpus(source_path, target_path, corpus_path, _buckets)
+    return data_utils_amr.load_corpus(corpus_path, _buckets, max_size)
   data_set = [[] for _ in _buckets]
   with tf.gfile.GFile(source_path, mode="r") as source_file:
     with tf.gfile.GFile(target_path, mode="r") as target_file:
@@ -178,7 +193,7 @@ def train():
       # Get a batch and make a step.
       start_time = time.time()
       encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-          train_set, bucket_id)
+          train_set, bucket_id, reuse_buffer=True)
       _, step_loss, _ = model.step(sess, encoder_inputs, decoder_inputs,
                                    target_weights, bucket_id, False)
       step_time += (time.time() - start_time) / FLAGS.steps_per_checkpoint
@@ -206,7 +221,7 @@ def train():
             print("  eval: empty bucket %d" % (bucket_id))
             continue
           encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-              dev_set, bucket_id)
+              dev_set, bucket_id, reuse_buffer=True)
           _, eval_loss, _ = model.step(sess, encoder_inputs, decoder_inputs,
                                        target_weights, bucket_id, True)
           eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
@@ -240,8 +255,8 @@ def decode():
       bucket_id = min([b for b in xrange(len(_buckets))
                        if _buckets[b][0] > len(token_ids)])
       # Get a 1-element batch to feed the sentence to the model.
-      encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-          {bucket_id: [(token_ids, [])]}, bucket_id)
+      encoder_inputs, decoder_inputs, target_weights = model.prepare_batch(
+          [(token_ids, [])], bucket_id)
       # Get output logits for the sentence.
       _, _, output_logits = model.step(sess, encoder_inputs, decoder_inputs,
                                        target_weights, bucket_id, True)
@@ -257,6 +272,86 @@ def decode():
       sentence = sys.stdin.readline()
 
 
+def make_decode_batches(token_ids_list, batch_size):
+  """Group sentences into decoding batches by bucket and length.
+
+  Args:
+    token_ids_list: list of token-id lists, one per input sentence; each must
+      fit into the largest bucket.
+    batch_size: maximum number of sentences in a batch.
+
+  Returns:
+    A list of (bucket_id, indices) pairs; indices are positions in
+    token_ids_list of sentences of similar length that fit into bucket_id.
+  """
+  bucket_ids = [min([b for b in xrange(len(_buckets))
+                     if _buckets[b][0] > len(token_ids)])
+                for token_ids in token_ids_list]
+  order = sorted(xrange(len(token_ids_list)),
+                 key=lambda i: (bucket_ids[i], len(token_ids_list[i])))
+  batches = []
+  for i in order:
+    if (batches and batches[-1][0] == bucket_ids[i] and
+        len(batches[-1][1]) < batch_size):
+      batches[-1][1].append(i)
+    else:
+      batches.append((bucket_ids[i], [i]))
+  return batches
+
+
+def decode_file():
+  """Decode FLAGS.decode_input in batches and write outputs in input order."""
+  with tf.Session() as sess:
+    # Create model and load parameters.
+    model = create_model(sess, True)
+
+    # Load vocabularies.
+    src_vocab_path = os.path.join(FLAGS.data_dir,
+                                 "vocab%d.src" % FLAGS.src_vocab_size)
+    dst_vocab_path = os.path.join(FLAGS.data_dir,
+                                 "vocab%d.dst" % FLAGS.dst_vocab_size)
+
+    src_vocab, _ = data_utils_amr.initialize_vocabulary(src_vocab_path)
+    _, rev_dst_vocab = data_utils_amr.initialize_vocabulary(dst_vocab_path)
+
+    # Get token-ids for all input sentences, truncated to the largest bucket.
+    token_ids_list = []
+    with tf.gfile.GFile(FLAGS.decode_input, mode="r") as input_file:
+      for sentence in input_file:
+        token_ids = data_utils_amr.sentence_to_token_ids(tf.compat.as_bytes(sentence), src_vocab)
+        token_ids_list.append(token_ids[:_buckets[-1][0] - 1])
+
+    results = [None] * len(token_ids_list)
+    start_time = time.time()
+    for bucket_id, indices in make_decode_batches(token_ids_list,
+                                                  FLAGS.batch_size):
+      model.batch_size = len(indices)
+      encoder_inputs, decoder_inputs, target_weights = model.prepare_batch(
+          [(token_ids_list[i], []) for i in indices], bucket_id)
+      _, _, output_logits = model.step(sess, encoder_inputs, decoder_inputs,
+                                       target_weights, bucket_id, True)
+      # This is a greedy decoder - outputs are just argmaxes of output_logits,
+      # one column per sentence in the batch.
+      best_ids = np.argmax(np.array(output_logits), axis=2)
+      for n, i in enumerate(indices):
+        outputs = [int(output) for output in best_ids[:, n]]
+        # If there is an EOS symbol in outputs, cut them at that point.
+        if data_utils_amr.EOS_ID in outputs:
+          outputs = outputs[:outputs.index(data_utils_amr.EOS_ID)]
+        results[i] = " ".join([tf.compat.as_str(rev_dst_vocab[output]) for output in outputs])
+    print("Decoded %d sentences in %.2f seconds." %
+          (len(results), time.time() - start_time), file=sys.stderr)
+
+    if FLAGS.decode_output:
+      output_file = tf.gfile.GFile(FLAGS.decode_output, mode="w")
+    else:
+      output_file = sys.stdout
+    for result in results:
+      output_file.write(result + "\n")
+    if FLAGS.decode_output:
+      output_file.close()
+
+
 def self_test():
   """Test the translation model."""
   with tf.Session() as sess:
@@ -280,6 +375,8 @@ def self_test():
 def main(_):
   if FLAGS.self_test:
     self_test()
+  elif FLAGS.decode and FLAGS.decode_input:
+    decode_file()
   elif FLAGS.decode:
     decode()
   else:
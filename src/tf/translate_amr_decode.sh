@@ -11,3 +11,7 @@ model_dir=./model_$size
 
 CUDA_VISIBLE_DEVICES=$gpuid python translate_amr.py --decode --train_dir $model_dir --size $size --use_lstm
 
+
+# To decode a whole token file in batches of 64, writing one output per line in input order:
+# CUDA_VISIBLE_DEVICES=$gpuid python translate_amr.py --decode --train_dir $model_dir --size $size --use_lstm \
+#     --batch_size 64 --decode_input <token file> --decode_output <output file>
@@ -94,6 +94,12 @@ class Network(object):
         If True, create an input variable that can hold a sparse matrix.
         Defaults to False, which assumes all arrays are dense.
 
+    index_input : bool
+        If True, encoder-decoder networks take their source and target
+        sequences as int32 matrices of token indices (time-steps, batch)
+        instead of dense one-hot tensors; the input layer then looks up the
+        embeddings directly. Defaults to False.
+
     Attributes
     ----------
     inputs : list of theano variables
@@ -104,11 +110,13 @@ class Network(object):
         True iff this network expects target weight inputs during training.
     '''
 
-    def __init__(self, layers, weighted=False, encdec = False,sparse_input=False):
+    def __init__(self, layers, weighted=False, encdec = False,sparse_input=False,
+                 index_input=False):
         self._graphs = {}     # cache of symbolic computation graphs
         self._functions = {}  # cache of callable feedforward functions
         self.weighted = weighted
         self.encdec = encdec
+        self.index_input = index_input
         self.inputs = list(self._setup_vars(sparse_input))
         self.layers = []
         for i, layer in enumerate(layers):
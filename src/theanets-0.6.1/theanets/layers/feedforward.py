@@ -92,14 +92,23 @@ class InputEncDec(base.Layer):
             A single integer specifying the size of this layer.
         '''
         return self.size
+
+    def _embed(self, x, name):
+        '''Map one-hot rows or int32 token indices to their embeddings.'''
+        if x.ndim == 2:
+            # token indices: negative entries are padding and embed to zeros,
+            # just like the all-zero rows of a one-hot input.
+            return self.find(name)[x] * TT.ge(x, 0).dimshuffle(0, 1, 'x')
+        return TT.dot(x, self.find(name))
+
     def transform(self,inputs):
         ''' Do nothing, just pass the inputs.'''
         src = inputs['src'] 
         dst = inputs['dst']
         src_mask = inputs['src_mask']
         # Now map them.
-        y_src = TT.dot(src, self.find('w_s'))
-        y_dst = TT.dot(dst, self.find('w_d'))
+        y_src = self._embed(src, 'w_s')
+        y_dst = self._embed(dst, 'w_d')
 
         return dict(out = y_src, src = y_src, dst = y_dst, src_mask = src_mask),[]
 
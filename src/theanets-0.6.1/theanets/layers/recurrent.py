@@ -714,55 +714,89 @@ class LSTMDec(Recurrent):
             truncate_gradient=self.kwargs.get('bptt_limit', -1)
         )
 
-    def transform(self, inputs):
+    def _split(self, z):
+        n = self.size
+        return z[:, 0*n:1*n], z[:, 1*n:2*n], z[:, 2*n:3*n], z[:, 3*n:4*n]
+
+    def _step(self, x_t, h_tm1, c_tm1, hid_ref, mask_ref, V):
+        x_ct = TT.dot(x_t, self.find('xh')) + self.find('b') # batch_size * h_size
+         
+        xi, xf, xc, xo = self._split(x_ct + TT.dot(h_tm1, self.find('hh')))
+        i_t = TT.nnet.sigmoid(xi + c_tm1 * self.find('ci'))
+        f_t = TT.nnet.sigmoid(xf + c_tm1 * self.find('cf'))
+        c_t = f_t * c_tm1 + i_t * TT.tanh(xc)
+        o_t = TT.nnet.sigmoid(xo + c_t * self.find('co'))
+        h_t = o_t * TT.tanh(c_t)
+
+        #hid_p = TT.dot(h_t, V) # batch_size * size.
+        hid_p = TT.dot(h_tm1, V) # batch_size * size.
+        hid_p_dim = hid_p.dimshuffle(('x', 0, 1))
+        x_ts = TT.extra_ops.repeat(hid_p_dim, hid_ref.shape[0], axis = 0) # mask_len * batch_size * size
+
+        emb = x_ts * hid_ref # mask_len * batch_size * size.
+        beta = TT.sum(emb, axis=-1) # mask_len * batch_size.
+        beta_b = TT.where( mask_ref > 0, beta, beta.min())
+        beat_b = beta_b - beta_b.max(axis=0, keepdims=True)
+        #beat_b = beta_b.clip(-50, 0)
+        z = TT.exp(beta_b * mask_ref) * mask_ref
+        z_sum = TT.sum(z, axis = 0, keepdims = True)
+        #z = theano.printing.Print('this is a very important value')(z)
+        #z_sum = theano.printing.Print('this is a very important value')(z_sum)
+        #alpha = (z * mask_ref ) / ( z * mask_ref ).sum(axis=0, keepdims=True) # max_len *  batch_size.
+        #alpha = z / TT.sum(z, axis = 0, keepdims = True)
+        alpha = z / z_sum
+        #if stage == 'train':
+        #    alpha_sample = self.h_sampling_mask * self.rng.multinomial(pvals = alpha.T, dtype = 'float32') \
+        #                   + (1. - self.h_sampling_mask) * alpha.T
+        #    alpha_sample = alpha_sample.T
+        #    logging.info('LSTMAtt: stage is %s, using the random.', stage)
+        #elif stage == 'test': # argmax for prediction.
+        #    alpha_sample = TT.cast(TT.eq(TT.arange(alpha.shape[0])[:,None], \
+        #    #alpha_sample = TT.cast(TT.eq(TT.arange(alpha.shape[0])[None,:], \
+        #        TT.argmax(alpha,axis=0,keepdims=True)), theano.config.floatX)
+        #    logging.info('LSTMAtt: stage is %s, using the argmax.', stage)
+        hid_ref_dim = hid_ref.dimshuffle((2,0,1)) # emb_size * mask_len * batch_size
+        #att = alpha * hid_ref_dim # now is size * max_len * batch_size
+        att = hid_ref_dim * alpha# now is size * max_len * batch_size
+        att = att.sum(axis = 1) # size * batch_size
+
+        return [h_t, c_t, alpha, att.T]
+
+    def step(self, x_t, h_tm1, c_tm1, hid_enc, mask):
+        '''Advance the decoder by a single time step.
+
+        This applies the same recurrence as :func:`transform`, but for one
+        time step only, so that a decoder can be driven incrementally from a
+        carried ``(h, c)`` state instead of rescanning the whole prefix.
 
-        def split(z):
-            n = self.size
-            return z[:, 0*n:1*n], z[:, 1*n:2*n], z[:, 2*n:3*n], z[:, 3*n:4*n]
+        Parameters
+        ----------
+        x_t : theano expression (batch_size, input_size)
+            Embedded input tokens for the current time step.
+        h_tm1 : theano expression (batch_size, size)
+            Hidden state from the previous time step.
+        c_tm1 : theano expression (batch_size, size)
+            Cell state from the previous time step.
+        hid_enc : theano expression (max_src_len, batch_size, size)
+            Encoder hidden states to attend over.
+        mask : theano expression (max_src_len, batch_size)
+            Mask over the valid encoder positions.
 
-        def fn(x_t, h_tm1, c_tm1, hid_ref, mask_ref, V):
-            x_ct = TT.dot(x_t, self.find('xh')) + self.find('b') # batch_size * h_size
-             
-            xi, xf, xc, xo = split(x_ct + TT.dot(h_tm1, self.find('hh')))
-            i_t = TT.nnet.sigmoid(xi + c_tm1 * self.find('ci'))
-            f_t = TT.nnet.sigmoid(xf + c_tm1 * self.find('cf'))
-            c_t = f_t * c_tm1 + i_t * TT.tanh(xc)
-            o_t = TT.nnet.sigmoid(xo + c_t * self.find('co'))
-            h_t = o_t * TT.tanh(c_t)
+        Returns
+        -------
+        out : theano expression (batch_size, 2 * size)
+            The decoder output, i.e., the hidden state concatenated with the
+            attention context, as in the "out" output of :func:`transform`.
+        h_t : theano expression (batch_size, size)
+            Hidden state for the current time step.
+        c_t : theano expression (batch_size, size)
+            Cell state for the current time step.
+        '''
+        h_t, c_t, alpha, att = self._step(
+            x_t, h_tm1, c_tm1, hid_enc, mask, self.find('V'))
+        return TT.concatenate((h_t, att), axis=-1), h_t, c_t
 
-            #hid_p = TT.dot(h_t, V) # batch_size * size.
-            hid_p = TT.dot(h_tm1, V) # batch_size * size.
-            hid_p_dim = hid_p.dimshuffle(('x', 0, 1))
-            x_ts = TT.extra_ops.repeat(hid_p_dim, hid_ref.shape[0], axis = 0) # mask_len * batch_size * size
-
-            emb = x_ts * hid_ref # mask_len * batch_size * size.
-            beta = TT.sum(emb, axis=-1) # mask_len * batch_size.
-            beta_b = TT.where( mask_ref > 0, beta, beta.min())
-            beat_b = beta_b - beta_b.max(axis=0, keepdims=True)
-            #beat_b = beta_b.clip(-50, 0)
-            z = TT.exp(beta_b * mask_ref) * mask_ref
-            z_sum = TT.sum(z, axis = 0, keepdims = True)
-            #z = theano.printing.Print('this is a very important value')(z)
-            #z_sum = theano.printing.Print('this is a very important value')(z_sum)
-            #alpha = (z * mask_ref ) / ( z * mask_ref ).sum(axis=0, keepdims=True) # max_len *  batch_size.
-            #alpha = z / TT.sum(z, axis = 0, keepdims = True)
-            alpha = z / z_sum
-            #if stage == 'train':
-            #    alpha_sample = self.h_sampling_mask * self.rng.multinomial(pvals = alpha.T, dtype = 'float32') \
-            #                   + (1. - self.h_sampling_mask) * alpha.T
-            #    alpha_sample = alpha_sample.T
-            #    logging.info('LSTMAtt: stage is %s, using the random.', stage)
-            #elif stage == 'test': # argmax for prediction.
-            #    alpha_sample = TT.cast(TT.eq(TT.arange(alpha.shape[0])[:,None], \
-            #    #alpha_sample = TT.cast(TT.eq(TT.arange(alpha.shape[0])[None,:], \
-            #        TT.argmax(alpha,axis=0,keepdims=True)), theano.config.floatX)
-            #    logging.info('LSTMAtt: stage is %s, using the argmax.', stage)
-            hid_ref_dim = hid_ref.dimshuffle((2,0,1)) # emb_size * mask_len * batch_size
-            #att = alpha * hid_ref_dim # now is size * max_len * batch_size
-            att = hid_ref_dim * alpha# now is size * max_len * batch_size
-            att = att.sum(axis = 1) # size * batch_size
-
-            return [h_t, c_t, alpha, att.T]
+    def transform(self, inputs):
 
         hid_enc = inputs['hid1:out'] # max_len * batch_size * emb_size
         #hid_enc = theano.printing.Print('this is a very important value')(hid_enc)
@@ -772,7 +806,7 @@ class LSTMDec(Recurrent):
 
         batch_size = x.shape[1]
         (out, cell, alpha, att), updates = self._scan_(
-            fn,
+            self._step,
             x,
             [('h', batch_size), ('c', batch_size)],
             non_seq = [hid_enc, mask, self.find('V')] )
@@ -367,10 +367,16 @@ class Classifier(feedforward.Classifier):
 
         assert not sparse_input, 'Theanets does not support sparse recurrent models!'
 
-        self.src = TT.ftensor3('src')
+        if self.index_input:
+            # token indices (time, batch); the input layer embeds them and
+            # treats negative indices as padding.
+            self.src = TT.imatrix('src')
+            self.dst = TT.imatrix('dst')
+        else:
+            self.src = TT.ftensor3('src')
+            self.dst = TT.ftensor3('dst')
         #self.src_mask = TT.imatrix('src_mask')
         self.src_mask = TT.matrix('src_mask')
-        self.dst = TT.ftensor3('dst')
         self.labels = TT.imatrix('labels')
         self.weights = TT.matrix('weights')
 
@@ -453,17 +459,23 @@ class Classifier(feedforward.Classifier):
             if cnt_ins == 0:
                 # we do not need the 20 steps, now we have find a total of $beam_size$ candidates. just break.
                 break
-            x_i = np.zeros((max_b, cnt_ins, word_num), dtype='float32')
-            x_src_i = np.zeros((x_src.shape[0], cnt_ins, x_src.shape[2]), dtype='float32')
+            if self.dst.ndim == 2:
+                x_i = -np.ones((max_b, cnt_ins), dtype='int32')
+            else:
+                x_i = np.zeros((max_b, cnt_ins, word_num), dtype='float32')
+            x_src_i = np.zeros((x_src.shape[0], cnt_ins) + x_src.shape[2:], dtype=x_src.dtype)
             mask_src_i = np.zeros((mask_src.shape[0], cnt_ins), dtype='float32')
             idx_base = 0
             for j,idx_prev_j in enumerate(idx_prevs):
                 for m, idx_prev in enumerate(idx_prev_j):
+                    if self.dst.ndim == 2:
+                        x_i[:len(idx_prev), m + idx_base] = idx_prev
+                        continue
                     for k in range(len(idx_prev)):
                         x_i[k, m + idx_base, idx_prev[k]] = 1.0
                 # This may be potentially error? When one batch or one image is empty (have already generated 20 sentences.
                 #v_i[idx_base:idx_base + len(idx_prev_j),:] = img_fea[j,:]
-                x_src_i[:,idx_base:idx_base+len(idx_prev_j),:] = x_src[:,j:j+1,:] # just make np happy
+                x_src_i[:,idx_base:idx_base+len(idx_prev_j)] = x_src[:,j:j+1] # just make np happy
                 mask_src_i[:,idx_base:idx_base+len(idx_prev_j)] = mask_src[:,j:j+1] # just make np happy
                 idx_base += len(idx_prev_j)
 
@@ -493,6 +505,102 @@ class Classifier(feedforward.Classifier):
             y.append(pred)
         return y 
 
+    def _decode_functions(self):
+        '''Compile (and cache) the step-wise decoding functions.
+
+        Returns
+        -------
+        encode : callable
+            A function mapping ``src`` to the encoder hidden states.
+        step : callable
+            A function mapping ``(prev, h, c, hid_enc, src_mask)`` -- the
+            previous target tokens, the carried decoder state, and the cached
+            encoder states -- to ``(prob, h, c)`` for the next time step.
+        '''
+        key = 'decode_step'
+        if key not in self._functions:
+            enc, dec = self.layers[1], self.layers[2]
+            outputs, _ = self.build_graph()
+            encode = theano.function([self.src], outputs[enc.output_name()])
+
+            prev = TT.ivector('prev')
+            h_tm1 = TT.matrix('h_tm1')
+            c_tm1 = TT.matrix('c_tm1')
+            hid_enc = TT.tensor3('hid_enc')
+            x_t = self.layers[0].find('w_d')[prev]
+            out, h_t, c_t = dec.step(x_t, h_tm1, c_tm1, hid_enc, self.src_mask)
+            outputs = {dec.output_name(): out}
+            for layer in self.layers[3:]:
+                out, _ = layer.transform(outputs)
+                outputs.update(
+                    (layer.output_name(name), expr) for name, expr in out.items())
+            step = theano.function(
+                [prev, h_tm1, c_tm1, hid_enc, self.src_mask],
+                [outputs[self.output_name()], h_t, c_t])
+            self._functions[key] = encode, step
+        return self._functions[key]
+
+    def predict_captions_incremental_batch(self, x_src, mask_src, beam_size=20,
+                                           max_steps=20):
+        '''Beam search decoding that advances the decoder one token at a time.
+
+        This returns the same beams as :func:`predict_captions_forward_batch`,
+        but the encoder is run only once per batch and every beam carries its
+        own decoder ``(h, c)`` state, so each step costs a single decoder time
+        step instead of a full pass over the prefix.
+
+        Parameters
+        ----------
+        x_src : ndarray (max_src_len, batch_size, src_size)
+            Source sequences to decode, either one-hot or, for networks built
+            with ``index_input``, int32 token indices (max_src_len, batch_size).
+        mask_src : ndarray (max_src_len, batch_size)
+            Mask over the valid source positions.
+        beam_size : int, optional
+            Number of hypotheses to keep for each source sequence.
+        max_steps : int, optional
+            Maximum number of tokens to generate. Defaults to 20.
+
+        Returns
+        -------
+        beams : list of list of (float, list of int)
+            For each source sequence, the ``(log-probability, tokens)`` pairs of
+            its best hypotheses in decreasing order of score.
+        '''
+        encode, step = self._decode_functions()
+        hid_enc = encode(x_src)
+        batch_size = x_src.shape[1]
+        zeros = np.zeros((self.layers[2].size, ), theano.config.floatX)
+        # Important! 0 is the start token and 1 is the end token.
+        batch_of_beams = [[(0.0, [0], zeros, zeros)] for _ in range(batch_size)]
+
+        for _ in range(max_steps):
+            live = [(i, b) for i, beams in enumerate(batch_of_beams)
+                    for b in beams if b[1][-1] != 1]
+            if not live:
+                break
+            owner = np.array([i for i, _ in live])
+            prob, h, c = step(
+                np.array([b[1][-1] for _, b in live], 'int32'),
+                np.array([b[2] for _, b in live]),
+                np.array([b[3] for _, b in live]),
+                hid_enc[:, owner, :],
+                mask_src[:, owner])
+            l = np.log(1e-20 + prob)
+            top_indices = np.argsort(-l, axis=-1)[:, :beam_size]
+
+            beam_c = [[b for b in beams if b[1][-1] == 1]
+                      for beams in batch_of_beams]
+            for row, (i, b) in enumerate(live):
+                for wordix in top_indices[row]:
+                    beam_c[i].append(
+                        (b[0] + l[row, wordix], b[1] + [wordix], h[row], c[row]))
+            for i, beams in enumerate(beam_c):
+                beams.sort(key=lambda b: (b[0], b[1]), reverse=True)
+                batch_of_beams[i] = beams[:beam_size]
+
+        return [[(b[0], b[1]) for b in beams] for beams in batch_of_beams]
+
     def predict_sequence(self, seed, steps, streams=1, rng=None):
         '''Draw a sequential sample of classes from this network.
 
@@ -0,0 +1,135 @@
+"""Asynchronous checkpoint writing for the translation models.
+
+Saving a checkpoint with model.saver.save blocks training until every
+variable, including the large output projection, is on disk. CheckpointWriter
+only copies the variable values out of the training session, which is fast,
+and writes them on a background thread from a separate graph and session.
+The files have the same variable names, so model.saver.restore and
+tf.train.get_checkpoint_state work on them as before. At most max_pending
+snapshots wait to be written; save blocks beyond that, so memory stays
+bounded when writing is slower than the save interval.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+import six
+from six.moves import queue
+import tensorflow as tf
+
+
+class CheckpointWriter(object):
+  """Snapshot model variables and write them as checkpoints in the background.
+
+  The writer keeps the max_to_keep most recently written checkpoints, like
+  tf.train.Saver does. Callers that only save when the dev perplexity improves
+  (as train_early_stop does) therefore keep the max_to_keep best ones.
+  """
+
+  def __init__(self, session, variables=None, max_to_keep=5, max_pending=1):
+    """Create the writer and start its thread.
+
+    Args:
+      session: the training session to snapshot variables from.
+      variables: variables to save; defaults to tf.all_variables().
+      max_to_keep: number of checkpoints to keep on disk.
+      max_pending: number of snapshots that may wait for the writer thread
+        besides the one it is writing.
+    """
+    self.session = session
+    self.variables = variables if variables is not None else tf.all_variables()
+    self.max_to_keep = max_to_keep
+    # (checkpoint path, snapshot seconds, write seconds) of each written save.
+    self.latencies = []
+    self._jobs = queue.Queue(maxsize=max_pending)
+    # sys.exc_info() of the error that stopped the writer thread, if any.
+    self._error = None
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def save(self, checkpoint_path, global_step, callback=None):
+    """Snapshot the variables now and write them later.
+
+    Args:
+      checkpoint_path: path prefix of the checkpoint, as for Saver.save.
+      global_step: step number appended to the checkpoint name.
+      callback: optional function called with the written checkpoint path,
+        on the writer thread.
+
+    Returns:
+      The seconds the snapshot took and the wait for a free queue slot.
+
+    Raises:
+      The error that stopped the writer thread, if an earlier write failed.
+    """
+    self._check_error()
+    start_time = time.time()
+    values = self.session.run(self.variables)
+    snapshot_time = time.time() - start_time
+    self._jobs.put((checkpoint_path, global_step, values, snapshot_time,
+                    callback))
+    return time.time() - start_time
+
+  def close(self):
+    """Write the waiting checkpoints and stop the thread.
+
+    Raises:
+      The error that stopped the writer thread, if a write failed.
+    """
+    self._jobs.put(None)
+    self._thread.join()
+    self._check_error()
+    if self.latencies:
+      print("Wrote %d checkpoints: snapshot %.2fs, write %.2fs on average."
+            % (len(self.latencies),
+               sum(l[1] for l in self.latencies) / len(self.latencies),
+               sum(l[2] for l in self.latencies) / len(self.latencies)))
+
+  def _check_error(self):
+    if self._error is not None:
+      six.reraise(*self._error)
+
+  def _run(self):
+    try:
+      self._write_jobs()
+    except Exception:  # pylint: disable=broad-except
+      self._error = sys.exc_info()
+      # Keep taking jobs, so that save and close do not block on the full
+      # queue of a stopped writer; they raise the error instead.
+      while self._jobs.get() is not None:
+        pass
+
+  def _write_jobs(self):
+    with tf.Graph().as_default(), tf.device("/cpu:0"):
+      # One variable per model variable, saved under the same name, with an
+      # assign op to load a snapshot into it.
+      placeholders, assign_ops, var_list = [], [], {}
+      for variable in self.variables:
+        dtype = variable.dtype.base_dtype
+        shape = variable.get_shape().as_list()
+        copy = tf.Variable(tf.zeros(shape, dtype=dtype), trainable=False)
+        placeholder = tf.placeholder(dtype, shape=shape)
+        placeholders.append(placeholder)
+        assign_ops.append(copy.assign(placeholder))
+        var_list[variable.op.name] = copy
+      saver = tf.train.Saver(var_list, max_to_keep=self.max_to_keep)
+      with tf.Session() as sess:
+        while True:
+          job = self._jobs.get()
+          if job is None:
+            break
+          checkpoint_path, global_step, values, snapshot_time, callback = job
+          start_time = time.time()
+          sess.run(assign_ops, dict(zip(placeholders, values)))
+          path = saver.save(sess, checkpoint_path, global_step=global_step)
+          write_time = time.time() - start_time
+          self.latencies.append((path, snapshot_time, write_time))
+          print("  checkpoint %s: snapshot %.2fs, write %.2fs"
+                % (path, snapshot_time, write_time))
+          if callback is not None:
+            callback(path)
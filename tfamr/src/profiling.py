@@ -0,0 +1,153 @@
+"""Step-time breakdown for the translation model training loops.
+
+TrainingProfiler accumulates wall-clock time per phase of a training step
+(batch sampling, feed construction, session run, evaluation, checkpointing),
+token and padding counts per bucket, and optionally captures TensorFlow
+timeline traces. Every report() prints one summary line and, if a log path is
+given, appends the same numbers as one JSON object per line, so runs can be
+compared with standard tools.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import json
+import math
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import data_utils
+
+
+def _finite(value):
+  """Return value with non-finite floats, also nested ones, set to None."""
+  if isinstance(value, dict):
+    return dict((key, _finite(item)) for key, item in value.items())
+  if isinstance(value, (list, tuple)):
+    return [_finite(item) for item in value]
+  if isinstance(value, float) and (math.isinf(value) or math.isnan(value)):
+    return None
+  return value
+
+
+class TrainingProfiler(object):
+  """Collect per-phase timers and per-bucket token counts between reports."""
+
+  def __init__(self, log_path=None, trace_steps=0, trace_dir=None):
+    """Create the profiler.
+
+    Args:
+      log_path: JSONL file to append reports to; if empty, reports are only
+        printed.
+      trace_steps: if positive, capture a TensorFlow timeline trace of every
+        trace_steps-th session run.
+      trace_dir: directory for the timeline-<run>.json trace files.
+    """
+    self.log_path = log_path
+    self.trace_steps = trace_steps
+    self.trace_dir = trace_dir
+    if trace_steps > 0 and not hasattr(tf, "RunMetadata"):
+      print("Timeline traces need tf.RunOptions and tf.RunMetadata; "
+            "not tracing.")
+      self.trace_steps = 0
+    self.run_count = 0
+    self._reset()
+
+  def _reset(self):
+    self.start_time = time.time()
+    self.phases = {}
+    self.steps = 0
+    # bucket id -> [batches, source tokens, target tokens, padded positions]
+    self.buckets = {}
+
+  def add(self, phase, seconds):
+    """Add seconds to the timer of phase."""
+    self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """Time the enclosed block as phase name."""
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self.add(name, time.time() - start_time)
+
+  def record_batch(self, bucket_id, encoder_inputs, target_weights):
+    """Count the real and padded positions of one training batch."""
+    source_tokens = sum(np.count_nonzero(inputs != data_utils.PAD_ID)
+                        for inputs in encoder_inputs)
+    target_tokens = sum(float(weights.sum()) for weights in target_weights)
+    positions = (len(encoder_inputs) + len(target_weights)) * \
+        len(encoder_inputs[0])
+    stats = self.buckets.setdefault(bucket_id, [0, 0, 0.0, 0])
+    stats[0] += 1
+    stats[1] += source_tokens
+    stats[2] += target_tokens
+    stats[3] += positions
+    self.steps += 1
+
+  def run(self, session, fetches, feed_dict):
+    """session.run, timed as phase "run" and traced every trace_steps runs."""
+    self.run_count += 1
+    if self.trace_steps > 0 and self.run_count % self.trace_steps == 0:
+      from tensorflow.python.client import timeline
+      run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+      run_metadata = tf.RunMetadata()
+      with self.phase("run"):
+        outputs = session.run(fetches, feed_dict, options=run_options,
+                              run_metadata=run_metadata)
+      trace_path = os.path.join(self.trace_dir or ".",
+                                "timeline-%d.json" % self.run_count)
+      with open(trace_path, "w") as trace_file:
+        trace_file.write(timeline.Timeline(run_metadata.step_stats)
+                         .generate_chrome_trace_format())
+      return outputs
+    with self.phase("run"):
+      return session.run(fetches, feed_dict)
+
+  def report(self, global_step, **extra):
+    """Print and log the numbers since the last report, then reset them.
+
+    Args:
+      global_step: global step of the model at this report.
+      **extra: further JSON-serializable values to log, e.g. perplexity;
+        infinite and NaN values are logged as null.
+
+    Returns:
+      The logged record.
+    """
+    elapsed = time.time() - self.start_time
+    buckets = {}
+    total_tokens, total_positions = 0.0, 0
+    for bucket_id, (batches, source, target, positions) in \
+        sorted(self.buckets.items()):
+      tokens = source + target
+      buckets[str(bucket_id)] = {
+          "batches": batches, "source_tokens": int(source),
+          "target_tokens": int(target),
+          "padding_ratio": 1.0 - tokens / positions if positions else 0.0}
+      total_tokens += tokens
+      total_positions += positions
+    record = {
+        "time": time.time(), "global_step": int(global_step),
+        "steps": self.steps, "seconds": elapsed,
+        "phases": self.phases,
+        "tokens_per_sec": total_tokens / elapsed if elapsed > 0 else 0.0,
+        "padding_ratio": (1.0 - total_tokens / total_positions
+                          if total_positions else 0.0),
+        "buckets": buckets}
+    record.update(extra)
+    print("  profile: %s tokens/sec %.0f padding %.2f"
+          % (" ".join("%s %.2fs" % item for item in sorted(self.phases.items())),
+             record["tokens_per_sec"], record["padding_ratio"]))
+    if self.log_path:
+      with open(self.log_path, "a") as log_file:
+        log_file.write(json.dumps(_finite(record), sort_keys=True,
+                                  allow_nan=False) + "\n")
+    self._reset()
+    return record
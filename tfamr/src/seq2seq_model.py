@@ -19,7 +19,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import random
+import time
 
 import numpy as np
 from six.moves import xrange  # pylint: disable=redefined-builtin
@@ -46,7 +46,8 @@ class Seq2SeqModel(object):
   def __init__(self, source_vocab_size, target_vocab_size, buckets, size,
                num_layers, max_gradient_norm, batch_size, learning_rate,
                learning_rate_decay_factor, use_lstm=True,
-               num_samples=512, forward_only=False, keep_prob=1.0):
+               num_samples=512, forward_only=False, keep_prob=1.0,
+               feed_previous=None):
     """Create the model.
 
     Args:
@@ -68,11 +69,18 @@ class Seq2SeqModel(object):
       use_lstm: if true, we use LSTM cells instead of GRU cells.
       num_samples: number of samples for sampled softmax.
       forward_only: if set, we do not construct the backward pass in the model.
+      feed_previous: if set, the decoder is fed its own previous outputs
+        instead of the decoder inputs; defaults to forward_only, clear it to
+        evaluate a forward-only model on known targets.
     """
     self.source_vocab_size = source_vocab_size
     self.target_vocab_size = target_vocab_size
     self.buckets = buckets
     self.batch_size = batch_size
+    self.forward_only = forward_only
+    self.keep_prob = keep_prob
+    if feed_previous is None:
+      feed_previous = forward_only
     self.learning_rate = tf.Variable(float(learning_rate), trainable=False)
     self.learning_rate_decay_op = self.learning_rate.assign(
         self.learning_rate * learning_rate_decay_factor)
@@ -96,12 +104,21 @@ class Seq2SeqModel(object):
                                             self.target_vocab_size)
       softmax_loss_function = sampled_loss
 
+    # Kept so that callers can compute full-softmax logits from the outputs.
+    self.output_projection = output_projection
+
     # Create the internal multi-layer cell for our RNN.
+    # The keep probability is fed by step(..), which feeds 1.0 for forward-only
+    # steps, so that evaluating the training graph is free of dropout.
+    self.keep_prob_placeholder = None
     single_cell = tf.nn.rnn_cell.GRUCell(size)
     if use_lstm:
       single_cell = tf.nn.rnn_cell.BasicLSTMCell(size)
       if not forward_only and keep_prob < 1:
-        single_cell = tf.nn.rnn_cell.DropoutWrapper(single_cell, output_keep_prob=keep_prob)
+        self.keep_prob_placeholder = tf.placeholder(tf.float32, shape=[],
+                                                    name="keep_prob")
+        single_cell = tf.nn.rnn_cell.DropoutWrapper(
+            single_cell, output_keep_prob=self.keep_prob_placeholder)
     cell = single_cell
     if num_layers > 1:
       cell = tf.nn.rnn_cell.MultiRNNCell([single_cell] * num_layers)
@@ -137,7 +154,8 @@ class Seq2SeqModel(object):
     if forward_only:
       self.outputs, self.losses = tf.nn.seq2seq.model_with_buckets(
           self.encoder_inputs, self.decoder_inputs, targets,
-          self.target_weights, buckets, lambda x, y: seq2seq_f(x, y, True),
+          self.target_weights, buckets,
+          lambda x, y: seq2seq_f(x, y, feed_previous),
           softmax_loss_function=softmax_loss_function)
       # If we use output projection, we need to project outputs for decoding.
       if output_projection is not None:
@@ -169,8 +187,12 @@ class Seq2SeqModel(object):
 
     self.saver = tf.train.Saver(tf.all_variables())
 
+    # Reusable batch buffers of get_batch, by bucket and batch size.
+    self._batch_buffers = {}
+    self._last_target = np.zeros([0], dtype=np.int32)
+
   def step(self, session, encoder_inputs, decoder_inputs, target_weights,
-           bucket_id, forward_only):
+           bucket_id, forward_only, profiler=None):
     """Run a step of the model feeding the given inputs.
 
     Args:
@@ -179,7 +201,10 @@ class Seq2SeqModel(object):
       decoder_inputs: list of numpy int vectors to feed as decoder inputs.
       target_weights: list of numpy float vectors to feed as target weights.
       bucket_id: which bucket of the model to use.
-      forward_only: whether to do the backward step or only forward.
+      forward_only: whether to do the backward step or only forward; forward
+        steps run without dropout.
+      profiler: optional profiling.TrainingProfiler that times the feed
+        construction and the session run.
 
     Returns:
       A triple consisting of gradient norm (or None if we did not do backward),
@@ -202,6 +227,7 @@ class Seq2SeqModel(object):
                        " %d != %d." % (len(target_weights), decoder_size))
 
     # Input feed: encoder inputs, decoder inputs, target_weights, as provided.
+    start_time = time.time()
     input_feed = {}
     for l in xrange(encoder_size):
       input_feed[self.encoder_inputs[l].name] = encoder_inputs[l]
@@ -211,7 +237,12 @@ class Seq2SeqModel(object):
 
     # Since our targets are decoder inputs shifted by one, we need one more.
     last_target = self.decoder_inputs[decoder_size].name
-    input_feed[last_target] = np.zeros([self.batch_size], dtype=np.int32)
+    if len(self._last_target) != self.batch_size:
+      self._last_target = np.zeros([self.batch_size], dtype=np.int32)
+    input_feed[last_target] = self._last_target
+    if self.keep_prob_placeholder is not None:
+      input_feed[self.keep_prob_placeholder.name] = (
+          1.0 if forward_only else self.keep_prob)
 
     # Output feed: depends on whether we do a backward step or not.
     if not forward_only:
@@ -223,68 +254,90 @@ class Seq2SeqModel(object):
       for l in xrange(decoder_size):  # Output logits.
         output_feed.append(self.outputs[bucket_id][l])
 
-    outputs = session.run(output_feed, input_feed)
+    if profiler is None:
+      outputs = session.run(output_feed, input_feed)
+    else:
+      profiler.add("feed", time.time() - start_time)
+      outputs = profiler.run(session, output_feed, input_feed)
     if not forward_only:
       return outputs[1], outputs[2], None  # Gradient norm, loss, no outputs.
     else:
       return None, outputs[0], outputs[1:]  # No gradient norm, loss, outputs.
 
-  def get_batch(self, data, bucket_id):
+  def get_batch(self, data, bucket_id, reuse_buffer=False):
     """Get a random batch of data from the specified bucket, prepare for step.
 
     To feed data in step(..) it must be a list of batch-major vectors, while
-    data here contains single length-major cases. So the main logic of this
-    function is to re-index data cases to be in the proper format for feeding.
+    data here contains single length-major cases. Only the sampled cases are
+    read and padded, so memory-mapped buckets of data_utils.load_corpus are
+    never copied as a whole.
 
     Args:
       data: a tuple of size len(self.buckets) in which each element contains
         lists of pairs of input and output data that we use to create a batch.
       bucket_id: integer, which bucket to get the batch for.
+      reuse_buffer: if True, pad into matrices kept by the model for this
+        bucket and batch size instead of allocating new ones; the returned
+        vectors are then overwritten by the next get_batch call.
 
     Returns:
       The triple (encoder_inputs, decoder_inputs, target_weights) for
       the constructed batch that has the proper format to call step(...) later.
     """
+    # Get a random batch of encoder and decoder inputs from data.
+    bucket = data[bucket_id]
+    indices = np.random.randint(len(bucket), size=self.batch_size)
+    pairs = [bucket[i] for i in indices]
+    out = None
+    if reuse_buffer:
+      key = (bucket_id, self.batch_size)
+      if key not in self._batch_buffers:
+        encoder_size, decoder_size = self.buckets[bucket_id]
+        self._batch_buffers[key] = (
+            np.empty((encoder_size, self.batch_size), dtype=np.int32),
+            np.empty((decoder_size, self.batch_size), dtype=np.int32),
+            np.empty((decoder_size, self.batch_size), dtype=np.float32))
+      out = self._batch_buffers[key]
+    return self._pad_batch(pairs, bucket_id, out)
+
+  def prepare_batch(self, pairs, bucket_id):
+    """Prepare the given (input, output) pairs for step(..) as one batch.
+
+    Args:
+      pairs: list of self.batch_size pairs of input and output data that fit
+        into the bucket; the output may be empty when decoding.
+      bucket_id: integer, which bucket the batch is for.
+
+    Returns:
+      The triple (encoder_inputs, decoder_inputs, target_weights), as in
+      get_batch; the n-th batch entry comes from pairs[n].
+    """
+    return self._pad_batch(pairs, bucket_id, None)
+
+  def _pad_batch(self, pairs, bucket_id, out):
+    """Pad (input, output) pairs into time-major matrices as step(..) inputs.
+
+    Encoder inputs are padded and then reversed, decoder inputs get an extra
+    "GO" symbol and are padded then; column n holds pairs[n]. The matrices
+    are the triple out kept by get_batch, or new ones if out is None.
+    """
     encoder_size, decoder_size = self.buckets[bucket_id]
-    encoder_inputs, decoder_inputs = [], []
-
-    # Get a random batch of encoder and decoder inputs from data,
-    # pad them if needed, reverse encoder inputs and add GO to decoder.
-    for _ in xrange(self.batch_size):
-      encoder_input, decoder_input = random.choice(data[bucket_id])
-
-      # Encoder inputs are padded and then reversed.
-      encoder_pad = [data_utils.PAD_ID] * (encoder_size - len(encoder_input))
-      encoder_inputs.append(list(reversed(encoder_input + encoder_pad)))
-
-      # Decoder inputs get an extra "GO" symbol, and are padded then.
-      decoder_pad_size = decoder_size - len(decoder_input) - 1
-      decoder_inputs.append([data_utils.GO_ID] + decoder_input +
-                            [data_utils.PAD_ID] * decoder_pad_size)
-
-    # Now we create batch-major vectors from the data selected above.
-    batch_encoder_inputs, batch_decoder_inputs, batch_weights = [], [], []
-
-    # Batch encoder inputs are just re-indexed encoder_inputs.
-    for length_idx in xrange(encoder_size):
-      batch_encoder_inputs.append(
-          np.array([encoder_inputs[batch_idx][length_idx]
-                    for batch_idx in xrange(self.batch_size)], dtype=np.int32))
-
-    # Batch decoder inputs are re-indexed decoder_inputs, we create weights.
-    for length_idx in xrange(decoder_size):
-      batch_decoder_inputs.append(
-          np.array([decoder_inputs[batch_idx][length_idx]
-                    for batch_idx in xrange(self.batch_size)], dtype=np.int32))
-
-      # Create target_weights to be 0 for targets that are padding.
-      batch_weight = np.ones(self.batch_size, dtype=np.float32)
-      for batch_idx in xrange(self.batch_size):
-        # We set weight to 0 if the corresponding target is a PAD symbol.
-        # The corresponding target is decoder_input shifted by 1 forward.
-        if length_idx < decoder_size - 1:
-          target = decoder_inputs[batch_idx][length_idx + 1]
-        if length_idx == decoder_size - 1 or target == data_utils.PAD_ID:
-          batch_weight[batch_idx] = 0.0
-      batch_weights.append(batch_weight)
-    return batch_encoder_inputs, batch_decoder_inputs, batch_weights
+    if out is None:
+      out = (np.empty((encoder_size, len(pairs)), dtype=np.int32),
+             np.empty((decoder_size, len(pairs)), dtype=np.int32),
+             np.empty((decoder_size, len(pairs)), dtype=np.float32))
+    batch_encoder, batch_decoder, batch_weights = out
+    batch_encoder.fill(data_utils.PAD_ID)
+    batch_decoder.fill(data_utils.PAD_ID)
+    batch_decoder[0] = data_utils.GO_ID
+    for n, (encoder_input, decoder_input) in enumerate(pairs):
+      if encoder_input:
+        batch_encoder[encoder_size - len(encoder_input):, n] = \
+            encoder_input[::-1]
+      batch_decoder[1:len(decoder_input) + 1, n] = decoder_input
+    # Create target_weights to be 0 for targets that are padding.
+    # The corresponding target is decoder_input shifted by 1 forward.
+    np.not_equal(batch_decoder[1:], data_utils.PAD_ID, out=batch_weights[:-1])
+    batch_weights[-1] = 0.0
+    # Rows of the time-major matrices are the batch-major vectors.
+    return list(batch_encoder), list(batch_decoder), list(batch_weights)
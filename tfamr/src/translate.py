@@ -35,15 +35,19 @@ import math
 import os
 import random
 import sys
+import threading
 import time
 
 import tensorflow.python.platform
 
 import numpy as np
+from six.moves import queue
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
 
+import checkpoints
 import data_utils
+import profiling
 import seq2seq_model
 #from tensorflow.models.rnn.translate import seq2seq_model
 from tensorflow.python.platform import gfile
@@ -67,14 +71,44 @@ tf.app.flags.DEFINE_string("train_dir", "../models", "Training directory.")
 tf.app.flags.DEFINE_string("amrseq_version", "1.1", "amr sequence version")
 tf.app.flags.DEFINE_integer("max_train_data_size", 0,
                             "Limit on the size of training data (0: no limit).")
+tf.app.flags.DEFINE_boolean("binary_corpus", False,
+                            "Convert the token-id files once into a binary "
+                            "corpus and memory-map it instead of parsing them.")
 tf.app.flags.DEFINE_integer("steps_per_checkpoint", 200,
                             "How many training steps to do per checkpoint.")
+tf.app.flags.DEFINE_integer("num_buckets", 0,
+                            "If positive, split the largest bucket into this "
+                            "many buckets sized from the lengths of the "
+                            "training data to minimize padding; the largest "
+                            "bucket is kept for longer pairs.")
+tf.app.flags.DEFINE_boolean("async_checkpoints", True,
+                            "Write checkpoints on a background thread.")
+tf.app.flags.DEFINE_integer("keep_checkpoints", 5,
+                            "Number of checkpoints to keep; with --early_stop "
+                            "these are the ones with the best dev perplexity.")
+tf.app.flags.DEFINE_string("profile_log", "",
+                           "Append the step-time breakdown of every checkpoint "
+                           "interval to this JSONL file.")
+tf.app.flags.DEFINE_integer("trace_steps", 0,
+                            "If positive, write a TensorFlow timeline trace of "
+                            "every this many steps to --train_dir.")
 tf.app.flags.DEFINE_integer("max_steps", 30000,
                             "maximum of global steps (batches) to run.")
 tf.app.flags.DEFINE_boolean("decode", False,
                             "Set to True for interactive decoding.")
 tf.app.flags.DEFINE_boolean("early_stop", False,
                             "Train with early stopping.")
+tf.app.flags.DEFINE_integer("eval_batch_size", 64,
+                            "Batch size for evaluating the development set.")
+tf.app.flags.DEFINE_boolean("eval_in_background", False,
+                            "With --early_stop, evaluate saved checkpoints in "
+                            "a separate thread while training goes on.")
+tf.app.flags.DEFINE_string("decode_input", "",
+                           "With --decode, decode this token file in batches "
+                           "of --batch_size instead of reading standard input.")
+tf.app.flags.DEFINE_string("decode_output", "",
+                           "File to write the --decode_input outputs to, one "
+                           "per line in input order (default: standard output).")
 tf.app.flags.DEFINE_boolean("self_test", False,
                             "Run a self-test if this is set to True.")
 
@@ -102,12 +136,18 @@ def read_data(source_path, target_path, max_size=None):
       (source, target) pairs read from the provided data files that fit
       into the n-th bucket, i.e., such that len(source) < _buckets[n][0] and
       len(target) < _buckets[n][1]; source and target are lists of token-ids.
+      With --binary_corpus, data_set[n] is a data_utils.CorpusBucket that
+      reads the pairs from the memory-mapped corpus instead.
   """
+  if FLAGS.binary_corpus:
+    corpus_path = "%s.%s.corpus" % (source_path, os.path.basename(target_path))
+    data_utils.ids_to_corpus(source_path, target_path, corpus_path, _buckets)
+    return data_utils.load_corpus(corpus_path, _buckets, max_size)
   data_set = [[] for _ in _buckets]
   with gfile.GFile(source_path, mode="r") as source_file:
     with gfile.GFile(target_path, mode="r") as target_file:
       source, target = source_file.readline(), target_file.readline()
-      counter = 0
+      counter, dropped = 0, 0
       while source and target and (not max_size or counter < max_size):
         counter += 1
         if counter % 100000 == 0:
@@ -120,10 +160,166 @@ def read_data(source_path, target_path, max_size=None):
           if len(source_ids) < source_size and len(target_ids) < target_size:
             data_set[bucket_id].append([source_ids, target_ids])
             break
+        else:
+          dropped += 1
         source, target = source_file.readline(), target_file.readline()
+  if dropped:
+    print("  dropped %d of %d pairs of %s that do not fit into bucket %s"
+          % (dropped, counter, source_path, _buckets[-1]))
+    sys.stdout.flush()
   return data_set
 
 
+def compute_buckets(source_path, target_path, num_buckets, max_size=None):
+  """Compute buckets that minimize padding for the given training data.
+
+  Pairs are grouped by source length into at most num_buckets ranges, chosen
+  by dynamic programming over the length histogram so that the total number
+  of encoder and decoder PAD_ID positions is smallest. Pairs that do not fit
+  into the largest bucket of _buckets are ignored, as read_data does.
+
+  The largest bucket of _buckets is kept as the last bucket when the training
+  data does not fill it, so that longer dev and test pairs still fit in.
+
+  Args:
+    source_path: path to the files with token-ids for the source language.
+    target_path: path to the file with token-ids for the target language.
+    num_buckets: maximum number of buckets.
+    max_size: maximum number of lines to read, as in read_data.
+
+  Returns:
+    A list of (source_size, target_size) pairs, ordered by source size; the
+    last bucket is the largest bucket of _buckets, or a bucket of the same
+    size, as Seq2SeqModel requires it to be the biggest one in both sizes.
+  """
+  max_source_size, max_target_size = _buckets[-1]
+  # count, total source length, total target length and maximum target length
+  # of the pairs with each source length.
+  histogram = {}
+  with gfile.GFile(source_path, mode="r") as source_file:
+    with gfile.GFile(target_path, mode="r") as target_file:
+      counter = 0
+      for source, target in zip(source_file, target_file):
+        if max_size and counter >= max_size:
+          break
+        counter += 1
+        # The target gets an EOS_ID, as in read_data.
+        source_len, target_len = len(source.split()), len(target.split()) + 1
+        if source_len >= max_source_size or target_len >= max_target_size:
+          continue
+        stats = histogram.setdefault(source_len, [0, 0, 0, 0])
+        stats[0] += 1
+        stats[1] += source_len
+        stats[2] += target_len
+        stats[3] = max(stats[3], target_len)
+  if not histogram:
+    return list(_buckets)
+
+  lengths = sorted(histogram)
+  n = len(lengths)
+
+  def group_cost(first, last):
+    # Padding of the pairs with source lengths lengths[first..last] in the
+    # bucket (lengths[last] + 1, longest target + 1).
+    count = source_total = target_total = target_max = 0
+    for length in lengths[first:last + 1]:
+      stats = histogram[length]
+      count += stats[0]
+      source_total += stats[1]
+      target_total += stats[2]
+      target_max = max(target_max, stats[3])
+    return (count * (lengths[last] + 1) - source_total +
+            count * (target_max + 1) - target_total), target_max + 1
+
+  # best[k][j]: smallest padding of the first j source lengths in k buckets.
+  inf = float("inf")
+  best = [[inf] * (n + 1) for _ in xrange(num_buckets + 1)]
+  split = [[0] * (n + 1) for _ in xrange(num_buckets + 1)]
+  best[0][0] = 0
+  costs = {}
+  for j in xrange(1, n + 1):
+    for i in xrange(j):
+      costs[i, j] = group_cost(i, j - 1)
+  for k in xrange(1, num_buckets + 1):
+    for j in xrange(1, n + 1):
+      for i in xrange(j):
+        cost = best[k - 1][i] + costs[i, j][0]
+        if cost < best[k][j]:
+          best[k][j], split[k][j] = cost, i
+  k = min(xrange(1, num_buckets + 1), key=lambda k: best[k][n])
+
+  buckets = []
+  j = n
+  while k > 0:
+    i = split[k][j]
+    buckets.append((lengths[j - 1] + 1, costs[i, j][1]))
+    j, k = i, k - 1
+  buckets.reverse()
+  # Seq2SeqModel builds its inputs for the last bucket, so it must be the
+  # biggest one in both sizes; keeping the old largest bucket also leaves room
+  # for dev and test pairs longer than any training pair.
+  if buckets[-1][0] < max_source_size:
+    buckets.append((max_source_size, max_target_size))
+  else:
+    buckets[-1] = (max_source_size, max_target_size)
+  return buckets
+
+
+def report_padding(data_set):
+  """Print how many encoder and decoder positions of each bucket are not PAD_ID.
+
+  Args:
+    data_set: bucketed (source, target) pairs, as returned by read_data.
+  """
+  total_tokens, total_size = 0, 0
+  for bucket_id, (source_size, target_size) in enumerate(_buckets):
+    # Decoder inputs are GO_ID followed by the target.
+    tokens = sum(len(source) + len(target) + 1
+                 for source, target in data_set[bucket_id])
+    size = len(data_set[bucket_id]) * (source_size + target_size)
+    print("  bucket %d (%d, %d): %d pairs, padding efficiency %.2f"
+          % (bucket_id, source_size, target_size, len(data_set[bucket_id]),
+             tokens / size if size else 0.0))
+    total_tokens += tokens
+    total_size += size
+  print("  total padding efficiency %.2f"
+        % (total_tokens / total_size if total_size else 0.0))
+  sys.stdout.flush()
+
+
+class SyncCheckpointWriter(object):
+  """Write checkpoints with model.saver in the training loop.
+
+  The fallback of checkpoints.CheckpointWriter for --noasync_checkpoints.
+  """
+
+  def __init__(self, session, saver):
+    self.session = session
+    self.saver = saver
+
+  def save(self, checkpoint_path, global_step, callback=None):
+    start_time = time.time()
+    path = self.saver.save(self.session, checkpoint_path,
+                           global_step=global_step)
+    print("  checkpoint %s: write %.2fs" % (path, time.time() - start_time))
+    if callback is not None:
+      callback(path)
+    return time.time() - start_time
+
+  def close(self):
+    pass
+
+
+def create_checkpoint_writer(session, model):
+  """Create the checkpoint writer selected by --async_checkpoints."""
+  if FLAGS.async_checkpoints:
+    return checkpoints.CheckpointWriter(session,
+                                        max_to_keep=FLAGS.keep_checkpoints)
+  return SyncCheckpointWriter(
+      session, tf.train.Saver(tf.all_variables(),
+                              max_to_keep=FLAGS.keep_checkpoints))
+
+
 def create_model(session, forward_only):
   """Create translation model and initialize or load parameters in session."""
   model = seq2seq_model.Seq2SeqModel(
@@ -141,12 +337,166 @@ def create_model(session, forward_only):
   return model
 
 
+def token_loss(outputs, decoder_inputs, target_weights, projection=None):
+  """Sum the negative log-likelihood of the target tokens of one batch.
+
+  Args:
+    outputs: the outputs of model.step(..) with forward_only set.
+    decoder_inputs, target_weights: the batch fed to model.step(..).
+    projection: values of the model's output projection (w, b), if its
+      outputs are not logits yet; a model built with forward_only projects
+      its outputs itself.
+
+  Returns:
+    A pair of the summed full-softmax loss of the targets with non-zero
+    weight, and their number.
+  """
+  loss, tokens = 0.0, 0.0
+  # Our targets are decoder inputs shifted by one.
+  for length_idx in xrange(len(decoder_inputs) - 1):
+    weights = target_weights[length_idx]
+    if not weights.any():
+      continue
+    logits = outputs[length_idx]
+    if projection is not None:
+      logits = np.dot(logits, projection[0]) + projection[1]
+    logits = logits - logits.max(axis=1, keepdims=True)
+    targets = decoder_inputs[length_idx + 1]
+    log_probs = (logits[np.arange(len(targets)), targets] -
+                 np.log(np.exp(logits).sum(axis=1)))
+    loss -= np.dot(log_probs, weights)
+    tokens += weights.sum()
+  return loss, tokens
+
+
+def evaluate(session, model, data_set):
+  """Evaluate every pair of data_set exactly once, in fixed-size chunks.
+
+  Args:
+    session: tensorflow session to use.
+    model: the Seq2SeqModel to evaluate.
+    data_set: bucketed (source, target) pairs, as returned by read_data.
+
+  Returns:
+    The token-weighted perplexity of the whole data set.
+  """
+  tmp_batch_size = model.batch_size
+  projection = None
+  if model.output_projection is not None and not model.forward_only:
+    projection = session.run(list(model.output_projection))
+  total_loss, total_tokens = 0.0, 0.0
+  for bucket_id in xrange(len(_buckets)):
+    pairs = data_set[bucket_id]
+    if len(pairs) == 0:
+      print("  eval: empty bucket %d" % (bucket_id))
+      continue
+    bucket_loss, bucket_tokens = 0.0, 0.0
+    for start in xrange(0, len(pairs), FLAGS.eval_batch_size):
+      chunk = [pairs[i] for i in
+               xrange(start, min(start + FLAGS.eval_batch_size, len(pairs)))]
+      model.batch_size = len(chunk)
+      encoder_inputs, decoder_inputs, target_weights = model.prepare_batch(
+          chunk, bucket_id)
+      _, _, outputs = model.step(session, encoder_inputs, decoder_inputs,
+                                 target_weights, bucket_id, True)
+      loss, tokens = token_loss(outputs, decoder_inputs, target_weights,
+                                projection)
+      bucket_loss += loss
+      bucket_tokens += tokens
+    eval_loss = bucket_loss / max(bucket_tokens, 1.0)
+    eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
+    print("  eval: bucket %d size:%d tokens:%d perplexity %.2f"
+          % (bucket_id, len(pairs), bucket_tokens, eval_ppx))
+    total_loss += bucket_loss
+    total_tokens += bucket_tokens
+  model.batch_size = tmp_batch_size
+  total_loss /= max(total_tokens, 1.0)
+  return math.exp(total_loss) if total_loss < 300 else float('inf')
+
+
+class BackgroundEvaluator(object):
+  """Evaluate saved checkpoints on the development set in a separate thread.
+
+  The thread has its own graph and session, so training goes on while it
+  evaluates. It always takes the newest submitted checkpoint, skipping older
+  ones that are still waiting, and saves every improvement on the best
+  perplexity so far as translate.ckpt in FLAGS.train_dir, where decoding
+  looks for it.
+  """
+
+  def __init__(self, dev_set):
+    self.dev_set = dev_set
+    self.best_ppx = float('inf')
+    self._jobs = queue.Queue()
+    self._results = queue.Queue()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, checkpoint_path, step):
+    """Queue the checkpoint saved at global step for evaluation."""
+    self._jobs.put((checkpoint_path, step))
+
+  def results(self):
+    """Return the (global step, perplexity) pairs evaluated since last call."""
+    results = []
+    while True:
+      try:
+        results.append(self._results.get_nowait())
+      except queue.Empty:
+        return results
+
+  def close(self):
+    """Evaluate the newest waiting checkpoint, stop the thread, get results."""
+    self._jobs.put(None)
+    self._thread.join()
+    return self.results()
+
+  def _run(self):
+    with tf.Graph().as_default(), tf.Session() as sess:
+      # No dropout or backward pass while evaluating, but the decoder is fed
+      # the targets as in training.
+      model = seq2seq_model.Seq2SeqModel(
+          FLAGS.en_vocab_size, FLAGS.fr_vocab_size, _buckets,
+          FLAGS.size, FLAGS.num_layers, FLAGS.max_gradient_norm,
+          FLAGS.eval_batch_size, FLAGS.learning_rate,
+          FLAGS.learning_rate_decay_factor, forward_only=True, keep_prob=1.0,
+          feed_previous=False)
+      # Only improvements are saved, so the kept checkpoints are the best.
+      saver = tf.train.Saver(tf.all_variables(),
+                             max_to_keep=FLAGS.keep_checkpoints)
+      done = False
+      while not done:
+        jobs = [self._jobs.get()]
+        while not self._jobs.empty():
+          jobs.append(self._jobs.get())
+        done = None in jobs
+        jobs = [job for job in jobs if job is not None]
+        if not jobs:
+          continue
+        checkpoint_path, step = jobs[-1]
+        model.saver.restore(sess, checkpoint_path)
+        print("  eval: checkpoint of global step %d" % step)
+        eval_ppx = evaluate(sess, model, self.dev_set)
+        if eval_ppx < self.best_ppx:
+          self.best_ppx = eval_ppx
+          saver.save(sess, os.path.join(FLAGS.train_dir, "translate.ckpt"),
+                     global_step=step)
+        self._results.put((step, eval_ppx))
+        sys.stdout.flush()
+
+
 def train():
   """Train a en->fr translation model using WMT data."""
+  global _buckets
   # Prepare WMT data.
   print("Preparing WMT data in %s" % FLAGS.data_dir)
   en_train, fr_train, en_dev, fr_dev, _, _ = data_utils.prepare_wmt_data(
       FLAGS.data_dir, FLAGS.en_vocab_size, FLAGS.fr_vocab_size, FLAGS.amrseq_version)
+  if FLAGS.num_buckets > 0:
+    _buckets = compute_buckets(en_train, fr_train, FLAGS.num_buckets,
+                               FLAGS.max_train_data_size)
+    print("Using buckets %s" % (_buckets,))
 
   with tf.Session() as sess:
     # Create model.
@@ -158,6 +508,8 @@ def train():
            % FLAGS.max_train_data_size)
     #dev_set = read_data(en_dev, fr_dev)
     train_set = read_data(en_train, fr_train, FLAGS.max_train_data_size)
+    print("Training data padding:")
+    report_padding(train_set)
     train_bucket_sizes = [len(train_set[b]) for b in xrange(len(_buckets))]
     train_total_size = float(sum(train_bucket_sizes))
 
@@ -171,6 +523,9 @@ def train():
     step_time, loss = 0.0, 0.0
     current_step = 0
     previous_losses = []
+    writer = create_checkpoint_writer(sess, model)
+    profiler = profiling.TrainingProfiler(FLAGS.profile_log, FLAGS.trace_steps,
+                                          FLAGS.train_dir)
     #while True:
     for _ in range(FLAGS.max_steps):
       # Choose a bucket according to data distribution. We pick a random number
@@ -181,10 +536,13 @@ def train():
 
       # Get a batch and make a step.
       start_time = time.time()
-      encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-          train_set, bucket_id)
+      with profiler.phase("get_batch"):
+        encoder_inputs, decoder_inputs, target_weights = model.get_batch(
+            train_set, bucket_id, reuse_buffer=True)
+      profiler.record_batch(bucket_id, encoder_inputs, target_weights)
       _, step_loss, _ = model.step(sess, encoder_inputs, decoder_inputs,
-                                   target_weights, bucket_id, False)
+                                   target_weights, bucket_id, False,
+                                   profiler=profiler)
       step_time += (time.time() - start_time) / FLAGS.steps_per_checkpoint
       loss += step_loss / FLAGS.steps_per_checkpoint
       current_step += 1
@@ -202,27 +560,36 @@ def train():
         previous_losses.append(loss)
         # Save checkpoint and zero timer and loss.
         checkpoint_path = os.path.join(FLAGS.train_dir, "translate.ckpt")
-        model.saver.save(sess, checkpoint_path, global_step=model.global_step)
+        profiler.add("checkpoint",
+                     writer.save(checkpoint_path, model.global_step.eval()))
+        profiler.report(model.global_step.eval(), perplexity=perplexity,
+                        step_time=step_time)
         step_time, loss = 0.0, 0.0
         # Run evals on development set and print their perplexity.
         '''
         for bucket_id in xrange(len(_buckets)):
           encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-              dev_set, bucket_id)
+              dev_set, bucket_id, reuse_buffer=True)
           _, eval_loss, _ = model.step(sess, encoder_inputs, decoder_inputs,
                                        target_weights, bucket_id, True)
           eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
           print("  eval: bucket %d perplexity %.2f" % (bucket_id, eval_ppx))
         sys.stdout.flush()
         '''
+    writer.close()
 
 
 def train_early_stop():
   """Train a en->fr translation model using AMR data with early stopping."""
+  global _buckets
   # Prepare data.
   print("Preparing WMT data in %s" % FLAGS.data_dir)
   en_train, fr_train, en_dev, fr_dev, _, _ = data_utils.prepare_wmt_data(
       FLAGS.data_dir, FLAGS.en_vocab_size, FLAGS.fr_vocab_size, FLAGS.amrseq_version)
+  if FLAGS.num_buckets > 0:
+    _buckets = compute_buckets(en_train, fr_train, FLAGS.num_buckets,
+                               FLAGS.max_train_data_size)
+    print("Using buckets %s" % (_buckets,))
 
   with tf.Session() as sess:
     # Create model.
@@ -234,6 +601,8 @@ def train_early_stop():
            % FLAGS.max_train_data_size)
     dev_set = read_data(en_dev, fr_dev)
     train_set = read_data(en_train, fr_train, FLAGS.max_train_data_size)
+    print("Training data padding:")
+    report_padding(train_set)
     train_bucket_sizes = [len(train_set[b]) for b in xrange(len(_buckets))]
     train_total_size = float(sum(train_bucket_sizes))
 
@@ -251,10 +620,17 @@ def train_early_stop():
     done_looping = False
     improvement_threshold = 0.995
 
-    best_eval_total_ppx = np.inf
+    best_eval_ppx = np.inf
     best_step = 0
     patience = int(train_total_size / FLAGS.batch_size) # go over this number of steps(batches) anyway
     patience_increase = 2
+
+    evaluator = None
+    if FLAGS.eval_in_background:
+      evaluator = BackgroundEvaluator(dev_set)
+    writer = create_checkpoint_writer(sess, model)
+    profiler = profiling.TrainingProfiler(FLAGS.profile_log, FLAGS.trace_steps,
+                                          FLAGS.train_dir)
     
     while model.global_step.eval() < FLAGS.max_steps and (not done_looping):
 
@@ -266,10 +642,13 @@ def train_early_stop():
 
       # Get a batch and make a step.
       start_time = time.time()
-      encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-          train_set, bucket_id)
+      with profiler.phase("get_batch"):
+        encoder_inputs, decoder_inputs, target_weights = model.get_batch(
+            train_set, bucket_id, reuse_buffer=True)
+      profiler.record_batch(bucket_id, encoder_inputs, target_weights)
       _, step_loss, _ = model.step(sess, encoder_inputs, decoder_inputs,
-                                   target_weights, bucket_id, False)
+                                   target_weights, bucket_id, False,
+                                   profiler=profiler)
       step_time += (time.time() - start_time) / FLAGS.steps_per_checkpoint
       loss += step_loss / FLAGS.steps_per_checkpoint
       current_step += 1
@@ -290,36 +669,52 @@ def train_early_stop():
         # Save checkpoint and zero timer and loss.
         #checkpoint_path = os.path.join(FLAGS.train_dir, "translate.ckpt")
         #model.saver.save(sess, checkpoint_path, global_step=model.global_step)
+        train_step_time = step_time
         step_time, loss = 0.0, 0.0
         
         # Run evals on development set and print their perplexity.
-        eval_total_ppx = 0.0 # total perplexity in all validation buckets
-        tmp_batch_size = model.batch_size
-        for bucket_id in xrange(len(_buckets)):
-          model.batch_size = len(dev_set[bucket_id]) # eval the whole bucket 
-          encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-              dev_set, bucket_id)
-          _, eval_loss, _ = model.step(sess, encoder_inputs, decoder_inputs,
-                                       target_weights, bucket_id, True)
-          eval_ppx = math.exp(eval_loss) if eval_loss < 300 else float('inf')
-          eval_total_ppx += eval_ppx
-          print("  eval: bucket %d size:%d perplexity %.2f" % (bucket_id, model.batch_size, eval_ppx))
-        model.batch_size = tmp_batch_size
-        if eval_total_ppx < best_eval_total_ppx:
-          if (eval_total_ppx < best_eval_total_ppx * improvement_threshold): # the improvement is good enough
-            patience = max(patience, model.global_step.eval() * patience_increase)
-          best_eval_total_ppx = eval_total_ppx
-          best_step = model.global_step.eval()
-
-          # save the current checkpoint
-          checkpoint_path = os.path.join(FLAGS.train_dir, "translate.ckpt")
-          model.saver.save(sess, checkpoint_path, global_step=model.global_step)
-
+        eval_ppx = None
+        if evaluator is None:
+          with profiler.phase("eval"):
+            eval_ppx = evaluate(sess, model, dev_set)
+          print("  eval: perplexity %.2f" % eval_ppx)
+          results = [(model.global_step.eval(), eval_ppx)]
+        else:
+          # the evaluator saves the best checkpoint itself
+          checkpoint_path = os.path.join(FLAGS.train_dir, "eval", "translate.ckpt")
+          if not os.path.isdir(os.path.dirname(checkpoint_path)):
+            os.makedirs(os.path.dirname(checkpoint_path))
+          step = model.global_step.eval()
+          profiler.add("checkpoint", writer.save(
+              checkpoint_path, step,
+              callback=lambda path, step=step: evaluator.submit(path, step)))
+          results = evaluator.results()
+        for eval_step, eval_ppx in results:
+          if eval_ppx < best_eval_ppx:
+            if (eval_ppx < best_eval_ppx * improvement_threshold): # the improvement is good enough
+              patience = max(patience, eval_step * patience_increase)
+            best_eval_ppx = eval_ppx
+            best_step = eval_step
+
+            if evaluator is None:
+              # save the current checkpoint
+              checkpoint_path = os.path.join(FLAGS.train_dir, "translate.ckpt")
+              profiler.add("checkpoint", writer.save(checkpoint_path, eval_step))
+
+        profiler.report(model.global_step.eval(), perplexity=perplexity,
+                        step_time=train_step_time, eval_perplexity=eval_ppx)
         if patience <= model.global_step.eval():
           done_looping = True
         sys.stdout.flush()
 
-    print("Optimization complete. Best total validation perplexity %f obtained at global step %d." % (best_eval_total_ppx, best_step))
+    writer.close()
+    if evaluator is not None:
+      for eval_step, eval_ppx in evaluator.close():
+        if eval_ppx < best_eval_ppx:
+          best_eval_ppx = eval_ppx
+          best_step = eval_step
+
+    print("Optimization complete. Best validation perplexity %f obtained at global step %d." % (best_eval_ppx, best_step))
 
 def decode():
   with tf.Session() as sess:
@@ -348,8 +743,8 @@ def decode():
       bucket_id = min([b for b in xrange(len(_buckets))
                        if _buckets[b][0] > len(token_ids)])
       # Get a 1-element batch to feed the sentence to the model.
-      encoder_inputs, decoder_inputs, target_weights = model.get_batch(
-          {bucket_id: [(token_ids, [])]}, bucket_id)
+      encoder_inputs, decoder_inputs, target_weights = model.prepare_batch(
+          [(token_ids, [])], bucket_id)
       # Get output logits for the sentence.
       _, _, output_logits = model.step(sess, encoder_inputs, decoder_inputs,
                                        target_weights, bucket_id, True)
@@ -367,6 +762,85 @@ def decode():
       sentence = sys.stdin.readline()
 
 
+def make_decode_batches(token_ids_list, batch_size):
+  """Group sentences into decoding batches by bucket and length.
+
+  Args:
+    token_ids_list: list of token-id lists, one per input sentence; each must
+      fit into the largest bucket.
+    batch_size: maximum number of sentences in a batch.
+
+  Returns:
+    A list of (bucket_id, indices) pairs; indices are positions in
+    token_ids_list of sentences of similar length that fit into bucket_id.
+  """
+  bucket_ids = [min([b for b in xrange(len(_buckets))
+                     if _buckets[b][0] > len(token_ids)])
+                for token_ids in token_ids_list]
+  order = sorted(xrange(len(token_ids_list)),
+                 key=lambda i: (bucket_ids[i], len(token_ids_list[i])))
+  batches = []
+  for i in order:
+    if (batches and batches[-1][0] == bucket_ids[i] and
+        len(batches[-1][1]) < batch_size):
+      batches[-1][1].append(i)
+    else:
+      batches.append((bucket_ids[i], [i]))
+  return batches
+
+
+def decode_file():
+  """Decode FLAGS.decode_input in batches and write outputs in input order."""
+  with tf.Session() as sess:
+    # Create model and load parameters.
+    model = create_model(sess, True)
+
+    # Load vocabularies.
+    en_vocab_path = os.path.join(FLAGS.data_dir,
+                                 "vocab%d.en" % FLAGS.en_vocab_size)
+    amr_vocab_path = os.path.join(FLAGS.data_dir,
+                                 "vocab%d.amr" % FLAGS.fr_vocab_size)
+    en_vocab, _ = data_utils.initialize_vocabulary(en_vocab_path)
+    _, rev_fr_vocab = data_utils.initialize_vocabulary(amr_vocab_path)
+
+    # Get token-ids for all input sentences, truncated to the largest bucket.
+    token_ids_list = []
+    with gfile.GFile(FLAGS.decode_input, mode="r") as input_file:
+      for sentence in input_file:
+        token_ids = data_utils.sentence_to_token_ids(sentence, en_vocab, normalize_digits=True)
+        token_ids_list.append(token_ids[:_buckets[-1][0] - 1])
+
+    results = [None] * len(token_ids_list)
+    start_time = time.time()
+    for bucket_id, indices in make_decode_batches(token_ids_list,
+                                                  FLAGS.batch_size):
+      model.batch_size = len(indices)
+      encoder_inputs, decoder_inputs, target_weights = model.prepare_batch(
+          [(token_ids_list[i], []) for i in indices], bucket_id)
+      _, _, output_logits = model.step(sess, encoder_inputs, decoder_inputs,
+                                       target_weights, bucket_id, True)
+      # This is a greedy decoder - outputs are just argmaxes of output_logits,
+      # one column per sentence in the batch.
+      best_ids = np.argmax(np.array(output_logits), axis=2)
+      for n, i in enumerate(indices):
+        outputs = [int(output) for output in best_ids[:, n]]
+        # If there is an EOS symbol in outputs, cut them at that point.
+        if data_utils.EOS_ID in outputs:
+          outputs = outputs[:outputs.index(data_utils.EOS_ID)]
+        results[i] = " ".join([rev_fr_vocab[output] for output in outputs])
+    print("Decoded %d sentences in %.2f seconds." %
+          (len(results), time.time() - start_time), file=sys.stderr)
+
+    if FLAGS.decode_output:
+      output_file = gfile.GFile(FLAGS.decode_output, mode="w")
+    else:
+      output_file = sys.stdout
+    for result in results:
+      output_file.write(result + "\n")
+    if FLAGS.decode_output:
+      output_file.close()
+
+
 def self_test():
   """Test the translation model."""
   with tf.Session() as sess:
@@ -390,6 +864,8 @@ def self_test():
 def main(_):
   if FLAGS.self_test:
     self_test()
+  elif FLAGS.decode and FLAGS.decode_input:
+    decode_file()
   elif FLAGS.decode:
     decode()
   elif FLAGS.early_stop: